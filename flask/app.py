@@ -6,6 +6,8 @@ import uuid
 import time
 import traceback
 import logging
+import threading
+import tempfile
 from datetime import datetime
 from flask import Flask, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
@@ -13,7 +15,6 @@ from flask_cors import CORS
 import numpy as np
 import re
 from urllib.parse import quote
-from PyPDF2 import PdfReader
 import openai
     
 
@@ -31,20 +32,39 @@ load_dotenv()
 # Load our modules
 from config import (
     DEBUG, SECRET_KEY, UPLOAD_FOLDER, PDF_FOLDER, AUDIO_FOLDER,
-    ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH
+    ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH, SEARCH_MODES, DEFAULT_SEARCH_MODE, FUSION_METHODS, HYBRID_FUSION,
+    WARM_UP_ON_START, VECTOR_SHARD_BY_SESSION, RERANKER, MMR_LAMBDA, MMR_MAX_PER_DOCUMENT,
+    WHISPER_MAX_FILE_SIZE
 )
 from models.cohere_client import CohereClient
 from models.document_processor import DocumentProcessor
+from models.reranker import LocalReranker
 from models.audio_processor import AudioProcessor
 from utils.session_manager import SessionManager
 from models.gemini_client import GeminiClient
+from models.bm25_index import BM25Index
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-from models.vector_store import query_database, connect_to_vstore, add_documents_to_vstore, get_documents_by_ids, ask_llm
+from models.vector_store import query_database, connect_to_vstore, add_documents_to_vstore, get_documents_by_ids, ask_llm, VectorStore
+from models.vector_store import warm_up, health_probe
+from models.sharded_vector_store import ShardedVectorStore
+from utils.embedding_cache import get_embedding_cache, get_query_embedding_cache
+from utils.rerank_cache import get_rerank_score_cache
+from utils.retrieval_cache import get_retrieval_cache, retrieval_cache_key
+from utils.pdf_extraction import extract_text_from_pdf, start_workers
+from utils.extraction_cache import get_extraction_cache
+from utils.upload_stream import StreamingRequest, save_upload, discard_spools, get_upload_index
+from utils.resumable_upload import ResumableUploadManager, UploadError
+from utils.audio_utils import split_wav
+from process_pdf_to_vectors import process_pdf_to_vector_store
+
+# Fork the PDF extraction workers while this process is still single-threaded
+start_workers()
 
 # Create Flask app
 app = Flask(__name__, static_folder='static')
+app.request_class = StreamingRequest  # Uploads are hashed while received and written once
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
@@ -69,9 +89,96 @@ CORS(app)
 
 # Initialize clients and managers
 cohere_client = CohereClient()
-document_processor = DocumentProcessor(cohere_client)
+document_processor = DocumentProcessor(
+    cohere_client,
+    reranker=LocalReranker(score_cache=get_rerank_score_cache()) if RERANKER == 'local' else None
+)
 audio_processor = AudioProcessor()
-session_manager = SessionManager(session_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions'))
+
+def free_session_documents(session_id):
+    """Delete the indexed documents of an expired session"""
+    if not vector_store:
+        return
+    document_ids = vector_store.delete_session_documents(session_id)
+    for document_id in document_ids:
+        text_index.remove_document(document_id)
+    if document_ids:
+        text_index.save()
+
+session_manager = SessionManager(
+    session_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions'),
+    on_session_expired=free_session_documents
+)
+
+# Local vector store used by the search and RAG endpoints
+try:
+    vector_store = ShardedVectorStore() if VECTOR_SHARD_BY_SESSION else VectorStore()
+    print("Vector store initialized successfully")
+except Exception as e:
+    print(f"Warning: Failed to initialize vector store: {e}")
+    vector_store = None
+
+# Load the shared embedding model in the background so the first request does not pay for it
+if WARM_UP_ON_START:
+    threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+
+# Lexical index over extracted text, used when vector search is unavailable or empty
+text_index = BM25Index(os.path.join(app.config['TEXT_FOLDER'], 'bm25_index.json'))
+
+# Large files uploaded in parts, beyond MAX_CONTENT_LENGTH
+resumable_uploads = ResumableUploadManager()
+
+def index_text_for_search(text, source_path, document_id=None, title=None, save=True):
+    """
+    Add a text to the lexical search index, one entry per paragraph.
+
+    Args:
+        text (str): Full text to index
+        source_path (str): Path of the text file the text was saved to
+        document_id (str, optional): Document the text belongs to. Defaults to the file name.
+        title (str, optional): Title returned with results
+        save (bool): Persist the index afterwards
+    """
+    file_name = os.path.basename(source_path)
+    document_id = document_id or os.path.splitext(file_name)[0]
+    title = title or os.path.splitext(file_name)[0].replace('_extracted', '')
+
+    text_index.remove_document(document_id)
+    for i, paragraph in enumerate(text.split('\n\n')):
+        if not paragraph.strip():
+            continue
+        text_index.add(
+            f"{file_name}:{i}",
+            paragraph,
+            metadata={"title": title, "content": paragraph, "chunk_index": i, "source_path": source_path},
+            document_id=document_id
+        )
+
+    if save:
+        text_index.save()
+
+def index_existing_text_files():
+    """Index extracted text files that are not in the lexical index yet"""
+    text_folder = app.config['TEXT_FOLDER']
+    indexed_sources = {meta.get('source_path') for meta in text_index.documents.values()}
+
+    added = 0
+    for file in os.listdir(text_folder):
+        text_path = os.path.join(text_folder, file)
+        if not (file.endswith('.txt') and 'extracted' in file) or text_path in indexed_sources:
+            continue
+        try:
+            with open(text_path, 'r', encoding='utf-8') as f:
+                index_text_for_search(f.read(), text_path, save=False)
+            added += 1
+        except Exception as e:
+            print(f"Error indexing {text_path}: {e}")
+
+    if added:
+        text_index.save()
+        print(f"Indexed {added} existing text files for lexical search")
+
+index_existing_text_files()
 
 # Check if COHERE_API_KEY is loaded
 if not os.environ.get('COHERE_API_KEY'):
@@ -85,6 +192,23 @@ if not os.environ.get('COHERE_API_KEY'):
 #     print(f"Warning: Failed to initialize Gemini client: {e}")
 #     gemini_client = None
 
+def extract_pages_with_gemini(pdf_path, first_page, last_page):
+    """
+    Extract PDF pages that lack a text layer with Gemini.
+
+    Fallback for extract_text_from_pdf; the client is only created when a
+    PDF actually has such pages.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        first_page (int): First page of the run (1-based)
+        last_page (int): Last page of the run (inclusive)
+
+    Returns:
+        str: Extracted text
+    """
+    return GeminiClient().extract_pdf_pages(pdf_path, first_page, last_page)
+
 def allowed_file(filename, file_type):
     """
     Check if a file has an allowed extension
@@ -112,10 +236,19 @@ def allowed_file(filename, file_type):
         # If file_type is a string, check against that type only
         return extension in ALLOWED_EXTENSIONS.get(file_type, set())
 
+@app.teardown_request
+def remove_upload_spools(exception=None):
+    """Delete spooled uploads the request did not save"""
+    discard_spools(request)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "ok", "message": "Notebook RAG API is running"})
+    return jsonify({
+        "status": "ok",
+        "message": "Notebook RAG API is running",
+        "models": health_probe()
+    })
 
 @app.route('/api/sessions', methods=['POST'])
 def create_session():
@@ -218,7 +351,7 @@ def upload_file():
             file_path = os.path.join(app.config['TEXT_FOLDER'], filename)
             file_type = 'text'
 
-        file.save(file_path)
+        file_hash = save_upload(file, file_path)
 
         # Generate a document ID
         document_id = f"doc_{uuid.uuid4().hex[:10]}"
@@ -226,9 +359,7 @@ def upload_file():
         text = ""
 
         if file_type == 'pdf':
-            reader = PdfReader(file_path)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
+            text = extract_text_from_pdf(file_path, file_hash=file_hash)
             is_added, id = add_documents_to_vstore([text])
 
         if file_type == 'text':
@@ -262,6 +393,48 @@ def upload_file():
         return jsonify({"error": str(e)}), 500
 
 
+def transcribe_audio_file(file_path_audio, file_path_text):
+    """
+    Transcribe an audio file with OpenAI's Whisper model.
+
+    WAV files over WHISPER_MAX_FILE_SIZE are split into segments under it
+    and transcribed in order, each prompted with the end of the text before.
+
+    Args:
+        file_path_audio (str): Path to the audio file
+        file_path_text (str): Path to save the transcription to
+
+    Returns:
+        str: Transcribed text
+    """
+    client = openai.OpenAI()  # Uses OPENAI_API_KEY from environment variable
+
+    def transcribe(path, prompt=None):
+        with open(path, "rb") as audio_file:
+            options = {"prompt": prompt} if prompt else {}
+            transcription = client.audio.transcriptions.create(
+                model="whisper-1",  # Free tier model
+                file=audio_file,
+                **options
+            )
+        return transcription.text
+
+    if os.path.getsize(file_path_audio) <= WHISPER_MAX_FILE_SIZE:
+        text = transcribe(file_path_audio)
+    elif file_path_audio.lower().endswith('.wav'):
+        texts = []
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(file_path_audio)) as segment_folder:
+            for segment_path in split_wav(file_path_audio, WHISPER_MAX_FILE_SIZE, segment_folder):
+                texts.append(transcribe(segment_path, prompt=texts[-1][-500:] if texts else None).strip())
+                os.remove(segment_path)
+        text = " ".join(t for t in texts if t)
+    else:
+        raise ValueError(f"Audio files over {WHISPER_MAX_FILE_SIZE // (1024 * 1024)} MB must be WAV to be transcribed")
+
+    with open(file_path_text, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return text
+
 @app.route('/api/upload-video', methods=['POST'])
 def upload_video():
     """Upload an audio file and transcribe it using OpenAI's Whisper model"""
@@ -287,26 +460,13 @@ def upload_video():
         file_path_text = os.path.join(app.config['AUDIO_FOLDER'], filename.split('.')[0] + '.txt')
         
         # Save the audio file
-        file.save(file_path_audio)
+        save_upload(file, file_path_audio)
         
         # Generate a document ID
         document_id = f"doc_{uuid.uuid4().hex[:10]}"
         
-        # Transcribe audio using OpenAI's Whisper (free tier)
-        client = openai.OpenAI()  # Uses OPENAI_API_KEY from environment variable
-        
-        with open(file_path_audio, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",  # Free tier model
-                file=audio_file
-            )
-        
-        # Get the transcribed text
-        text = transcription.text
-        
-        # Save transcription to text file
-        with open(file_path_text, 'w', encoding='utf-8') as f:
-            f.write(text)
+        # Transcribe audio and save the transcription next to it
+        text = transcribe_audio_file(file_path_audio, file_path_text)
         
         if not text:
             return jsonify({"error": "No text found in the audio"}), 400
@@ -338,6 +498,175 @@ def upload_video():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def ingest_resumable_upload(upload_id, file_path, file_hash, file_type, filename, session_id):
+    """
+    Process a completed resumable upload like a direct upload of the same
+    file, recording the outcome on the upload. Runs in a background thread.
+
+    Args:
+        upload_id (str): Upload ID
+        file_path (str): Where the assembled file was stored
+        file_hash (str): SHA-256 of the file
+        file_type (str): 'pdf' or 'audio'
+        filename (str): Secure file name
+        session_id (str): Session to add the document to, or 'default_session'
+    """
+    try:
+        if file_type == 'pdf':
+            document_id = process_pdf_to_vector_store(file_path, vector_store, session_id, file_hash=file_hash)
+            if not document_id:
+                raise ValueError("Failed to process file")
+        else:
+            title = os.path.splitext(filename)[0]
+            text_path = os.path.splitext(file_path)[0] + '.txt'
+            text = transcribe_audio_file(file_path, text_path)
+            if not text:
+                raise ValueError("No text found in the audio")
+
+            document_id = f"doc_{uuid.uuid4().hex[:10]}"
+            index_text_for_search(text, text_path, document_id, title)
+            if not vector_store.add_document(document_id=document_id, title=title, content=text,
+                                             source_path=file_path, session_id=session_id,
+                                             metadata={"file_type": "audio", "original_filename": filename,
+                                                       "transcription_path": text_path}):
+                raise ValueError("Failed to add transcription to vector store")
+
+        if session_id != 'default_session' and hasattr(session_manager, 'add_document_to_session'):
+            session_manager.add_document_to_session(session_id, document_id)
+        resumable_uploads.finish(upload_id, document_id=document_id)
+        print(f"Resumable upload {upload_id} processed as document {document_id}")
+
+    except Exception as e:
+        print(f"Error processing resumable upload {upload_id}: {e}")
+        traceback.print_exc()
+        resumable_uploads.finish(upload_id, error=str(e))
+
+@app.route('/api/uploads', methods=['POST'])
+def create_resumable_upload():
+    """
+    Start a resumable upload of a large PDF or audio file.
+
+    Request body:
+    {
+        "filename": "lecture.wav",
+        "size": 734003200,             # Bytes
+        "part_size": 8388608,          # Optional, at most RESUMABLE_PART_SIZE
+        "session_id": "session_123"    # Optional
+    }
+
+    The file is then sent with PUT /api/uploads/<upload_id>/parts/<n>, one
+    request per part (n from 0; every part but the last is part_size bytes),
+    and finished with POST /api/uploads/<upload_id>/complete.
+    GET /api/uploads/<upload_id> lists the missing parts to resume with.
+
+    Audio over WHISPER_MAX_FILE_SIZE is transcribed in segments, which only
+    WAV files can be split into; larger files of other formats get a 413.
+    """
+    data = request.json
+    if not data:
+        return jsonify({"error": "Missing JSON data"}), 400
+
+    filename = secure_filename(data.get('filename') or '')
+    if not allowed_file(filename, ['pdf', 'audio']):
+        return jsonify({"error": "Only PDF and audio files are allowed"}), 400
+
+    try:
+        if (allowed_file(filename, 'audio') and not filename.lower().endswith('.wav')
+                and int(data.get('size', 0)) > WHISPER_MAX_FILE_SIZE):
+            return jsonify({
+                "error": f"Audio files over {WHISPER_MAX_FILE_SIZE // (1024 * 1024)} MB must be WAV to be transcribed"
+            }), 413
+        upload = resumable_uploads.create(
+            filename, data.get('size', 0), part_size=data.get('part_size'),
+            metadata={
+                "file_type": 'pdf' if allowed_file(filename, 'pdf') else 'audio',
+                "session_id": data.get('session_id', 'default_session')
+            }
+        )
+        return jsonify({
+            "upload_id": upload['upload_id'],
+            "part_size": upload['part_size'],
+            "part_count": upload['part_count']
+        }), 201
+    except (UploadError, ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), getattr(e, 'status_code', 400)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def resumable_upload_status(upload_id):
+    """Report the received and missing parts of a resumable upload, and its processing status"""
+    try:
+        upload = resumable_uploads.status(upload_id)
+        return jsonify({
+            "upload_id": upload_id,
+            "filename": upload['filename'],
+            "status": upload['status'],
+            "part_size": upload['part_size'],
+            "part_count": upload['part_count'],
+            "received_parts": sorted(int(n) for n in upload['parts']),
+            "missing_parts": upload['missing_parts'],
+            "document_id": upload.get('document_id'),
+            "error": upload.get('error')
+        })
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
+@app.route('/api/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+def upload_part(upload_id, part_number):
+    """Receive one part of a resumable upload as the raw request body"""
+    try:
+        upload = resumable_uploads.write_part(upload_id, part_number, request.stream, request.content_length)
+        return jsonify({
+            "upload_id": upload_id,
+            "part_number": part_number,
+            "received_parts": len(upload['parts']),
+            "part_count": upload['part_count']
+        })
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error receiving part {part_number} of upload {upload_id}: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_resumable_upload(upload_id):
+    """Assemble a resumable upload and start processing it in the background"""
+    try:
+        upload = resumable_uploads.status(upload_id)
+        file_type = upload['metadata']['file_type']
+        folder = app.config['PDF_FOLDER'] if file_type == 'pdf' else app.config['AUDIO_FOLDER']
+        file_path = os.path.join(folder, upload['filename'])
+
+        file_hash = resumable_uploads.complete(upload_id, file_path)
+        get_upload_index().put(file_hash, file_path)
+
+        threading.Thread(
+            target=ingest_resumable_upload, name=f"ingest-{upload_id}", daemon=True,
+            args=(upload_id, file_path, file_hash, file_type, upload['filename'], upload['metadata']['session_id'])
+        ).start()
+
+        return jsonify({
+            "upload_id": upload_id,
+            "status": "processing",
+            "file_hash": file_hash,
+            "message": f"Upload of '{upload['filename']}' complete; poll GET /api/uploads/{upload_id} for the document"
+        }), 202
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"Error completing upload {upload_id}: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_resumable_upload(upload_id):
+    """Cancel a resumable upload and delete its parts"""
+    try:
+        resumable_uploads.abort(upload_id)
+        return jsonify({"success": True, "upload_id": upload_id})
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status_code
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
@@ -407,6 +736,24 @@ def list_documents():
     documents = document_processor.get_session_documents(session_id)
     return jsonify(documents)
 
+@app.route('/api/documents/<document_id>', methods=['DELETE'])
+def delete_document(document_id):
+    """Delete a document from the vector store, the RAG document store and the text search index"""
+    # Chunks processed for RAG live in the document processor; dropping them also drops their cached rerank scores
+    processed = document_processor.delete_document(document_id)
+    indexed = vector_store.delete_document(document_id) if vector_store else False
+
+    if not indexed and not processed:
+        return jsonify({"error": "Document not found"}), 404
+
+    text_index.remove_document(document_id)
+    text_index.save()
+
+    return jsonify({
+        "success": True,
+        "message": f"Document {document_id} deleted"
+    })
+
 @app.route('/api/text', methods=['POST'])
 def process_raw_text():
     """Process raw text input"""
@@ -479,6 +826,41 @@ def clean_sessions():
         "message": f"Cleaned {count} expired sessions"
     })
 
+@app.route('/api/admin/index-report', methods=['GET'])
+def index_report():
+    """Admin endpoint comparing the HNSW index against exact search"""
+    if not vector_store:
+        return jsonify({"error": "Vector store is not available"}), 503
+
+    sample_size = request.args.get('sample_size', 200, type=int)
+    k = request.args.get('k', 10, type=int)
+    session_id = request.args.get('session_id')
+
+    try:
+        if session_id and isinstance(vector_store, ShardedVectorStore):
+            return jsonify(vector_store.index_report(sample_size=sample_size, k=k, session_id=session_id))
+        return jsonify(vector_store.index_report(sample_size=sample_size, k=k))
+    except Exception as e:
+        print(f"Error building index report: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+def cache_stats():
+    """Admin endpoint reporting hit/miss/eviction counters of the embedding, rerank, retrieval and extraction caches"""
+    try:
+        return jsonify({
+            "query_embeddings": get_query_embedding_cache().stats(),
+            "chunk_embeddings": get_embedding_cache().stats(),
+            "rerank_scores": get_rerank_score_cache().stats(),
+            "retrieval_results": get_retrieval_cache().stats(),
+            "pdf_extractions": get_extraction_cache().stats()
+        })
+    except Exception as e:
+        print(f"Error reading cache stats: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api')
 def api_docs():
     """API documentation endpoint"""
@@ -514,9 +896,10 @@ def analyze_pdf():
     # Create safe filename
     filename = secure_filename(file.filename)
     file_path = os.path.join(app.config['PDF_FOLDER'], filename)
-    file.save(file_path)
 
     try:
+        file_hash = save_upload(file, file_path)
+
         # Process the PDF according to the requested analysis type
         if analysis_type == 'summary':
             result = gemini_client.summarize_document(file_path)
@@ -531,7 +914,7 @@ def analyze_pdf():
             result = gemini_client.summarize_document(file_path)
 
         # Also process the PDF with our regular document processor for RAG
-        doc_id = document_processor.process_pdf(file_path, filename, session_id)
+        doc_id = document_processor.process_pdf(file_path, filename, session_id, file_hash=file_hash)
 
         # Add document to session
         session_manager.add_document_to_session(session_id, doc_id)
@@ -566,57 +949,63 @@ def rag_query():
     if not query:
         return jsonify({"error": "Query is required"}), 400
 
-    # Get relevant chunks
-    chunks = vector_store.search_similar(
-        query,
-        limit=5,
-        session_id=session_id,
-        document_id=document_id
-    )
+    def build_payload():
+        # Get relevant chunks
+        chunks = vector_store.search_similar(
+            query,
+            limit=5,
+            session_id=session_id,
+            document_id=document_id
+        )
 
-    if not chunks:
-        return jsonify({
-            "answer": "I couldn't find any relevant information to answer your question.",
-            "chunks": []
-        }), 200
+        if not chunks:
+            return {
+                "answer": "I couldn't find any relevant information to answer your question.",
+                "chunks": []
+            }
 
-    # Format chunks as context
-    context = "\n\n---\n\n".join([chunk["content"] for chunk in chunks])
+        # Format chunks as context
+        context = "\n\n---\n\n".join([chunk["content"] for chunk in chunks])
 
-    # Initialize Gemini client
-    gemini_client = GeminiClient()
+        # Initialize Gemini client
+        gemini_client = GeminiClient()
 
-    # Create RAG prompt
-    rag_prompt = f"""
-    Answer the following question based ONLY on the provided context:
+        # Create RAG prompt
+        rag_prompt = f"""
+        Answer the following question based ONLY on the provided context:
 
-    Question: {query}
+        Question: {query}
 
-    Context:
-    {context}
+        Context:
+        {context}
 
-    Provide a detailed, accurate answer based solely on the information in the context.
-    If the context doesn't contain enough information to answer the question,
-    state that clearly rather than making up information.
-    """
+        Provide a detailed, accurate answer based solely on the information in the context.
+        If the context doesn't contain enough information to answer the question,
+        state that clearly rather than making up information.
+        """
 
-    # Generate response
-    result = gemini_client.process_text(rag_prompt)
-
-    # Format chunk information for response
-    chunk_info = []
-    for chunk in chunks:
-        chunk_info.append({
-            "document_id": chunk["document_id"],
-            "document_title": chunk["title"],
-            "content_excerpt": chunk["content"][:200] + "..." if len(chunk["content"]) > 200 else chunk["content"],
-            "similarity_score": chunk["similarity"]
-        })
+        # Generate response
+        result = gemini_client.process_text(rag_prompt)
+
+        # Format chunk information for response
+        chunk_info = []
+        for chunk in chunks:
+            chunk_info.append({
+                "document_id": chunk["document_id"],
+                "document_title": chunk["title"],
+                "content_excerpt": chunk["content"][:200] + "..." if len(chunk["content"]) > 200 else chunk["content"],
+                "similarity_score": chunk["similarity"]
+            })
 
-    return jsonify({
-        "answer": result,
-        "chunks": chunk_info
-    })
+        return {
+            "answer": result,
+            "chunks": chunk_info
+        }
+
+    # Identical questions against unchanged content reuse the previous answer
+    key = retrieval_cache_key('rag', query, 5, filters={"document_id": document_id, "session_id": session_id},
+                              generation=retrieval_generation(session_id, document_id))
+    return cached_json_response(key, build_payload)
 
 @app.route('/api/process-document', methods=['POST'])
 def process_document():
@@ -661,6 +1050,7 @@ def process_document():
     # Process each file
     processed_documents = []
     failed_documents = []
+    text_documents = []  # Text files are indexed together after the loop
 
     for file in files:
         # Check file format
@@ -678,13 +1068,13 @@ def process_document():
                 else:
                     file_path = os.path.join(app.config['TEXT_FOLDER'], filename)
 
-                file.save(file_path)
+                file_hash = save_upload(file, file_path)
                 print(f"File saved to {file_path}")
 
                 # Process the file based on its type
                 if file_extension == 'pdf':
                     # Process PDF file
-                    document_id = process_pdf_to_vector_store(file_path, vector_store, session_id)
+                    document_id = process_pdf_to_vector_store(file_path, vector_store, session_id, file_hash=file_hash)
                 else:
                     # Process text file
                     with open(file_path, 'r', encoding='utf-8') as f:
@@ -692,15 +1082,17 @@ def process_document():
 
                     # Generate a unique document ID
                     document_id = f"doc_{uuid.uuid4().hex[:10]}"
+                    index_text_for_search(content, file_path, document_id, filename)
 
-                    # Add to vector store
-                    vector_store.add_document(
-                        document_id=document_id,
-                        title=filename,
-                        content=content,
-                        source_path=file_path,
-                        session_id=session_id
-                    )
+                    # Queue for the batched vector store insert
+                    text_documents.append({
+                        "document_id": document_id,
+                        "title": filename,
+                        "content": content,
+                        "source_path": file_path,
+                        "session_id": session_id
+                    })
+                    continue
 
                 if document_id:
                     # Associate document with session if session_id was provided
@@ -732,6 +1124,26 @@ def process_document():
                 "reason": "File format not supported"
             })
 
+    # Embed and index all text files in shared batches
+    if text_documents:
+        result = vector_store.add_documents(text_documents)
+        filenames = {document["document_id"]: document["title"] for document in text_documents}
+
+        for document_id in result["document_ids"]:
+            if session_id != 'default_session' and hasattr(session_manager, 'add_document_to_session'):
+                session_manager.add_document_to_session(session_id, document_id)
+            processed_documents.append({
+                "document_id": document_id,
+                "filename": filenames[document_id],
+                "file_type": "txt"
+            })
+
+        for failure in result["failed"]:
+            failed_documents.append({
+                "filename": filenames[failure["document_id"]],
+                "reason": failure["reason"]
+            })
+
     # Return the results
     if processed_documents:
         return jsonify({
@@ -775,86 +1187,50 @@ def process_pdf():
         os.makedirs(text_folder, exist_ok=True)
 
         file_path = os.path.join(pdf_folder, filename)
-        file.save(file_path)
+        file_hash = save_upload(file, file_path)
 
         # Generate a document ID
         document_id = f"doc_{uuid.uuid4().hex[:10]}"
 
-        # Extract text from PDF using Gemini
+        # Extract text from the PDF, using Gemini only for pages without a text layer
         extracted_text = "Text extraction not available"
         text_path = None
         vectorization_success = False
 
         try:
-            # Check if Gemini client is available
-            if gemini_client:
-                print(f"Using Gemini to extract text from {file_path}")
-
-                # Create extraction prompt for text contents
-                extraction_prompt = """
-                Extract all meaningful text content from this PDF document.
-                Include all text from paragraphs, headers, bullet points, tables, and captions.
-                Maintain the original structure as much as possible.
-                Do not include your own commentary or analysis.
-                """
-
-                # Extract text with Gemini
-                extract_result = gemini_client.process_pdf(file_path, prompt=extraction_prompt)
-                extracted_text = extract_result["text"]
-
-                # Save the extracted text
-                text_filename = f"{os.path.splitext(filename)[0]}_extracted.txt"
-                text_path = os.path.join(text_folder, text_filename)
-                with open(text_path, 'w', encoding='utf-8') as f:
-                    f.write(extracted_text)
-                print(f"Extracted text saved to {text_path}")
-
-                # Add to vector store if available
-                if vector_store:
-                    print(f"Adding document to vector store...")
-                    vector_success = vector_store.add_document(
-                        document_id=document_id,
-                        title=os.path.splitext(filename)[0],
-                        content=extracted_text,
-                        source_path=file_path,
-                        metadata={
-                            "file_type": "pdf",
-                            "original_filename": filename,
-                            "extracted_text_path": text_path
-                        }
-                    )
-
-                    if vector_success:
-                        print(f"Document successfully added to vector store")
-                        vectorization_success = True
-                    else:
-                        print(f"Failed to add document to vector store")
+            print(f"Extracting text from {file_path}")
+            extracted_text = extract_text_from_pdf(file_path, fallback=extract_pages_with_gemini, file_hash=file_hash)
+
+            # Save the extracted text
+            text_filename = f"{os.path.splitext(filename)[0]}_extracted.txt"
+            text_path = os.path.join(text_folder, text_filename)
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write(extracted_text)
+            print(f"Extracted text saved to {text_path}")
+            index_text_for_search(extracted_text, text_path, document_id, os.path.splitext(filename)[0])
+
+            # Add to vector store if available
+            if vector_store:
+                print(f"Adding document to vector store...")
+                vector_success = vector_store.add_document(
+                    document_id=document_id,
+                    title=os.path.splitext(filename)[0],
+                    content=extracted_text,
+                    source_path=file_path,
+                    metadata={
+                        "file_type": "pdf",
+                        "original_filename": filename,
+                        "extracted_text_path": text_path
+                    }
+                )
+
+                if vector_success:
+                    print(f"Document successfully added to vector store")
+                    vectorization_success = True
                 else:
-                    print("Vector store not available, falling back to text extraction only")
+                    print(f"Failed to add document to vector store")
             else:
-                print("Gemini client not available, falling back to PyPDF2")
-
-                # Fall back to PyPDF2 if Gemini is not available
-                try:
-                    import PyPDF2
-                    with open(file_path, 'rb') as pdf_file:
-                        pdf_reader = PyPDF2.PdfReader(pdf_file)
-                        pdf_text = ""
-                        for page_num in range(len(pdf_reader.pages)):
-                            page = pdf_reader.pages[page_num]
-                            pdf_text += page.extract_text() + "\n\n"
-
-                        extracted_text = pdf_text
-
-                    # Save the extracted text
-                    text_filename = f"{os.path.splitext(filename)[0]}_extracted.txt"
-                    text_path = os.path.join(text_folder, text_filename)
-                    with open(text_path, 'w', encoding='utf-8') as f:
-                        f.write(extracted_text)
-                    print(f"Extracted text saved to {text_path}")
-
-                except Exception as e:
-                    print(f"PyPDF2 error: {e}")
+                print("Vector store not available, falling back to text extraction only")
 
         except Exception as e:
             print(f"Error extracting text: {e}")
@@ -953,30 +1329,35 @@ def api_v1_search():
         if not query:
             return jsonify({"error": "Query is required"}), 400
 
-        # If we have a vector store, use it for search
-        if 'vector_store' in globals() and vector_store:
-            # Search with vector store
-            results = vector_store.search_similar(
-                query=query,
-                limit=5,
-                document_id=document_id
-            )
-
-            return jsonify({
-                "query": query,
-                "results": results,
-                "count": len(results)
-            })
-        else:
-            # Fallback to simple text search if vector store isn't available
-            results = perform_simple_text_search(query, document_id)
+        def build_payload():
+            # If we have a vector store, use it for search
+            if 'vector_store' in globals() and vector_store:
+                # Search with vector store
+                results = vector_store.search_similar(
+                    query=query,
+                    limit=5,
+                    document_id=document_id
+                )
+
+                return {
+                    "query": query,
+                    "results": results,
+                    "count": len(results)
+                }
+            else:
+                # Fallback to simple text search if vector store isn't available
+                results = perform_simple_text_search(query, document_id)
+
+                return {
+                    "query": query,
+                    "results": results,
+                    "count": len(results),
+                    "search_type": "simple_text"  # Indicate this is not vector search
+                }
 
-            return jsonify({
-                "query": query,
-                "results": results,
-                "count": len(results),
-                "search_type": "simple_text"  # Indicate this is not vector search
-            })
+        key = retrieval_cache_key('v1_search', query, 5, filters={"document_id": document_id},
+                                  generation=retrieval_generation(document_id=document_id))
+        return cached_json_response(key, build_payload)
 
     except Exception as e:
         import traceback
@@ -990,6 +1371,9 @@ def search():
     Optional filters:
     - document_id: Filter to a specific document
     - session_id: Filter to a specific session
+    Optional retrieval settings:
+    - mode: 'vector', 'lexical' or 'hybrid' (BM25 and vector search fused in one call)
+    - fusion: 'rrf' or 'weighted', for hybrid mode
     """
 
     # Get JSON data
@@ -1005,110 +1389,146 @@ def search():
     # Get optional filter fields
     document_id = data.get('document_id')  # Optional
     session_id = data.get('session_id')    # Optional
-
-    try:
+    mode = data.get('mode', DEFAULT_SEARCH_MODE)
+    fusion = data.get('fusion', HYBRID_FUSION)
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+    if fusion not in FUSION_METHODS:
+        return jsonify({"error": f"fusion must be one of {', '.join(FUSION_METHODS)}"}), 400
+
+    def build_payload():
         # Search the vector store
         results = vector_store.search_similar(
             query=query,
             limit=10,  # Return top 10 results
             session_id=session_id,
-            document_id=document_id
+            document_id=document_id,
+            mode=mode,
+            fusion=fusion
         )
 
-        # If no results from vector search, try text search
-        if not results:
-            print("No vector search results, falling back to text search")
-            results = perform_simple_text_search(query, document_id)
-
-        return jsonify({
+        payload = {
             "query": query,
             "results": results,
             "filters": {
                 "document_id": document_id,
                 "session_id": session_id
-            }
-        })
+            },
+            "mode": mode
+        }
+
+        # If no results from vector search, try text search
+        if not results:
+            print("No vector search results, falling back to text search")
+            payload["results"] = perform_simple_text_search(query, document_id)
+            payload["search_type"] = "simple_text"
+
+        return payload
+
+    try:
+        # Identical searches against unchanged content are served from the retrieval cache
+        key = retrieval_cache_key('search', query, 10, mode=(mode, fusion),
+                                  filters={"document_id": document_id, "session_id": session_id},
+                                  generation=retrieval_generation(session_id, document_id, mode))
+        return cached_json_response(key, build_payload)
 
     except Exception as e:
         print(f"Error during search: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-def perform_simple_text_search(query, document_id=None):
-    """
-    Perform a simple text-based search when vector store is not available
+def parse_diversity_options(data):
     """
-    results = []
+    Read the MMR options of a request, defaulting to MMR_LAMBDA and MMR_MAX_PER_DOCUMENT.
 
-    # Convert query to lowercase for case-insensitive matching
-    query_lower = query.lower()
-    query_terms = query_lower.split()
+    Args:
+        data (dict): Request JSON. "mmr_lambda": null turns diversification off.
 
-    # Define the folder containing text files
-    text_folder = app.config.get('TEXT_FOLDER', os.path.join(app.static_folder, 'uploads', 'texts'))
+    Returns:
+        tuple: (mmr_lambda, max_per_document)
 
-    # Find all text files
-    text_files = []
-    for file in os.listdir(text_folder):
-        if file.endswith('.txt') and 'extracted' in file:
-            text_files.append(os.path.join(text_folder, file))
+    Raises:
+        ValueError: If an option is out of range
+    """
+    mmr_lambda = data.get('mmr_lambda', MMR_LAMBDA)
+    max_per_document = data.get('max_per_document', MMR_MAX_PER_DOCUMENT)
+    if mmr_lambda is not None and (not isinstance(mmr_lambda, (int, float)) or not 0 <= mmr_lambda <= 1):
+        raise ValueError("mmr_lambda must be a number between 0 and 1, or null")
+    if max_per_document is not None and (not isinstance(max_per_document, int) or max_per_document < 1):
+        raise ValueError("max_per_document must be a positive integer, or null")
+    return mmr_lambda, max_per_document
+
+def retrieval_generation(session_id=None, document_id=None, mode='vector'):
+    """
+    Content generation of a search scope in the vector store.
 
-    # Search through each text file
-    for text_path in text_files:
-        file_name = os.path.basename(text_path)
-        doc_title = os.path.splitext(file_name)[0].replace('_extracted', '')
+    Vector scores only depend on the scope's own chunks. Lexical and hybrid
+    scores use BM25 statistics of the whole store, so any change to it
+    makes them stale and they are keyed by the store-wide generation.
 
-        # If document_id is specified, only search that document
-        if document_id:
-            # Simple check if the document ID might be in the filename
-            # This is just a basic heuristic, not reliable for production
-            if document_id not in text_path:
-                continue
+    Args:
+        session_id (str, optional): Session filter
+        document_id (str, optional): Document filter
+        mode (str): Retrieval mode
 
-        try:
-            with open(text_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+    Returns:
+        tuple: Generation counters, or None without a vector store
+    """
+    if not vector_store:
+        return None
+    if mode != 'vector':
+        return vector_store.content_generation()
+    return vector_store.content_generation(session_id, document_id)
 
-            # Split the content into paragraphs
-            paragraphs = content.split('\n\n')
+def cached_json_response(key, build_payload):
+    """
+    Serve a JSON payload from the retrieval cache, building and caching it on a miss.
 
-            for i, paragraph in enumerate(paragraphs):
-                if not paragraph.strip():
-                    continue
+    Payloads are cached serialized, so a hit costs a dictionary lookup.
+    Payloads built from the text search fallback ("search_type":
+    "simple_text") are also tied to the text index generation, since its
+    scores change with any extracted text; the others are not, so indexing
+    text does not invalidate every session's vector results.
 
-                # Simple scoring: count term occurrences and calculate similarity
-                paragraph_lower = paragraph.lower()
-
-                # Check if any term is in the paragraph
-                matches = 0
-                for term in query_terms:
-                    if term in paragraph_lower:
-                        matches += paragraph_lower.count(term)
-
-                if matches > 0:
-                    # Calculate a simple similarity score
-                    similarity = matches / (len(query_terms) + 0.1)  # Adding 0.1 to avoid division by zero
-
-                    # Create a result with the paragraph and metadata
-                    curr_doc_id = f"doc_{hash(text_path) % 10000:04d}_{i}"
-
-                    # Add to results if similarity is above threshold
-                    results.append({
-                        "document_id": document_id or curr_doc_id,
-                        "title": doc_title,
-                        "content": paragraph,
-                        "chunk_index": i,
-                        "similarity": similarity
-                    })
-        except Exception as e:
-            print(f"Error processing {text_path}: {e}")
-            continue
+    Args:
+        key (tuple): Key from retrieval_cache_key, including the scope's content generation
+        build_payload (callable): Returns the payload dict; exceptions are not cached
+
+    Returns:
+        Response: JSON response
+    """
+    cache = get_retrieval_cache()
+    entry = cache.get(key)
+    if entry is not None and entry[0] is not None and entry[0] != text_index.generation:
+        entry = None
+    if entry is None:
+        # Read before building, so a concurrent change leaves the entry stale rather than wrong
+        text_generation = text_index.generation
+        payload = build_payload()
+        entry = (text_generation if payload.get("search_type") == "simple_text" else None, json.dumps(payload))
+        cache.put(key, entry)
+    return app.response_class(entry[1], mimetype='application/json')
+
+def perform_simple_text_search(query, document_id=None):
+    """
+    Perform a lexical (BM25) search over extracted text when vector search is not available
+    """
+    allowed = text_index.document_keys(document_id) if document_id else None
+    if allowed is not None and not allowed:
+        return []
 
-    # Sort by similarity score
-    results.sort(key=lambda x: x["similarity"], reverse=True)
+    results = []
+    for key, score in text_index.search(query, k=5, allowed=allowed):
+        meta = text_index.documents.get(key, {})
+        results.append({
+            "document_id": meta.get("document_id"),
+            "title": meta.get("title", ""),
+            "content": meta.get("content", ""),
+            "chunk_index": meta.get("chunk_index", 0),
+            "similarity": score
+        })
 
-    # Return top results
-    return results[:5]
+    return results
 
 @app.route('/api/process-text', methods=['POST'])
 def process_text():
@@ -1148,6 +1568,7 @@ def process_text():
         text_path = os.path.join(app.config['TEXT_FOLDER'], filename)
         with open(text_path, 'w', encoding='utf-8') as f:
             f.write(text)
+        index_text_for_search(text, text_path, document_id, title)
 
         print(f"Processing text document: {title}")
         print(f"Text length: {len(text)} characters")
@@ -1257,22 +1678,14 @@ def generate_lecture():
                     })
         else:
             # If neither document_ids nor session_id is provided, get all available documents
-            # This requires a function to get all documents from the vector store
             try:
-                # Execute a direct query to get all unique document IDs
-                conn = vector_store.conn
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT document_id FROM documents")
-                all_doc_ids = [row[0] for row in cursor.fetchall()]
-                cursor.close()
-
-                for doc_id in all_doc_ids:
+                for doc in vector_store.get_all_documents():
+                    doc_id = doc.get('document_id')
                     chunks = vector_store.get_document_chunks(doc_id)
                     if chunks:
-                        first_chunk = chunks[0]
                         documents.append({
                             "document_id": doc_id,
-                            "title": first_chunk.get('title', 'Untitled Document'),
+                            "title": doc.get('title', 'Untitled Document'),
                             "chunks": chunks
                         })
             except Exception as e:
@@ -1353,6 +1766,7 @@ Documents for reference:
         lecture_path = os.path.join(app.config['TEXT_FOLDER'], f"{lecture_id}.txt")
         with open(lecture_path, 'w', encoding='utf-8') as f:
             f.write(response_text)
+        index_text_for_search(response_text, lecture_path, lecture_id, title)
 
         # Also add the lecture as a document in the vector store
         vector_store.add_document(
@@ -1530,7 +1944,10 @@ def rag_chat():
         "query": "User's question or message",
         "document_id": "Optional document ID to filter search",
         "session_id": "Optional session ID to filter search",
-        "history": "Optional array of previous messages in the conversation"
+        "history": "Optional array of previous messages in the conversation",
+        "mode": "Optional retrieval mode: vector, lexical or hybrid",
+        "mmr_lambda": "Optional MMR relevance/novelty trade-off in [0, 1] (default MMR_LAMBDA, null disables)",
+        "max_per_document": "Optional number of chunks one document may contribute (default MMR_MAX_PER_DOCUMENT)"
     }
 
     Returns a response generated based on relevant document chunks.
@@ -1553,15 +1970,29 @@ def rag_chat():
     document_id = data.get('document_id')  # Optional
     session_id = data.get('session_id')    # Optional
     history = data.get('history', [])      # Optional conversation history
+    mode = data.get('mode', DEFAULT_SEARCH_MODE)
+    fusion = data.get('fusion', HYBRID_FUSION)
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+    if fusion not in FUSION_METHODS:
+        return jsonify({"error": f"fusion must be one of {', '.join(FUSION_METHODS)}"}), 400
+    try:
+        mmr_lambda, max_per_document = parse_diversity_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        # Step 1: Search the vector store for relevant chunks
-        print(f"Searching for relevant chunks for: {query}")
+        # Step 1: Search the vector store for relevant chunks, diversified so the context is not one passage repeated
+        print(f"Searching for relevant chunks ({mode}) for: {query}")
         results = vector_store.search_similar(
             query=query,
             limit=5,  # Return top 5 results
             session_id=session_id,
-            document_id=document_id
+            document_id=document_id,
+            mode=mode,
+            fusion=fusion,
+            mmr_lambda=mmr_lambda,
+            max_per_document=max_per_document
         )
 
         # If no results from vector search, try text search as fallback
@@ -1700,7 +2131,9 @@ def generate_video_endpoint():
     {
         "query": "User's query for the video",
         "document_id": "Optional document ID to filter search",
-        "session_id": "Optional session ID to filter search"
+        "session_id": "Optional session ID to filter search",
+        "mmr_lambda": "Optional MMR relevance/novelty trade-off in [0, 1] (default MMR_LAMBDA, null disables)",
+        "max_per_document": "Optional number of chunks one document may contribute (default MMR_MAX_PER_DOCUMENT)"
     }
 
     Returns URL to the generated video.
@@ -1726,15 +2159,21 @@ def generate_video_endpoint():
     # Get optional filter fields
     document_id = data.get('document_id')  # Optional
     session_id = data.get('session_id')    # Optional
+    try:
+        mmr_lambda, max_per_document = parse_diversity_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        # Search the vector store for relevant content
+        # Search the vector store for relevant content, diversified so the video covers distinct material
         print(f"Searching for relevant content for video about: {query}")
         results = vector_store.search_similar(
             query=query,
             limit=5,  # Return top 5 results for video
             session_id=session_id,
-            document_id=document_id
+            document_id=document_id,
+            mmr_lambda=mmr_lambda,
+            max_per_document=max_per_document
         )
 
         # If no results from vector search, try text search as fallback
@@ -20,6 +20,7 @@ BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
 PDF_FOLDER = os.path.join(UPLOAD_FOLDER, 'pdfs')
 AUDIO_FOLDER = os.path.join(UPLOAD_FOLDER, 'audio')
+VECTOR_STORE_FOLDER = os.path.join(UPLOAD_FOLDER, 'vector_store')
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {
@@ -31,7 +32,80 @@ ALLOWED_EXTENSIONS = {
 # Maximum file size (16MB)
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024
 
+# Upload handling
+UPLOAD_SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, 'spool')  # Uploads are received here, then renamed into place
+UPLOAD_INDEX_PATH = os.path.join(UPLOAD_FOLDER, 'upload_index.sqlite')  # Stored uploads by content hash, for early dedupe
+RESUMABLE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'resumable')  # In-progress resumable uploads, one folder each
+RESUMABLE_PART_SIZE = 8 * 1024 * 1024  # Largest part of a resumable upload; each part is one request under MAX_CONTENT_LENGTH
+RESUMABLE_MAX_UPLOAD_SIZE = int(os.environ.get('RESUMABLE_MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))  # Largest file a resumable upload accepts
+RESUMABLE_UPLOAD_EXPIRY = 24 * 60 * 60  # Seconds an inactive resumable upload is kept before it is deleted
+
+# Transcription
+WHISPER_MAX_FILE_SIZE = 24 * 1024 * 1024  # Largest audio file sent to Whisper at once (its limit is 25 MB); larger WAV files go in segments
+
 # RAG configurations
 CHUNK_SIZE = 1000  # Size of text chunks for embedding
 CHUNK_OVERLAP = 200  # Overlap between chunks
+PARENT_CHILD_RETRIEVAL = os.environ.get('PARENT_CHILD_RETRIEVAL', 'true').lower() == 'true'  # Match small windows, serve larger spans
+CHILD_CHUNK_SIZE = 300  # Size of the windows the vector store matches on with parent-child retrieval
+CHILD_CHUNK_OVERLAP = 60  # Overlap between child windows
+PARENT_CHUNK_SIZE = 1500  # Context served around a matched child window, read from the stored document text
+NEAR_DUPLICATE_THRESHOLD = 0.85  # Estimated Jaccard similarity (5-word shingles) at which chunks are near-duplicates
+MINHASH_PERMUTATIONS = 128  # MinHash signature length
+MINHASH_BANDS = 16  # LSH bands (8 rows each); candidates are verified against the threshold
+MINHASH_CHECKPOINT_MIN_JOURNAL = 5000  # Fewest journaled near-duplicate index changes that trigger rewriting the index file
+MINHASH_CHECKPOINT_JOURNAL_FRACTION = 0.25  # Journaled changes, relative to the signed chunks, that trigger it
+DOCUMENT_SNAPSHOT_MIN_DELTA = 200  # Fewest documents logged since the last document snapshot that trigger writing a new one
+DOCUMENT_SNAPSHOT_DELTA_FRACTION = 0.25  # Logged documents, relative to the snapshot's, that trigger it
+BM25_CHECKPOINT_MIN_JOURNAL = 5000  # Fewest journaled BM25 index changes that trigger rewriting the index file
+BM25_CHECKPOINT_JOURNAL_FRACTION = 0.25  # Journaled changes, relative to the indexed units, that trigger it
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 64))  # Chunks embedded and written per batch
+EMBEDDING_CACHE_PATH = os.path.join(UPLOAD_FOLDER, 'embedding_cache.sqlite')  # Chunk embeddings keyed by model + text hash
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # Least recently used embeddings are evicted beyond this
+QUERY_EMBEDDING_CACHE_SIZE = 2048  # Query embeddings kept in memory
+QUERY_EMBEDDING_CACHE_TTL = float(os.environ['QUERY_EMBEDDING_CACHE_TTL']) if os.environ.get('QUERY_EMBEDDING_CACHE_TTL') else None  # Seconds; None never expires
+RETRIEVAL_CACHE_SIZE = 1024  # Search and RAG response payloads kept in memory
+RETRIEVAL_CACHE_TTL = float(os.environ['RETRIEVAL_CACHE_TTL']) if os.environ.get('RETRIEVAL_CACHE_TTL') else None  # Seconds; None never expires
 SESSION_EXPIRY = 24 * 60 * 60  # Session expiry in seconds (24 hours)
+RERANK_CANDIDATES = 100  # Chunks preselected with BM25 before they are sent to the reranker
+RERANK_BATCH_SIZE = 100  # Documents per rerank request
+RERANK_MAX_CONCURRENCY = 4  # Rerank requests in flight at once
+RERANKER = os.environ.get('RERANKER', 'cohere')  # 'cohere' or 'local' (offline, deterministic)
+RERANK_SCORE_CACHE_SIZE = 20000  # (model, query, chunk) rerank scores kept in memory
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', 'true').lower() == 'true'  # Load the embedding model at app start
+
+# Text extraction configurations
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))  # Processes extracting PDF page ranges
+PDF_PAGES_PER_TASK = 16  # Pages per process-pool task; smaller PDFs are extracted in the calling thread
+PDF_MIN_TEXT_DENSITY = 0.2  # Text-layer characters per 1000 pt² below which a page with graphics goes to Gemini (a full Letter page is ~5)
+EXTRACTION_CACHE_PATH = os.path.join(UPLOAD_FOLDER, 'extraction_cache.sqlite')  # Extracted pages and chunks keyed by file hash + extractor
+EXTRACTION_CACHE_MAX_ENTRIES = 2000  # Least recently used extractions are evicted beyond this
+
+# Vector index configurations
+HNSW_MIN_CHUNKS = 20000  # Build the HNSW graph once the store holds this many chunks (float32 storage only)
+HNSW_M = 16  # Graph neighbours per node
+HNSW_EF_CONSTRUCTION = 200  # Candidate list size while inserting
+HNSW_EF_SEARCH = 128  # Candidate list size while querying
+FILTERED_EXACT_MAX_ROWS = 50000  # Filtered searches over at most this many chunks are scored exactly
+VECTOR_STORAGE = os.environ.get('VECTOR_STORAGE', 'float32')  # 'float32', 'int8' or 'pq' (compressed codes)
+PQ_SUBVECTOR_DIM = 4  # Dimensions per product-quantization subvector (16x smaller than float32)
+QUANTIZER_TRAIN_SIZE = 1024  # Vectors collected before the quantizer is trained
+QUANTIZED_SHORTLIST_FACTOR = 8  # Candidates re-ranked at full precision per requested result
+COMPACTION_DEAD_FRACTION = 0.2  # Compact the vector store once this fraction of its rows are deleted
+CHECKPOINT_JOURNAL_FRACTION = 0.25  # Rows journaled since the last full vector store save, relative to its size, that trigger a background save
+CHECKPOINT_MIN_JOURNAL_ROWS = 20000  # Fewest journaled rows that trigger such a save
+VECTOR_SHARD_BY_SESSION = os.environ.get('VECTOR_SHARD_BY_SESSION', 'true').lower() == 'true'  # One index per session
+VECTOR_SHARD_MEMORY_BUDGET = int(os.environ.get('VECTOR_SHARD_MEMORY_BUDGET', 512 * 1024 * 1024))  # Bytes of resident shards before LRU eviction
+VECTOR_SHARD_QUERY_LIMIT = int(os.environ.get('VECTOR_SHARD_QUERY_LIMIT', 32))  # Most shards one search opens; resident shards and those matching the query's terms go first
+
+# Retrieval configurations
+SEARCH_MODES = ('vector', 'lexical', 'hybrid')
+DEFAULT_SEARCH_MODE = os.environ.get('SEARCH_MODE', 'vector')  # Used when a request does not pick a mode
+FUSION_METHODS = ('rrf', 'weighted')
+HYBRID_FUSION = 'rrf'  # 'rrf' (reciprocal-rank fusion) or 'weighted' (normalized score blend)
+HYBRID_CANDIDATES_FACTOR = 4  # Candidates taken from each leg per requested result
+RRF_K = 60  # Rank offset of reciprocal-rank fusion
+HYBRID_VECTOR_WEIGHT = 0.5  # Weight of the vector leg in weighted fusion
+MMR_LAMBDA = 0.7  # Relevance/novelty trade-off of MMR diversification (1 = relevance only)
+MMR_CANDIDATES_FACTOR = 4  # Shortlist size per requested result that MMR selects from
+MMR_MAX_PER_DOCUMENT = 2  # Chunks one document may contribute to a diversified result list
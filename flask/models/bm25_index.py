@@ -0,0 +1,431 @@
+"""
+Persistent BM25 inverted index for lexical search over document text.
+"""
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter
+
+from config import BM25_CHECKPOINT_MIN_JOURNAL, BM25_CHECKPOINT_JOURNAL_FRACTION
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in',
+    'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was',
+    'were', 'will', 'with'
+}
+
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens, dropping common English stopwords.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Tokens in order of appearance
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring.
+
+    Each indexed unit (a chunk or paragraph) has a string key. Postings map
+    every term to the keys containing it and their term frequencies, so a
+    query only touches the postings of its own terms.
+
+    With a path, save() appends the units added or removed since the last
+    save to a journal next to the JSON file, so it costs the change, not
+    the index. The JSON file is only rewritten once the journal has grown,
+    from a copy taken under the lock and serialized outside it.
+    """
+    def __init__(self, path=None, k1=1.5, b=0.75, checkpoint_min_journal=BM25_CHECKPOINT_MIN_JOURNAL,
+                 checkpoint_journal_fraction=BM25_CHECKPOINT_JOURNAL_FRACTION):
+        """
+        Args:
+            path (str, optional): JSON file the index is persisted to
+            k1 (float): Term frequency saturation
+            b (float): Document length normalization strength
+            checkpoint_min_journal (int): Fewest journaled changes that trigger rewriting the JSON file
+            checkpoint_journal_fraction (float): Journaled changes, relative to the index size, that trigger it
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.checkpoint_min_journal = checkpoint_min_journal
+        self.checkpoint_journal_fraction = checkpoint_journal_fraction
+
+        self.postings = {}       # Term -> {key: term frequency}
+        self.doc_lengths = {}    # Key -> token count
+        self.documents = {}      # Key -> metadata
+        self.total_length = 0
+        self._doc_terms = {}     # Key -> terms, to remove a key without scanning the vocabulary
+        self._document_keys = {} # Document id -> keys
+        self.generation = 0      # Bumped on every change, so callers can tell when cached results are stale
+        self._lock = threading.RLock()
+        self._pending = []       # Journal records of changes made since the last save
+        self._journal_records = 0
+        self._save_lock = threading.Lock()  # Serializes writes to the files
+
+        if path and (os.path.exists(path) or os.path.exists(self._journal_path)):
+            self.load()
+
+    @property
+    def _journal_path(self):
+        return os.path.splitext(self.path)[0] + '.journal.jsonl' if self.path else None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, key):
+        return key in self.doc_lengths
+
+    def add(self, key, text, metadata=None, document_id=None):
+        """
+        Index (or re-index) a unit of text.
+
+        Args:
+            key (str): Unique key of the unit
+            text (str): Text to index
+            metadata (dict, optional): Data returned with search results
+            document_id (str, optional): Document the unit belongs to
+        """
+        counts = Counter(tokenize(text))
+        metadata = dict(metadata or {})
+        if document_id is not None:
+            metadata['document_id'] = document_id
+        with self._lock:
+            self._index(key, counts, metadata)
+            if self.path:
+                self._pending.append({"op": "add", "key": key, "counts": counts, "metadata": metadata})
+
+    def _index(self, key, counts, metadata):
+        """Index a unit's term counts without journaling the change"""
+        with self._lock:
+            if key in self.doc_lengths:
+                self._remove(key)
+
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, {})[key] = frequency
+
+            length = sum(counts.values())
+            self.doc_lengths[key] = length
+            self.total_length += length
+            self._doc_terms[key] = list(counts)
+
+            document_id = metadata.get('document_id')
+            if document_id is not None:
+                self._document_keys.setdefault(document_id, set()).add(key)
+            self.documents[key] = metadata
+            self.generation += 1
+
+    def remove(self, key):
+        """
+        Remove a unit from the index.
+
+        Args:
+            key (str): Key of the unit
+
+        Returns:
+            bool: True if the key was indexed
+        """
+        with self._lock:
+            if not self._remove(key):
+                return False
+            if self.path:
+                self._pending.append({"op": "remove", "key": key})
+            return True
+
+    def _remove(self, key):
+        """Remove a unit without journaling the change"""
+        with self._lock:
+            if key not in self.doc_lengths:
+                return False
+
+            for term in self._doc_terms.pop(key, []):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(key, None)
+                    if not postings:
+                        del self.postings[term]
+
+            self.total_length -= self.doc_lengths.pop(key)
+            metadata = self.documents.pop(key, {})
+            document_id = metadata.get('document_id')
+            if document_id in self._document_keys:
+                self._document_keys[document_id].discard(key)
+                if not self._document_keys[document_id]:
+                    del self._document_keys[document_id]
+            self.generation += 1
+            return True
+
+    def remove_document(self, document_id):
+        """
+        Remove every unit of a document.
+
+        Args:
+            document_id (str): Document identifier
+
+        Returns:
+            int: Number of units removed
+        """
+        with self._lock:
+            keys = list(self._document_keys.get(document_id, ()))
+            for key in keys:
+                self.remove(key)
+            return len(keys)
+
+    def clear(self):
+        """Remove every unit from the index"""
+        with self._lock:
+            self._clear()
+            if self.path:
+                self._pending.append({"op": "clear"})
+
+    def _clear(self):
+        """Empty the index without journaling the change"""
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.documents = {}
+            self.total_length = 0
+            self._doc_terms = {}
+            self._document_keys = {}
+            self.generation += 1
+
+    def document_keys(self, document_id):
+        """Keys of the units belonging to a document"""
+        with self._lock:
+            return set(self._document_keys.get(document_id, ()))
+
+    def query_stats(self, query):
+        """
+        Corpus statistics BM25 scores a query with.
+
+        Summing them over several indexes and passing the sum to search()
+        makes the scores of those indexes comparable, as if they were one.
+
+        Args:
+            query (str): Search query
+
+        Returns:
+            tuple: (unit count, total token count, {term: units containing it})
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            return (len(self.doc_lengths), self.total_length,
+                    {term: len(self.postings.get(term, ())) for term in terms})
+
+    def term_stats(self):
+        """
+        Corpus statistics of every term, for scoring queries without this index.
+
+        Returns:
+            tuple: (unit count, total token count, {term: units containing it})
+        """
+        with self._lock:
+            return (len(self.doc_lengths), self.total_length,
+                    {term: len(postings) for term, postings in self.postings.items()})
+
+    def search(self, query, k=10, allowed=None, stats=None):
+        """
+        Rank units against a query with BM25.
+
+        Args:
+            query (str): Search query
+            k (int): Number of results to return
+            allowed (container, optional): Only score keys contained in it
+            stats (tuple, optional): query_stats() of the whole corpus to score against.
+                Defaults to this index's own.
+
+        Returns:
+            list: (key, score) tuples, best first
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            num_docs, total_length, dfs = stats if stats is not None else (len(self.doc_lengths), self.total_length, {})
+            if not terms or num_docs == 0:
+                return []
+
+            avg_length = total_length / num_docs or 1.0
+            scores = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+
+                df = dfs.get(term, len(postings))
+                idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+                for key, frequency in postings.items():
+                    if allowed is not None and key not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path=None):
+        """
+        Persist the changes made since the last save.
+
+        They are appended to the journal; the JSON file is rewritten once
+        the journal holds checkpoint_min_journal changes and
+        checkpoint_journal_fraction of the index.
+
+        Args:
+            path (str, optional): Write the whole index to this file instead
+        """
+        if path:
+            try:
+                self._write(path)
+            except Exception as e:
+                print(f"Error saving BM25 index: {e}")
+            return
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if records:
+                try:
+                    with open(self._journal_path, 'a', encoding='utf-8') as f:
+                        offset = f.tell()
+                        try:
+                            f.write("".join(json.dumps(record) + '\n' for record in records))
+                            f.flush()
+                        except Exception:
+                            # Drop the partial write so the next append starts on a clean line
+                            f.truncate(offset)
+                            raise
+                    self._journal_records += len(records)
+                except Exception as e:
+                    with self._lock:
+                        self._pending[:0] = records
+                    print(f"Error saving BM25 index journal: {e}")
+                    return
+
+            if self._journal_records >= max(self.checkpoint_min_journal,
+                                            self.checkpoint_journal_fraction * len(self)):
+                self._checkpoint()
+
+    def checkpoint(self):
+        """
+        Rewrite the JSON file with the whole index and start a new journal.
+
+        Cheaper than journaling every unit after rebuilding the index.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        with self._lock:
+            state = self._state()
+            records, self._pending = self._pending, []
+        try:
+            self._write(self.path, state)
+            # A journal left behind by a failed removal only replays changes the file already holds
+            if os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+            self._journal_records = 0
+        except Exception as e:
+            with self._lock:
+                self._pending[:0] = records
+            print(f"Error checkpointing BM25 index: {e}")
+
+    def _state(self):
+        """Copy of the persisted state, so it can be serialized outside the lock"""
+        with self._lock:
+            return {
+                "k1": self.k1,
+                "b": self.b,
+                "postings": {term: dict(postings) for term, postings in self.postings.items()},
+                "doc_lengths": dict(self.doc_lengths),
+                "documents": dict(self.documents)
+            }
+
+    def _write(self, path, state=None):
+        """Write the whole index to a JSON file, serializing a copy outside the lock"""
+        if state is None:
+            state = self._state()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        """
+        Load the index from its JSON file and replay its journal.
+
+        Args:
+            path (str, optional): File to read instead of the index's own; it has no journal
+        """
+        data = {}
+        if path or os.path.exists(self.path):
+            try:
+                with open(path or self.path, 'r') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Error loading BM25 index: {e}")
+                return
+
+        with self._lock:
+            self.k1 = data.get("k1", self.k1)
+            self.b = data.get("b", self.b)
+            self.postings = data.get("postings", {})
+            self.doc_lengths = data.get("doc_lengths", {})
+            self.documents = data.get("documents", {})
+            self.total_length = sum(self.doc_lengths.values())
+
+            self._doc_terms = {}
+            for term, postings in self.postings.items():
+                for key in postings:
+                    self._doc_terms.setdefault(key, []).append(term)
+
+            self._document_keys = {}
+            for key, metadata in self.documents.items():
+                document_id = metadata.get('document_id')
+                if document_id is not None:
+                    self._document_keys.setdefault(document_id, set()).add(key)
+            self.generation += 1
+
+            if not path:
+                self._replay_journal()
+
+        print(f"Loaded BM25 index with {len(self.doc_lengths)} entries")
+
+    def _replay_journal(self):
+        """Apply the changes journaled since the JSON file was written"""
+        self._journal_records = 0
+        if not os.path.exists(self._journal_path):
+            return
+        valid_length = 0
+        with open(self._journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("unterminated record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A save interrupted mid-write; later records cannot follow it
+                    print(f"Ignoring truncated BM25 index journal after {self._journal_records} records")
+                    break
+                if record["op"] == "add":
+                    self._index(record["key"], record["counts"], record["metadata"])
+                elif record["op"] == "remove":
+                    self._remove(record["key"])
+                elif record["op"] == "clear":
+                    self._clear()
+                valid_length += len(line)
+                self._journal_records += 1
+        if valid_length < os.path.getsize(self._journal_path):
+            with open(self._journal_path, 'r+b') as f:
+                f.truncate(valid_length)
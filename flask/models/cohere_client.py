@@ -4,6 +4,11 @@ import sys
 import traceback
 from dotenv import load_dotenv
 
+from config import RERANK_BATCH_SIZE, RERANK_MAX_CONCURRENCY
+from utils.embedding_cache import get_embedding_cache
+from utils.rerank_cache import get_rerank_score_cache
+from models.reranker import rerank_in_batches, to_rerank_documents, source_chunk_ids
+
 class CohereClient:
     """
     Client for interacting with Cohere API.
@@ -23,6 +28,9 @@ class CohereClient:
         self.embed_model = "embed-english-v3.0"
         self.rerank_model = "rerank-english-v3.0"
 
+        # Scores of (query, chunk) pairs already reranked, shared across requests
+        self.rerank_cache = get_rerank_score_cache()
+
         print("Cohere client initialized successfully")
 
     def chat_with_docs(self, message, documents, conversation_history=None):
@@ -252,6 +260,7 @@ class CohereClient:
     def embed_texts(self, texts):
         """
         Generate embeddings for a list of texts.
+        Texts embedded before with the same model are served from the embedding cache.
 
         Args:
             texts (list): List of text strings to embed
@@ -259,75 +268,76 @@ class CohereClient:
         Returns:
             list: List of embeddings
         """
-        try:
+        def embed_uncached(uncached_texts):
             response = self.client.embed(
-                texts=texts,
+                texts=uncached_texts,
                 model=self.embed_model
             )
             return response.embeddings
+
+        try:
+            return get_embedding_cache().embed(self.embed_model, texts, embed_uncached)
         except Exception as e:
             print(f"Error in embed_texts: {e}")
             print("Traceback:")
             traceback.print_exc()
             raise
 
-    def rerank_chunks(self, query, chunks, top_n=5):
+    def rerank_chunks(self, query, chunks, top_n=5, batch_size=RERANK_BATCH_SIZE,
+                      max_concurrency=RERANK_MAX_CONCURRENCY):
         """
         Rerank document chunks based on relevance to the query.
 
+        Large candidate lists are split into batches of `batch_size` that are
+        reranked concurrently (at most `max_concurrency` requests at once) and
+        merged into a global top_n. Chunks already scored for the same
+        (normalized) query are served from the rerank score cache, so only the
+        misses are sent to Cohere.
+
         Args:
             query (str): The user query
             chunks (list): List of text chunks to rerank
             top_n (int): Number of top chunks to return
+            batch_size (int): Maximum documents per rerank request
+            max_concurrency (int): Maximum rerank requests in flight
 
         Returns:
             list: Ranked document chunks with scores and metadata
         """
         try:
-            # Convert chunks to the format expected by Cohere's rerank
-            documents = []
-            for i, chunk in enumerate(chunks):
-                if isinstance(chunk, dict) and 'text' in chunk:
-                    doc = {
-                        "text": chunk['text'],
-                        "id": chunk.get('id', f"chunk_{i}")
-                    }
-                    # Add any additional metadata
-                    for key, value in chunk.items():
-                        if key not in ['text', 'id']:
-                            doc[key] = value
-                    documents.append(doc)
-                else:
-                    documents.append({
-                        "text": chunk,
-                        "id": f"chunk_{i}"
-                    })
-
-            # Perform reranking
-            response = self.client.rerank(
-                model=self.rerank_model,
-                query=query,
-                documents=documents,
-                top_n=top_n
-            )
-
-            # Format the results
-            results = []
-            for item in response.results:
-                result = {
-                    "text": item.document,
-                    "score": item.relevance_score,
-                    "id": item.document_id
-                }
-                results.append(result)
-
-            return results
+            return rerank_in_batches(query, to_rerank_documents(chunks), top_n, self.rerank_scores,
+                                     batch_size=batch_size, max_concurrency=max_concurrency,
+                                     score_cache=self.rerank_cache, model=self.rerank_model,
+                                     chunk_ids=source_chunk_ids(chunks))
         except Exception as e:
             print(f"Error in rerank_chunks: {e}")
             print("Traceback:")
             traceback.print_exc()
             raise
 
+    def rerank_scores(self, query, texts):
+        """
+        Score every text against the query with one rerank request.
+
+        Args:
+            query (str): The user query
+            texts (list): Texts to score
+
+        Returns:
+            list: One relevance score per text
+        """
+        response = self.client.rerank(
+            model=self.rerank_model,
+            query=query,
+            documents=texts,
+            top_n=len(texts)
+        )
+
+        scores = [0.0] * len(texts)
+        for item in response.results:
+            scores[item.index] = item.relevance_score
+        return scores
+
 
 # Test the RAG and summarization functionality if this file is run directly
 if __name__ == "__main__":
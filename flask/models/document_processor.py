@@ -1,43 +1,230 @@
 import os
 import hashlib
+import threading
 from datetime import datetime
 import json
-from config import CHUNK_SIZE, CHUNK_OVERLAP, PDF_FOLDER
-from utils.pdf_utils import chunk_text #, extract_text_from_pdf,
+from config import (
+    CHUNK_SIZE, CHUNK_OVERLAP, PDF_FOLDER, RERANK_CANDIDATES,
+    NEAR_DUPLICATE_THRESHOLD, MINHASH_PERMUTATIONS, MINHASH_BANDS,
+    MINHASH_CHECKPOINT_MIN_JOURNAL, MINHASH_CHECKPOINT_JOURNAL_FRACTION
+)
+from utils.pdf_utils import chunk_text
+from utils.pdf_extraction import extract_pdf_chunks
+from utils.extraction_cache import hash_file
+from models.bm25_index import BM25Index
+from models.document_snapshot import SnapshotDocumentStore
+from models.near_duplicates import MinHashLSH
+from utils.rerank_cache import get_rerank_score_cache
 
 class DocumentProcessor:
     """
     Processes documents for RAG operations.
     Handles PDF extraction, chunking, and storing processed documents.
+    Documents are persisted as a memory-mapped columnar snapshot, so
+    startup does not depend on corpus size.
+    Chunks are also kept in a BM25 index used to preselect rerank candidates.
+    Near-duplicate chunks (overlapping uploads, repeated slides) are found
+    with MinHash/LSH at ingest and linked to a canonical chunk instead of
+    being indexed again; retrieval returns one chunk per group.
     """
-    def __init__(self, cohere_client):
+    def __init__(self, cohere_client, reranker=None):
+        """
+        Args:
+            cohere_client (CohereClient): Client used for Cohere operations
+            reranker (optional): Object with rerank_chunks(query, chunks, top_n). Defaults to cohere_client.
+        """
         self.cohere_client = cohere_client
-        self.document_store = {}  # In-memory store for document data
+        self.reranker = reranker or cohere_client
 
         # Ensure PDF folder exists
         os.makedirs(PDF_FOLDER, exist_ok=True)
 
-        # Try to load existing document store
+        self.snapshot_path = os.path.join(PDF_FOLDER, 'document_store.snap')
+        self.document_store = self._load_document_store()
+
+        # Lexical index over canonical chunks, keyed by chunk ID, loaded on first use
+        self._chunk_index = None
+        self._chunk_index_lock = threading.Lock()
+
+        # MinHash signatures of canonical chunks, loaded on first use
+        self._near_duplicates = None
+        self._near_duplicates_lock = threading.Lock()
+
+        # Held while a document is stored or deleted, so the indexes change in step with the store
+        self._store_lock = threading.Lock()
+
+    def _load_document_store(self):
+        """Open the document snapshot and its delta log, migrating a legacy document_store.json once"""
+        store = SnapshotDocumentStore.open(self.snapshot_path)
+        if len(store):
+            print(f"Opened document snapshot with {len(store)} documents")
+            return store
+
         store_path = os.path.join(PDF_FOLDER, 'document_store.json')
         if os.path.exists(store_path):
             try:
                 with open(store_path, 'r') as f:
-                    self.document_store = json.load(f)
-                print(f"Loaded {len(self.document_store)} documents from store")
+                    store.update(json.load(f))
+                store.save()
+                store.rebuild()
+                print(f"Migrated {len(store)} documents from document_store.json to a snapshot")
             except Exception as e:
                 print(f"Error loading document store: {e}")
+        return store
+
+    @property
+    def chunk_index(self):
+        """BM25 index over canonical chunks, loaded (and rebuilt if out of date) on first use"""
+        if self._chunk_index is None:
+            with self._chunk_index_lock:
+                if self._chunk_index is None:
+                    chunk_index = BM25Index(os.path.join(PDF_FOLDER, 'chunk_index.json'))
+                    if len(chunk_index) != len(self.near_duplicates):
+                        self.rebuild_chunk_index(chunk_index)
+                    self._chunk_index = chunk_index
+        return self._chunk_index
+
+    @property
+    def near_duplicates(self):
+        """MinHash/LSH index of canonical chunks, loaded (and rebuilt if out of date) on first use"""
+        if self._near_duplicates is None:
+            with self._near_duplicates_lock:
+                if self._near_duplicates is None:
+                    index = MinHashLSH(os.path.join(PDF_FOLDER, 'near_duplicates.npz'),
+                                       num_perm=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS,
+                                       threshold=NEAR_DUPLICATE_THRESHOLD,
+                                       checkpoint_min_journal=MINHASH_CHECKPOINT_MIN_JOURNAL,
+                                       checkpoint_journal_fraction=MINHASH_CHECKPOINT_JOURNAL_FRACTION)
+                    if index.chunk_total != self.document_store.chunk_total():
+                        self.rebuild_near_duplicates(index)
+                    self._near_duplicates = index
+        return self._near_duplicates
+
+    def rebuild_chunk_index(self, chunk_index=None):
+        """Re-index every stored canonical chunk in the BM25 index"""
+        if chunk_index is None:
+            chunk_index = self.chunk_index
+        chunk_index.clear()
+        for doc_id in self.document_store:
+            self.index_chunks(doc_id, self.document_store.chunks(doc_id), chunk_index)
+        chunk_index.checkpoint()
+        print(f"Indexed {len(chunk_index)} chunks for candidate retrieval")
+
+    def rebuild_near_duplicates(self, index=None):
+        """Re-sign every stored canonical chunk, keeping the existing duplicate links"""
+        if index is None:
+            index = self.near_duplicates
+        index.clear()
+        for doc_id in self.document_store:
+            for chunk in self.document_store.chunks(doc_id):
+                if 'duplicate_of' in chunk:
+                    index.link(chunk["id"], chunk["duplicate_of"])
+                else:
+                    index.add(chunk["id"], index.signature(chunk["text"]))
+        index.chunk_total = self.document_store.chunk_total()
+        index.checkpoint()
+        print(f"Signed {len(index)} chunks for near-duplicate detection")
+
+    def index_chunks(self, doc_id, chunked_docs, chunk_index=None):
+        """Add a document's canonical chunks to the BM25 index"""
+        if chunk_index is None:
+            chunk_index = self.chunk_index
+        for chunk in chunked_docs:
+            if 'duplicate_of' not in chunk:
+                chunk_index.add(chunk["id"], chunk["text"], document_id=doc_id)
+
+    def link_near_duplicates(self, chunked_docs, signatures):
+        """
+        Link chunks that nearly duplicate a stored chunk, or an earlier chunk
+        of the same document, to it.
+
+        Linked chunks get a 'duplicate_of' field and are left out of the
+        BM25 and MinHash indexes; the others become canonical chunks. The
+        MinHash index is not changed; index_near_duplicates() does that once
+        the document is stored.
+
+        Args:
+            chunked_docs (list): New chunks, in document order
+            signatures (list): MinHash signature of each chunk
+
+        Returns:
+            int: Number of chunks linked
+        """
+        index = self.near_duplicates
+        document_index = MinHashLSH(num_perm=index.num_perm, bands=index.bands,
+                                    threshold=index.threshold, shingle_size=index.shingle_size)
+        linked = 0
+        for chunk, signature in zip(chunked_docs, signatures):
+            matches = [match for match in (index.query(signature), document_index.query(signature)) if match]
+            if matches:
+                chunk["duplicate_of"] = max(matches, key=lambda match: match[1])[0]
+                linked += 1
+            else:
+                document_index.add(chunk["id"], signature)
+        return linked
+
+    def index_near_duplicates(self, chunked_docs, signatures):
+        """Add a stored document's canonical chunks and duplicate links to the MinHash index"""
+        index = self.near_duplicates
+        for chunk, signature in zip(chunked_docs, signatures):
+            if 'duplicate_of' in chunk:
+                index.link(chunk["id"], chunk["duplicate_of"])
+            else:
+                index.add(chunk["id"], signature)
+
+    def _store_document(self, doc_id, document):
+        """
+        Link a new document's near-duplicate chunks, store it, then index its chunks.
+
+        Signatures are computed first; the rest runs under the store lock, so
+        concurrent ingests see each other's chunks and the indexes only
+        change once the document has been persisted.
+
+        Args:
+            doc_id (str): Document ID
+            document (dict): Document metadata with its 'chunks'
+
+        Returns:
+            int: Number of chunks linked as near-duplicates
+        """
+        chunked_docs = document['chunks']
+        index = self.near_duplicates
+        signatures = [index.signature(chunk["text"]) for chunk in chunked_docs]
+
+        with self._store_lock:
+            # Link near-duplicates of stored chunks instead of indexing them again
+            duplicate_count = self.link_near_duplicates(chunked_docs, signatures)
+            document['duplicate_chunk_count'] = duplicate_count
+
+            self.document_store[doc_id] = document
+            try:
+                self.save_document_store()
+            except Exception:
+                # Not persisted, so it must not be served or indexed either
+                self.document_store.pop(doc_id, None)
+                raise
+
+            self.index_near_duplicates(chunked_docs, signatures)
+            self.index_chunks(doc_id, chunked_docs)
+            self.save_indexes()
+        return duplicate_count
+
+    def save_indexes(self):
+        """Persist the BM25 and near-duplicate indexes (the BM25 index journals only the chunks changed)"""
+        self.chunk_index.save()
+        self.near_duplicates.chunk_total = self.document_store.chunk_total()
+        self.near_duplicates.save()
 
     def save_document_store(self):
-        """Save the document store to disk"""
-        store_path = os.path.join(PDF_FOLDER, 'document_store.json')
-        try:
-            with open(store_path, 'w') as f:
-                json.dump(self.document_store, f)
-            print(f"Saved {len(self.document_store)} documents to store")
-        except Exception as e:
-            print(f"Error saving document store: {e}")
+        """
+        Persist the documents changed since the last save to the store's delta log.
 
-    def process_pdf(self, file_path, file_name=None, session_id=None):
+        Raises:
+            OSError: If they cannot be written, so the caller does not report them as stored
+        """
+        self.document_store.save()
+
+    def process_pdf(self, file_path, file_name=None, session_id=None, file_hash=None):
         """
         Process a PDF file: extract text, chunk it, and store metadata.
 
@@ -45,12 +232,13 @@ class DocumentProcessor:
             file_path (str): Path to the PDF file
             file_name (str, optional): Name to use for the file
             session_id (str, optional): Session ID to associate with this document
+            file_hash (str, optional): SHA-256 of the file, when computed while it was uploaded
 
         Returns:
             str: Document ID
         """
         # Generate a unique document ID based on content and timestamp
-        file_hash = hashlib.md5(open(file_path, 'rb').read()).hexdigest()
+        file_hash = file_hash or hash_file(file_path)
         doc_id = f"doc_{file_hash[:10]}_{int(datetime.now().timestamp())}"
 
         # Use provided filename or extract from path
@@ -58,37 +246,32 @@ class DocumentProcessor:
             file_name = os.path.basename(file_path)
 
         try:
-            # Extract text from PDF
-            text = extract_text_from_pdf(file_path)
-
-            # Chunk the text
-            chunks = chunk_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+            # Extract pages in parallel and chunk them as they arrive, or reuse
+            # the chunks of an identical file
+            chunks = extract_pdf_chunks(file_path, CHUNK_SIZE, CHUNK_OVERLAP, file_hash=file_hash)
 
             # Prepare chunked documents for Cohere format
             chunked_docs = []
-            for i, chunk in enumerate(chunks):
+            for i, (chunk, page) in enumerate(chunks):
                 chunked_docs.append({
                     "id": f"{doc_id}_chunk_{i}",
                     "text": chunk,
                     "source": file_name,
-                    "page": i // 2  # Rough estimate of page number
+                    "page": page
                 })
 
-            # Store document metadata
-            self.document_store[doc_id] = {
+            # Store document metadata, then index its chunks
+            duplicate_count = self._store_document(doc_id, {
                 'filename': file_name,
                 'path': file_path,
                 'upload_time': datetime.now().isoformat(),
-                'chunk_count': len(chunks),
+                'chunk_count': len(chunked_docs),
                 'file_hash': file_hash,
                 'session_id': session_id,
                 'chunks': chunked_docs
-            }
-
-            # Save the updated document store
-            self.save_document_store()
+            })
 
-            print(f"Processed document {doc_id} with {len(chunks)} chunks")
+            print(f"Processed document {doc_id} with {len(chunked_docs)} chunks ({duplicate_count} near-duplicates)")
             return doc_id
 
         except Exception as e:
@@ -111,31 +294,86 @@ class DocumentProcessor:
         # If specific document IDs are provided, retrieve those
         if doc_ids:
             for doc_id in doc_ids:
-                if doc_id in self.document_store:
-                    chunks.extend(self.document_store[doc_id].get('chunks', []))
+                chunks.extend(self.document_store.chunks(doc_id))
 
         # If session ID is provided, retrieve all documents for that session
         elif session_id:
-            for doc_id, doc_data in self.document_store.items():
-                if doc_data.get('session_id') == session_id:
-                    chunks.extend(doc_data.get('chunks', []))
+            for doc_id in self.document_store.session_document_ids(session_id):
+                chunks.extend(self.document_store.chunks(doc_id))
 
         # If neither is provided, return all chunks
         else:
-            for doc_data in self.document_store.values():
-                chunks.extend(doc_data.get('chunks', []))
+            for doc_id in self.document_store:
+                chunks.extend(self.document_store.chunks(doc_id))
+
+        return self._collapse_near_duplicates(chunks)
+
+    @staticmethod
+    def _collapse_near_duplicates(chunks):
+        """
+        Keep one chunk per near-duplicate group.
+
+        The canonical chunk is kept when it is among `chunks`; otherwise the
+        first linked chunk stands in for it, so filtered requests still see
+        the content.
+        """
+        ids = {chunk["id"] for chunk in chunks}
+        seen = set()
+        collapsed = []
+        for chunk in chunks:
+            group = chunk.get("duplicate_of", chunk["id"])
+            if group in seen or (group != chunk["id"] and group in ids):
+                continue
+            seen.add(group)
+            collapsed.append(chunk)
+        return collapsed
+
+    def select_candidates(self, query, chunks, limit=RERANK_CANDIDATES, filtered=True):
+        """
+        Preselect the chunks worth reranking with BM25.
 
-        return chunks
+        Args:
+            query (str): The user query
+            chunks (list): Chunks matching the request's filters
+            limit (int): Maximum number of candidates
+            filtered (bool): Whether `chunks` is a subset of the corpus
 
-    def retrieve_relevant_chunks(self, query, doc_ids=None, session_id=None, top_n=5):
+        Returns:
+            list: At most `limit` chunks, best lexical matches first. If fewer
+                chunks match lexically, the rest are filled in document order.
+        """
+        if len(chunks) <= limit:
+            return chunks
+
+        # Only canonical chunks are indexed; a linked chunk standing in for its group matches as the canonical one
+        chunks_by_group = {chunk.get("duplicate_of", chunk["id"]): chunk for chunk in chunks}
+        hits = self.chunk_index.search(query, k=limit, allowed=chunks_by_group if filtered else None)
+        candidates = [chunks_by_group[chunk_id] for chunk_id, _ in hits if chunk_id in chunks_by_group]
+
+        if len(candidates) < limit:
+            selected = {chunk["id"] for chunk in candidates}
+            for chunk in chunks:
+                if len(candidates) >= limit:
+                    break
+                if chunk["id"] not in selected:
+                    candidates.append(chunk)
+
+        return candidates
+
+    def retrieve_relevant_chunks(self, query, doc_ids=None, session_id=None, top_n=5,
+                                 candidates=RERANK_CANDIDATES):
         """
         Retrieve the most relevant document chunks for a query.
 
+        Candidates are preselected with BM25 so the reranker sees at most
+        `candidates` chunks however large the session or corpus is.
+
         Args:
             query (str): The user query
             doc_ids (list, optional): List of document IDs to search within
             session_id (str, optional): Session ID to filter documents
             top_n (int): Number of chunks to retrieve
+            candidates (int): Number of chunks passed to the reranker
 
         Returns:
             list: List of relevant text chunks in Cohere format
@@ -146,8 +384,12 @@ class DocumentProcessor:
         if not all_chunks:
             return []
 
-        # Use Cohere's rerank to find relevant chunks
-        reranked_chunks = self.cohere_client.rerank_chunks(query, all_chunks, top_n=top_n)
+        # Stage 1: lexical candidate generation
+        candidate_chunks = self.select_candidates(query, all_chunks, limit=candidates,
+                                                  filtered=bool(doc_ids or session_id))
+
+        # Stage 2: rerank the candidates (Cohere, or the local scorer when offline)
+        reranked_chunks = self.reranker.rerank_chunks(query, candidate_chunks, top_n=top_n)
 
         # Format for Cohere's RAG
         cohere_docs = []
@@ -163,6 +405,78 @@ class DocumentProcessor:
 
         return cohere_docs
 
+    def delete_document(self, doc_id):
+        """
+        Delete a document and its chunks.
+
+        Cached rerank scores of the chunks are dropped with it.
+
+        Args:
+            doc_id (str): Document ID
+
+        Returns:
+            bool: True if the document existed
+        """
+        with self._store_lock:
+            doc_data = self.document_store.pop(doc_id, None)
+            if doc_data is None:
+                return False
+
+            chunks = doc_data.get('chunks', [])
+            self._promote_near_duplicates(chunks)
+            self.chunk_index.remove_document(doc_id)
+            get_rerank_score_cache().invalidate_chunks(chunk["id"] for chunk in chunks)
+            self.save_document_store()
+            self.save_indexes()
+
+        print(f"Deleted document {doc_id}")
+        return True
+
+    def _promote_near_duplicates(self, deleted_chunks):
+        """
+        Unlink deleted chunks and, for each deleted canonical chunk, make its
+        first surviving duplicate canonical and relink the rest to it.
+
+        Args:
+            deleted_chunks (list): Chunks of a document already removed from the store
+        """
+        index = self.near_duplicates
+        deleted_ids = {chunk["id"] for chunk in deleted_chunks}
+        updates = {}  # Chunk id -> new canonical id, or None to become canonical
+
+        for chunk in deleted_chunks:
+            if 'duplicate_of' in chunk:
+                index.unlink(chunk["id"], chunk["duplicate_of"])
+                continue
+            survivors = [key for key in index.remove(chunk["id"]) if key not in deleted_ids]
+            if survivors:
+                updates[survivors[0]] = None
+                for key in survivors[1:]:
+                    updates[key] = survivors[0]
+
+        # Chunk ids are "<doc_id>_chunk_<n>"
+        by_document = {}
+        for chunk_id, canonical in updates.items():
+            by_document.setdefault(chunk_id.rsplit('_chunk_', 1)[0], {})[chunk_id] = canonical
+
+        for other_id, changes in by_document.items():
+            if other_id not in self.document_store:
+                continue
+            other = self.document_store[other_id]
+            for chunk in other.get('chunks', []):
+                if chunk["id"] not in changes:
+                    continue
+                canonical = changes[chunk["id"]]
+                if canonical is None:
+                    del chunk["duplicate_of"]
+                    index.add(chunk["id"], index.signature(chunk["text"]))
+                    self.chunk_index.add(chunk["id"], chunk["text"], document_id=other_id)
+                    other['duplicate_chunk_count'] = max(other.get('duplicate_chunk_count', 1) - 1, 0)
+                else:
+                    chunk["duplicate_of"] = canonical
+                    index.link(chunk["id"], canonical)
+            self.document_store[other_id] = other
+
     def get_session_documents(self, session_id):
         """
         Get information about all documents in a session.
@@ -174,13 +488,9 @@ class DocumentProcessor:
             dict: Dictionary of document metadata for the session
         """
         session_docs = {}
-        for doc_id, doc_data in self.document_store.items():
-            if doc_data.get('session_id') == session_id:
-                # Create a copy without the chunks to reduce size
-                doc_info = doc_data.copy()
-                if 'chunks' in doc_info:
-                    del doc_info['chunks']
-                session_docs[doc_id] = doc_info
+        for doc_id in self.document_store.session_document_ids(session_id):
+            # Metadata only, the chunks are not decoded
+            session_docs[doc_id] = self.document_store.metadata(doc_id)
 
         return session_docs
 
@@ -215,23 +525,20 @@ class DocumentProcessor:
                     "section": i  # Simple sequential section numbering
                 })
 
-            # Store document metadata
-            self.document_store[doc_id] = {
+            # Store document metadata, then index its chunks
+            duplicate_count = self._store_document(doc_id, {
                 'filename': os.path.basename(file_path) if file_path else f"{title}.txt",
                 'path': file_path,
                 'title': title,
                 'upload_time': datetime.now().isoformat(),
-                'chunk_count': len(chunks),
+                'chunk_count': len(chunked_docs),
                 'content_hash': content_hash,
                 'session_id': session_id,
                 'chunks': chunked_docs,
                 'type': 'text'
-            }
-
-            # Save the updated document store
-            self.save_document_store()
+            })
 
-            print(f"Processed text document {doc_id} with {len(chunks)} chunks")
+            print(f"Processed text document {doc_id} with {len(chunks)} chunks ({duplicate_count} near-duplicates)")
             return doc_id
 
         except Exception as e:
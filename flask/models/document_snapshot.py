@@ -0,0 +1,553 @@
+"""
+Columnar binary snapshot of the processed document store.
+
+Layout (little endian):
+
+    magic        8 bytes  b"BVDSNAP1"
+    header size  uint32
+    header       JSON: counts and {column name: [byte offset, dtype, length]}
+    columns      each aligned to 8 bytes
+
+Fixed-width columns hold the per-document chunk ranges (CSR offsets into
+the chunk columns); strings live in heaps, each an int64 offsets column
+plus a uint8 bytes column. The file is opened with mmap, so opening costs
+the same whatever the corpus size, nothing is parsed until a document is
+read, and worker processes opening the same file share its pages.
+
+A persisted store is a numbered snapshot version plus a JSON-lines delta
+log of the documents put or deleted since it was written.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import struct
+import threading
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from config import DOCUMENT_SNAPSHOT_MIN_DELTA, DOCUMENT_SNAPSHOT_DELTA_FRACTION
+
+MAGIC = b"BVDSNAP1"
+VERSION = 1
+
+# Chunk fields with their own heap; any other chunk keys go to the 'extra' JSON heap
+CHUNK_FIELDS = ('id', 'text', 'source')
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _heap(values):
+    """Encode strings as (int64 offsets, uint8 bytes)"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def write_snapshot(path, documents):
+    """
+    Write documents to a snapshot file, atomically replacing any previous one.
+
+    Args:
+        path (str): Snapshot file
+        documents (Mapping): Document ID -> document dict with a 'chunks' list
+    """
+    doc_ids, doc_sessions, doc_meta = [], [], []
+    chunk_starts = [0]
+    chunk_columns = {field: [] for field in CHUNK_FIELDS}
+    chunk_extra = []
+
+    for doc_id, doc_data in documents.items():
+        chunks = doc_data.get('chunks', [])
+        doc_ids.append(doc_id)
+        doc_sessions.append(doc_data.get('session_id') or '')
+        doc_meta.append(json.dumps({key: value for key, value in doc_data.items() if key != 'chunks'}))
+        chunk_starts.append(chunk_starts[-1] + len(chunks))
+        for chunk in chunks:
+            for field in CHUNK_FIELDS:
+                value = chunk.get(field)
+                chunk_columns[field].append(value if isinstance(value, str) else '')
+            # Anything the string heaps cannot hold faithfully goes to the JSON heap
+            chunk_extra.append(json.dumps({key: value for key, value in chunk.items()
+                                           if key not in CHUNK_FIELDS or not isinstance(value, str)}))
+
+    columns = {"doc_chunk_start": np.asarray(chunk_starts, dtype=np.int64)}
+    heaps = {"doc_id": doc_ids, "doc_session": doc_sessions, "doc_meta": doc_meta, "chunk_extra": chunk_extra}
+    heaps.update({f"chunk_{field}": values for field, values in chunk_columns.items()})
+    for name, values in heaps.items():
+        columns[f"{name}.offsets"], columns[f"{name}.bytes"] = _heap(values)
+
+    # Lay the columns out after the header, each 8-byte aligned. The header
+    # holds the column offsets, so grow its reserved space until it fits.
+    header_space = 256
+    while True:
+        offset = _align(len(MAGIC) + 4 + header_space)
+        layout = {}
+        for name, column in columns.items():
+            layout[name] = [offset, column.dtype.str, len(column)]
+            offset = _align(offset + column.nbytes)
+        header = json.dumps({
+            "version": VERSION,
+            "documents": len(doc_ids),
+            "chunks": chunk_starts[-1],
+            "columns": layout
+        }).encode('utf-8')
+        if len(header) <= header_space:
+            break
+        header_space = len(header) + 256
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name, column in columns.items():
+            f.seek(layout[name][0])
+            f.write(column.tobytes())
+        f.truncate(offset)  # Empty trailing columns still lie inside the file
+    os.replace(tmp_path, path)
+
+
+class DocumentSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file.
+
+    Documents are addressed by position; strings are decoded on access.
+    The mapping stays valid as long as the snapshot is referenced, so a
+    replaced snapshot can still serve the reads that started on it.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Snapshot file written by write_snapshot
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a document snapshot")
+        header_size = struct.unpack_from('<I', self._mmap, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(self._mmap[start:start + header_size]))
+        if header.get("version") != VERSION:
+            self._mmap.close()
+            raise ValueError(f"Unsupported document snapshot version {header.get('version')}")
+
+        self.document_count = header["documents"]
+        self.chunk_count = header["chunks"]
+        self._columns = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=length, offset=offset)
+            for name, (offset, dtype, length) in header["columns"].items()
+        }
+        self._positions = None  # Document id -> position, built on first lookup
+
+    def positions(self):
+        """Document id -> position of every document in the snapshot"""
+        if self._positions is None:
+            self._positions = {self.document_id(i): i for i in range(self.document_count)}
+        return self._positions
+
+    def _string(self, heap, i):
+        offsets = self._columns[f"{heap}.offsets"]
+        return self._columns[f"{heap}.bytes"][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def document_id(self, i):
+        return self._string("doc_id", i)
+
+    def session_id(self, i):
+        """Session of the document at position i, or None"""
+        return self._string("doc_session", i) or None
+
+    def chunk_total(self, i):
+        """Number of chunks of the document at position i"""
+        starts = self._columns["doc_chunk_start"]
+        return int(starts[i + 1] - starts[i])
+
+    def metadata(self, i):
+        """Metadata of the document at position i, without its chunks"""
+        return json.loads(self._string("doc_meta", i))
+
+    def chunks(self, i):
+        """Chunks of the document at position i"""
+        starts = self._columns["doc_chunk_start"]
+        chunks = []
+        for j in range(int(starts[i]), int(starts[i + 1])):
+            chunk = {field: self._string(f"chunk_{field}", j) for field in CHUNK_FIELDS}
+            chunk.update(json.loads(self._string("chunk_extra", j)))
+            chunks.append(chunk)
+        return chunks
+
+    def document(self, i):
+        """Full document dict at position i, chunks included"""
+        doc_data = self.metadata(i)
+        doc_data['chunks'] = self.chunks(i)
+        return doc_data
+
+    def close(self):
+        """Unmap the file. Only for a snapshot no reader can still be using."""
+        self._columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # A caller still holds a view; the mapping goes away with it
+
+
+def snapshot_file(path, version):
+    """
+    Snapshot file of a version of the store at path.
+
+    Version 0 is path itself, as written before snapshots were versioned.
+
+    Args:
+        path (str): Base snapshot path, e.g. 'document_store.snap'
+        version (int): Snapshot version
+
+    Returns:
+        str: e.g. 'document_store.3.snap'
+    """
+    if not version:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{version}{extension}"
+
+
+def delta_file(path, version):
+    """Delta log of the changes made on top of a snapshot version, e.g. 'document_store.3.delta.jsonl'"""
+    return os.path.splitext(snapshot_file(path, version))[0] + '.delta.jsonl'
+
+
+def snapshot_versions(path):
+    """Versions of the store at path whose snapshot file is complete, ascending"""
+    directory = os.path.dirname(path) or '.'
+    stem, extension = os.path.splitext(os.path.basename(path))
+    pattern = re.compile(re.escape(stem) + r"\.(\d+)" + re.escape(extension) + "$")
+    versions = [0] if os.path.exists(path) else []
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        match = pattern.match(name)
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+def read_delta(path):
+    """
+    Read a delta log; a torn last line (a crash while appending) ends it.
+
+    Returns:
+        list: {"op": "put", "id", "document"} and {"op": "delete", "id"} records, in order
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"Ignoring a truncated entry at the end of {path}")
+                break
+    return records
+
+
+class SnapshotDocumentStore(MutableMapping):
+    """
+    Document store dict backed by a DocumentSnapshot.
+
+    Reads go to the snapshot; documents added or deleted since it was
+    written are kept in an overlay. The snapshot and its overlay are
+    swapped together, and every read works on the pair it started with,
+    so replacing the snapshot never pulls it out from under a reader.
+
+    A store opened from a path persists itself: save() appends the
+    documents changed since the last save to a delta log next to the
+    snapshot, so a change costs its own size, not the corpus. Once the
+    log has grown enough a new snapshot is written in the background
+    under the next version number, never over a file that is mapped.
+    """
+    def __init__(self, snapshot=None, path=None, min_delta=DOCUMENT_SNAPSHOT_MIN_DELTA,
+                 delta_fraction=DOCUMENT_SNAPSHOT_DELTA_FRACTION):
+        """
+        Args:
+            snapshot (DocumentSnapshot, optional): Snapshot to serve reads from
+            path (str, optional): Base snapshot path to persist to; see open()
+            min_delta (int): Fewest logged changes that trigger a new snapshot
+            delta_fraction (float): Logged changes, relative to the snapshot's documents, that trigger one
+        """
+        # (snapshot, added, deleted): added maps document ids newer than the
+        # snapshot to their dicts, deleted holds snapshot ids deleted since
+        self._state = (snapshot, {}, set())
+        self._lock = threading.RLock()
+        self.path = path
+        self.min_delta = min_delta
+        self.delta_fraction = delta_fraction
+        self._version = 0           # Snapshot version the delta log applies to
+        self._delta_count = 0       # Records in that log
+        self._unsaved = set()       # Document ids changed since the last save
+        self._rebuild_changes = None  # Document ids changed while a new snapshot is written
+        self._rebuild_lock = threading.Lock()
+        self._rebuild_thread = None
+
+    @classmethod
+    def open(cls, path, **options):
+        """
+        Open the latest snapshot version at path and replay its delta log.
+
+        Args:
+            path (str): Base snapshot path, e.g. 'document_store.snap'
+            **options: min_delta and delta_fraction
+
+        Returns:
+            SnapshotDocumentStore: Store persisting to path
+        """
+        store = cls(path=path, **options)
+        versions = snapshot_versions(path)
+        if versions:
+            store._version = versions[-1]
+            store._state = (DocumentSnapshot(snapshot_file(path, store._version)), {}, set())
+        records = read_delta(delta_file(path, store._version))
+        for record in records:
+            if record["op"] == "put":
+                store._put(record["id"], record["document"])
+            elif record["op"] == "delete":
+                store._discard(record["id"])
+        store._delta_count = len(records)
+        store._remove_stale_files()
+        return store
+
+    @staticmethod
+    def _positions(snapshot):
+        return snapshot.positions() if snapshot is not None else {}
+
+    @classmethod
+    def _position(cls, state, doc_id):
+        """Snapshot position of a live, unmodified document, or None"""
+        snapshot, added, deleted = state
+        if doc_id in added or doc_id in deleted:
+            return None
+        return cls._positions(snapshot).get(doc_id)
+
+    def __getitem__(self, doc_id):
+        state = self._state
+        if doc_id in state[1]:
+            return state[1][doc_id]
+        position = self._position(state, doc_id)
+        if position is None:
+            raise KeyError(doc_id)
+        return state[0].document(position)
+
+    def __setitem__(self, doc_id, doc_data):
+        with self._lock:
+            self._put(doc_id, doc_data)
+            self._changed(doc_id)
+
+    def __delitem__(self, doc_id):
+        with self._lock:
+            if not self._discard(doc_id):
+                raise KeyError(doc_id)
+            self._changed(doc_id)
+
+    def _put(self, doc_id, doc_data):
+        snapshot, added, deleted = self._state
+        added[doc_id] = doc_data
+        deleted.discard(doc_id)
+
+    def _discard(self, doc_id):
+        """Delete a document from the overlay; False if it does not exist"""
+        state = self._state
+        snapshot, added, deleted = state
+        if doc_id in added:
+            del added[doc_id]
+            if doc_id in self._positions(snapshot):
+                deleted.add(doc_id)
+        elif self._position(state, doc_id) is not None:
+            deleted.add(doc_id)
+        else:
+            return False
+        return True
+
+    def _changed(self, doc_id):
+        self._unsaved.add(doc_id)
+        if self._rebuild_changes is not None:
+            self._rebuild_changes.add(doc_id)
+
+    def __contains__(self, doc_id):
+        state = self._state
+        return doc_id in state[1] or self._position(state, doc_id) is not None
+
+    def __iter__(self):
+        snapshot, added, deleted = self._state
+        for doc_id in list(self._positions(snapshot)):
+            if doc_id not in added and doc_id not in deleted:
+                yield doc_id
+        yield from list(added)
+
+    def __len__(self):
+        snapshot, added, deleted = self._state
+        positions = self._positions(snapshot)
+        return (len(positions) - len(deleted)
+                + sum(1 for doc_id in list(added) if doc_id not in positions))
+
+    def chunks(self, doc_id):
+        """Chunks of a document, without decoding its metadata"""
+        state = self._state
+        if doc_id in state[1]:
+            return state[1][doc_id].get('chunks', [])
+        position = self._position(state, doc_id)
+        return state[0].chunks(position) if position is not None else []
+
+    def metadata(self, doc_id):
+        """Metadata of a document without its chunks"""
+        state = self._state
+        if doc_id in state[1]:
+            return {key: value for key, value in state[1][doc_id].items() if key != 'chunks'}
+        position = self._position(state, doc_id)
+        if position is None:
+            raise KeyError(doc_id)
+        return state[0].metadata(position)
+
+    def session_document_ids(self, session_id):
+        """IDs of the documents of a session, read from the session column only"""
+        snapshot, added, deleted = self._state
+        ids = []
+        for doc_id, position in self._positions(snapshot).items():
+            if doc_id not in added and doc_id not in deleted \
+                    and snapshot.session_id(position) == session_id:
+                ids.append(doc_id)
+        ids.extend(doc_id for doc_id, doc_data in list(added.items()) if doc_data.get('session_id') == session_id)
+        return ids
+
+    def chunk_total(self):
+        """Number of chunks across all documents"""
+        snapshot, added, deleted = self._state
+        total = sum(len(doc_data.get('chunks', [])) for doc_data in list(added.values()))
+        for doc_id, position in self._positions(snapshot).items():
+            if doc_id not in added and doc_id not in deleted:
+                total += snapshot.chunk_total(position)
+        return total
+
+    def _record(self, doc_id):
+        """Delta log record bringing a document to its current state"""
+        if doc_id in self:
+            return {"op": "put", "id": doc_id, "document": self[doc_id]}
+        return {"op": "delete", "id": doc_id}
+
+    def save(self):
+        """
+        Persist the documents changed since the last save.
+
+        They are appended to the delta log of the current snapshot. Once
+        the log holds min_delta changes and delta_fraction of the
+        snapshot's documents, a new snapshot is written in the background.
+
+        Raises:
+            OSError: If the changes cannot be written; they stay unsaved
+        """
+        if self.path is None:
+            raise ValueError("Document store was not opened from a path")
+        with self._lock:
+            if self._unsaved:
+                path = delta_file(self.path, self._version)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                lines = "".join(json.dumps(self._record(doc_id)) + '\n' for doc_id in self._unsaved)
+                try:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(lines)
+                except Exception:
+                    # Cut a partial write off so later records do not follow a torn line
+                    if os.path.exists(path):
+                        with open(path, 'r+b') as f:
+                            f.truncate(size)
+                    raise
+                self._delta_count += len(self._unsaved)
+                self._unsaved.clear()
+
+            rebuild = self._delta_count >= max(self.min_delta,
+                                               self.delta_fraction * len(self._positions(self._state[0])))
+            if rebuild and (self._rebuild_thread is None or not self._rebuild_thread.is_alive()):
+                self._rebuild_thread = threading.Thread(target=self.rebuild, name="document-snapshot", daemon=True)
+                self._rebuild_thread.start()
+
+    def rebuild(self):
+        """
+        Write every document to the next snapshot version and serve reads from it.
+
+        Changes carry on meanwhile; those made while it is written start the
+        new version's delta log. The previous snapshot is not closed, since
+        reads may still be running on it, and its file is deleted once no
+        longer mapped.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                snapshot, added, deleted = self._state
+                frozen = SnapshotDocumentStore(snapshot)
+                frozen._state = (snapshot, dict(added), set(deleted))
+                version = self._version + 1
+                self._rebuild_changes = set()
+
+            path = snapshot_file(self.path, version)
+            tmp_path = path + '.new'
+            try:
+                start = time.time()
+                write_snapshot(tmp_path, frozen)
+                with self._lock:
+                    # The new version exists once its snapshot is in place, with its delta log already written
+                    changes = self._rebuild_changes
+                    records = [self._record(doc_id) for doc_id in changes]
+                    delta_path = delta_file(self.path, version)
+                    with open(delta_path + '.tmp', 'w', encoding='utf-8') as f:
+                        f.write("".join(json.dumps(record) + '\n' for record in records))
+                    os.replace(delta_path + '.tmp', delta_path)
+                    os.replace(tmp_path, path)
+                    try:
+                        new_snapshot = DocumentSnapshot(path)
+                    except Exception:
+                        os.remove(path)
+                        raise
+
+                    new_added, new_deleted = {}, set()
+                    positions = new_snapshot.positions()
+                    current = self._state
+                    for doc_id in changes:
+                        if doc_id in current[1]:
+                            new_added[doc_id] = current[1][doc_id]
+                        elif doc_id in positions:
+                            new_deleted.add(doc_id)
+                    self._state = (new_snapshot, new_added, new_deleted)
+                    self._version = version
+                    self._delta_count = len(records)
+                print(f"Wrote document snapshot version {version} of {len(frozen)} documents "
+                      f"in {time.time() - start:.2f} seconds")
+            finally:
+                with self._lock:
+                    self._rebuild_changes = None
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        """Delete snapshot versions and delta logs older than the current version"""
+        for version in set(snapshot_versions(self.path)) | {0}:
+            if version < self._version:
+                for name in (snapshot_file(self.path, version), delta_file(self.path, version)):
+                    try:
+                        if os.path.exists(name):
+                            os.remove(name)
+                    except OSError:
+                        pass  # Still mapped (Windows); removed after a later snapshot
+
+    def close(self):
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            snapshot = self._state[0]
+            self._state = (None, {}, set())
+            if snapshot is not None:
+                snapshot.close()
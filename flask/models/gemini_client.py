@@ -2,8 +2,16 @@ import os
 import sys
 import traceback
 import pathlib
+import tempfile
 from dotenv import load_dotenv
 
+PDF_EXTRACTION_PROMPT = """
+Extract all meaningful text content from this PDF document.
+Include all text from paragraphs, headers, bullet points, tables, and captions.
+Maintain the original structure as much as possible.
+Do not include your own commentary or analysis.
+"""
+
 class GeminiClient:
     """
     Client for interacting with Google's Gemini API.
@@ -112,6 +120,37 @@ class GeminiClient:
             traceback.print_exc()
             raise
 
+    def extract_pdf_pages(self, pdf_path, first_page, last_page, prompt=PDF_EXTRACTION_PROMPT):
+        """
+        Extract the text of a page range only, by sending just those pages.
+
+        Used as the fallback for pages without a usable text layer, see
+        utils.pdf_extraction.iter_pdf_pages.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+            first_page (int): First page to extract (1-based)
+            last_page (int): Last page to extract (inclusive)
+            prompt (str, optional): Extraction prompt
+
+        Returns:
+            str: Extracted text
+        """
+        import fitz
+
+        temp_path = None
+        try:
+            with fitz.open(pdf_path) as doc, fitz.open() as pages:
+                pages.insert_pdf(doc, from_page=first_page - 1, to_page=last_page - 1)
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                    temp_path = f.name
+                pages.save(temp_path)
+
+            return self.process_pdf(temp_path, prompt=prompt)["text"]
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
     def summarize_document(self, pdf_path):
         """
         Generate a concise summary of a PDF document.
@@ -0,0 +1,363 @@
+"""
+MinHash signatures with LSH banding for near-duplicate chunk detection.
+"""
+import os
+import json
+import zlib
+import threading
+
+import numpy as np
+
+from models.bm25_index import TOKEN_PATTERN
+
+MERSENNE_PRIME = (1 << 31) - 1
+SEED = 1729  # Fixed, so signatures stay comparable across restarts
+
+
+def shingles(text, size=5):
+    """
+    Word n-grams of a text, hashed to 32-bit integers.
+
+    Args:
+        text (str): Text to shingle
+        size (int): Words per shingle
+
+    Returns:
+        np.ndarray: Unique uint64 shingle hashes
+    """
+    words = TOKEN_PATTERN.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams),
+                                 dtype=np.uint64, count=len(grams)))
+
+
+class MinHashLSH:
+    """
+    Index of MinHash signatures bucketed by LSH bands.
+
+    A chunk's signature is split into `bands` bands; chunks sharing any band
+    are candidates, and a candidate is a near-duplicate when the share of
+    equal signature positions (an estimate of the shingle Jaccard
+    similarity) reaches `threshold`. Only canonical chunks are indexed;
+    the duplicates linked to each are kept alongside so they can be
+    promoted when the canonical chunk is deleted.
+
+    With a path, save() appends the changes made since the last save to a
+    journal next to the .npz file, which is only rewritten once the journal
+    has grown.
+    """
+    def __init__(self, path=None, num_perm=128, bands=16, threshold=0.85, shingle_size=5,
+                 checkpoint_min_journal=5000, checkpoint_journal_fraction=0.25):
+        """
+        Args:
+            path (str, optional): .npz file the index is persisted to
+            num_perm (int): Signature length
+            bands (int): LSH bands; num_perm must be a multiple of it
+            threshold (float): Estimated Jaccard similarity at which chunks are near-duplicates
+            shingle_size (int): Words per shingle
+            checkpoint_min_journal (int): Fewest journaled changes that trigger rewriting the .npz file
+            checkpoint_journal_fraction (float): Journaled changes, relative to the indexed chunks, that trigger it
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.checkpoint_min_journal = checkpoint_min_journal
+        self.checkpoint_journal_fraction = checkpoint_journal_fraction
+
+        rng = np.random.default_rng(SEED)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self.signatures = {}    # Canonical chunk id -> signature
+        self.duplicates = {}    # Canonical chunk id -> ids of chunks linked to it
+        self.chunk_total = 0    # Chunks in the store when last saved, to detect a stale index
+        self._buckets = [{} for _ in range(bands)]  # Band -> {band bytes: set of chunk ids}
+        self._lock = threading.RLock()
+        self._pending = []       # Journal records of changes made since the last save
+        self._journal_records = 0
+        self._journaled_chunk_total = 0
+        self._save_lock = threading.Lock()  # Serializes writes to the files
+
+        if path and (os.path.exists(path) or os.path.exists(self._journal_path)):
+            self.load()
+
+    @property
+    def _journal_path(self):
+        return os.path.splitext(self.path)[0] + '.journal.jsonl' if self.path else None
+
+    def _journal(self, record):
+        if self.path:
+            self._pending.append(record)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def signature(self, text):
+        """
+        MinHash signature of a text.
+
+        Args:
+            text (str): Text to sign
+
+        Returns:
+            np.ndarray: num_perm uint32 values
+        """
+        hashes = shingles(text, self.shingle_size)
+        if not len(hashes):
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint32)
+        # (a * x + b) mod p for every permutation and shingle; a, x < 2^32 so nothing overflows
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _bands(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key, signature):
+        """Index a canonical chunk"""
+        with self._lock:
+            self._add(key, signature)
+            self._journal({"op": "add", "key": key, "signature": signature.astype(np.uint32).tobytes().hex()})
+
+    def _add(self, key, signature):
+        with self._lock:
+            if key in self.signatures:
+                self._remove(key)
+            self.signatures[key] = signature
+            for band, bucket_key in enumerate(self._bands(signature)):
+                self._buckets[band].setdefault(bucket_key, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove a canonical chunk.
+
+        Returns:
+            list: IDs of the chunks that were linked to it
+        """
+        with self._lock:
+            self._journal({"op": "remove", "key": key})
+            return self._remove(key)
+
+    def _remove(self, key):
+        with self._lock:
+            signature = self.signatures.pop(key, None)
+            if signature is not None:
+                for band, bucket_key in enumerate(self._bands(signature)):
+                    bucket = self._buckets[band].get(bucket_key)
+                    if bucket is not None:
+                        bucket.discard(key)
+                        if not bucket:
+                            del self._buckets[band][bucket_key]
+            return self.duplicates.pop(key, [])
+
+    def query(self, signature):
+        """
+        Find the most similar indexed chunk.
+
+        Args:
+            signature (np.ndarray): Signature to look up
+
+        Returns:
+            tuple: (chunk id, estimated similarity) of the best match at or
+                above the threshold, or None
+        """
+        with self._lock:
+            candidates = set()
+            for band, bucket_key in enumerate(self._bands(signature)):
+                candidates.update(self._buckets[band].get(bucket_key, ()))
+            if not candidates:
+                return None
+
+            keys = sorted(candidates)
+            matrix = np.stack([self.signatures[key] for key in keys])
+            similarity = (matrix == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return keys[best], float(similarity[best])
+
+    def link(self, key, canonical):
+        """Record chunk `key` as a near-duplicate of `canonical`"""
+        with self._lock:
+            self._link(key, canonical)
+            self._journal({"op": "link", "key": key, "canonical": canonical})
+
+    def _link(self, key, canonical):
+        with self._lock:
+            linked = self.duplicates.setdefault(canonical, [])
+            if key not in linked:
+                linked.append(key)
+
+    def unlink(self, key, canonical):
+        """Forget that chunk `key` is a near-duplicate of `canonical`"""
+        with self._lock:
+            self._unlink(key, canonical)
+            self._journal({"op": "unlink", "key": key, "canonical": canonical})
+
+    def _unlink(self, key, canonical):
+        with self._lock:
+            linked = self.duplicates.get(canonical)
+            if linked and key in linked:
+                linked.remove(key)
+                if not linked:
+                    del self.duplicates[canonical]
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+            self._journal({"op": "clear"})
+
+    def _clear(self):
+        with self._lock:
+            self.signatures = {}
+            self.duplicates = {}
+            self._buckets = [{} for _ in range(self.bands)]
+
+    def save(self):
+        """
+        Persist the changes made since the last save, and chunk_total.
+
+        They are appended to the journal; the .npz file is rewritten once
+        the journal holds checkpoint_min_journal changes and
+        checkpoint_journal_fraction of the indexed chunks.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+                chunk_total = self.chunk_total
+            if chunk_total != self._journaled_chunk_total:
+                records.append({"op": "chunk_total", "value": chunk_total})
+            if records:
+                try:
+                    with open(self._journal_path, 'a', encoding='utf-8') as f:
+                        offset = f.tell()
+                        try:
+                            f.write("".join(json.dumps(record) + '\n' for record in records))
+                            f.flush()
+                        except Exception:
+                            # Drop the partial write so the next append starts on a clean line
+                            f.truncate(offset)
+                            raise
+                    self._journal_records += len(records)
+                    self._journaled_chunk_total = chunk_total
+                except Exception as e:
+                    with self._lock:
+                        self._pending[:0] = [record for record in records if record["op"] != "chunk_total"]
+                    print(f"Error saving near-duplicate index journal: {e}")
+                    return
+
+            if self._journal_records >= max(self.checkpoint_min_journal,
+                                            self.checkpoint_journal_fraction * len(self)):
+                self._checkpoint()
+
+    def checkpoint(self):
+        """Rewrite the .npz file with the whole index and start a new journal"""
+        if not self.path:
+            return
+        with self._save_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # Copy under the lock and serialize outside it
+        with self._lock:
+            keys = list(self.signatures)
+            signatures = (np.stack([self.signatures[key] for key in keys]) if keys
+                          else np.zeros((0, self.num_perm), dtype=np.uint32))
+            duplicates = {canonical: list(linked) for canonical, linked in self.duplicates.items()}
+            chunk_total = self.chunk_total
+            records, self._pending = self._pending, []
+        try:
+            tmp_path = self.path + '.tmp.npz'
+            np.savez(tmp_path, keys=np.asarray(keys, dtype=str), signatures=signatures,
+                     meta=np.asarray(json.dumps({
+                         "num_perm": self.num_perm,
+                         "bands": self.bands,
+                         "shingle_size": self.shingle_size,
+                         "chunk_total": chunk_total,
+                         "duplicates": duplicates
+                     })))
+            os.replace(tmp_path, self.path)
+            # A journal left behind by a failed removal only replays changes the file already holds
+            if os.path.exists(self._journal_path):
+                os.remove(self._journal_path)
+            self._journal_records = 0
+            self._journaled_chunk_total = chunk_total
+        except Exception as e:
+            with self._lock:
+                self._pending[:0] = records
+            print(f"Error saving near-duplicate index: {e}")
+
+    def load(self):
+        """Load the index from its .npz file and replay its journal"""
+        keys, signatures, meta = [], [], {}
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as data:
+                    keys = data["keys"].tolist()
+                    signatures = data["signatures"]
+                    meta = json.loads(str(data["meta"]))
+            except Exception as e:
+                print(f"Error loading near-duplicate index: {e}")
+                return
+
+            if (meta.get("num_perm"), meta.get("bands"), meta.get("shingle_size")) != \
+                    (self.num_perm, self.bands, self.shingle_size):
+                print("Near-duplicate index was built with other settings, ignoring it")
+                return
+
+        with self._lock:
+            self._clear()
+            for key, signature in zip(keys, signatures):
+                self._add(key, signature)
+            self.duplicates = meta.get("duplicates", {})
+            self.chunk_total = meta.get("chunk_total", 0)
+            self._replay_journal()
+            self._journaled_chunk_total = self.chunk_total
+        print(f"Loaded near-duplicate index with {len(self.signatures)} chunks")
+
+    def _replay_journal(self):
+        """Apply the changes journaled since the .npz file was written"""
+        self._journal_records = 0
+        if not os.path.exists(self._journal_path):
+            return
+        valid_length = 0
+        with open(self._journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("unterminated record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A save interrupted mid-write; later records cannot follow it
+                    print(f"Ignoring truncated near-duplicate index journal after {self._journal_records} records")
+                    break
+                op = record["op"]
+                if op == "add":
+                    self._add(record["key"], np.frombuffer(bytes.fromhex(record["signature"]), dtype=np.uint32))
+                elif op == "remove":
+                    self._remove(record["key"])
+                elif op == "link":
+                    self._link(record["key"], record["canonical"])
+                elif op == "unlink":
+                    self._unlink(record["key"], record["canonical"])
+                elif op == "clear":
+                    self._clear()
+                elif op == "chunk_total":
+                    self.chunk_total = record["value"]
+                valid_length += len(line)
+                self._journal_records += 1
+        if valid_length < os.path.getsize(self._journal_path):
+            with open(self._journal_path, 'r+b') as f:
+                f.truncate(valid_length)
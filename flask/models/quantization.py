@@ -0,0 +1,389 @@
+"""
+Compressed vector storage for the local VectorStore.
+
+Search runs over int8 or product-quantized codes held in memory, then the
+shortlist is re-scored exactly against full-precision vectors that stay on
+disk and are only paged in through a memory map.
+"""
+import os
+import numpy as np
+
+from models.vector_index import normalize, top_k
+
+# Rows scored per step, so decoding never materializes the whole corpus as float32
+SCORE_BLOCK_ROWS = 65536
+
+
+class ScalarQuantizer:
+    """
+    Symmetric per-dimension int8 quantizer (4x smaller than float32).
+    """
+    code_dtype = np.int8
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.scale = None
+
+    @property
+    def trained(self):
+        return self.scale is not None
+
+    def train(self, vectors):
+        """Fit the per-dimension scale to the given vectors"""
+        scale = np.abs(vectors).max(axis=0) / 127.0
+        scale[scale == 0] = 1e-8
+        self.scale = scale.astype(np.float32)
+
+    def encode(self, vectors):
+        """Quantize vectors to int8 codes"""
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def score(self, codes, query):
+        """Approximate inner products between the codes and a query"""
+        weighted_query = query * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weighted_query
+        return scores
+
+    def state(self):
+        return {"scale": self.scale}
+
+    def load_state(self, state):
+        self.scale = state["scale"]
+
+
+class ProductQuantizer:
+    """
+    Product quantizer: each vector is split into subvectors and every
+    subvector is replaced by the id of its nearest of 256 centroids.
+    With 4-dimension subvectors a 768-dim vector shrinks from 3072 to 192 bytes.
+    """
+    code_dtype = np.uint8
+
+    def __init__(self, dim, subvector_dim=4, iterations=20, seed=0):
+        # Pick the number of subvectors so that it divides the dimension
+        num_subvectors = max(dim // max(subvector_dim, 1), 1)
+        while dim % num_subvectors:
+            num_subvectors -= 1
+
+        self.dim = dim
+        self.num_subvectors = num_subvectors
+        self.subvector_dim = dim // num_subvectors
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None  # (num_subvectors, 256, subvector_dim)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _split(self, vectors):
+        return vectors.reshape(len(vectors), self.num_subvectors, self.subvector_dim)
+
+    def train(self, vectors):
+        """Run k-means independently in every subspace"""
+        rng = np.random.default_rng(self.seed)
+        subvectors = self._split(np.asarray(vectors, dtype=np.float32))
+        num_centroids = min(256, len(vectors))
+
+        centroids = np.zeros((self.num_subvectors, 256, self.subvector_dim), dtype=np.float32)
+        for j in range(self.num_subvectors):
+            data = subvectors[:, j, :]
+            centers = data[rng.choice(len(data), size=num_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(data, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assignment, data)
+                counts = np.bincount(assignment, minlength=num_centroids)[:, None]
+                filled = counts[:, 0] > 0
+                centers[filled] = sums[filled] / counts[filled]
+            centroids[j, :num_centroids] = centers
+            # Unused centroid slots repeat the first one so they are never the unique nearest
+            centroids[j, num_centroids:] = centers[0]
+        self.centroids = centroids
+
+    @staticmethod
+    def _nearest(data, centers):
+        distances = (
+            (data ** 2).sum(axis=1, keepdims=True)
+            - 2 * data @ centers.T
+            + (centers ** 2).sum(axis=1)
+        )
+        return distances.argmin(axis=1)
+
+    def encode(self, vectors):
+        """Replace each subvector by the id of its nearest centroid"""
+        subvectors = self._split(np.asarray(vectors, dtype=np.float32))
+        codes = np.empty((len(vectors), self.num_subvectors), dtype=np.uint8)
+        for j in range(self.num_subvectors):
+            codes[:, j] = self._nearest(subvectors[:, j, :], self.centroids[j])
+        return codes
+
+    def score(self, codes, query):
+        """Approximate inner products using per-subspace lookup tables"""
+        tables = np.einsum('mkd,md->mk', self.centroids, self._split(query[None, :])[0])
+        subspaces = np.arange(self.num_subvectors)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = tables[subspaces, block].sum(axis=1)
+        return scores
+
+    def state(self):
+        return {"centroids": self.centroids}
+
+    def load_state(self, state):
+        self.centroids = state["centroids"]
+
+
+QUANTIZERS = {
+    'int8': ScalarQuantizer,
+    'pq': ProductQuantizer
+}
+
+
+class QuantizedIndex:
+    """
+    Vector index that keeps only compressed codes resident.
+
+    Full-precision (normalized float32) rows are appended to a raw file on
+    disk and memory-mapped on demand. Queries score the codes first, then
+    re-rank `shortlist_factor * k` candidates exactly. Until `train_size`
+    vectors have been added the quantizer is untrained and search is exact.
+    """
+    def __init__(self, vectors_path, mode='int8', dim=None, pq_subvector_dim=4,
+                 train_size=1024, shortlist_factor=8):
+        """
+        Args:
+            vectors_path (str): Raw float32 file holding the full-precision rows
+            mode (str): 'int8' or 'pq'
+            dim (int, optional): Vector dimension, inferred on first add
+            pq_subvector_dim (int): Dimensions per PQ subvector
+            train_size (int): Vectors collected before the quantizer is trained
+            shortlist_factor (int): Candidates re-ranked exactly per requested result
+        """
+        if mode not in QUANTIZERS:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+
+        self.vectors_path = vectors_path
+        self.mode = mode
+        self.dim = dim
+        self.pq_subvector_dim = pq_subvector_dim
+        self.train_size = train_size
+        self.shortlist_factor = shortlist_factor
+
+        self.quantizer = None
+        self._codes = None
+        self._size = 0
+        self._mmap = None
+
+    def __len__(self):
+        return self._size
+
+    def _new_quantizer(self):
+        if self.mode == 'pq':
+            return ProductQuantizer(self.dim, subvector_dim=self.pq_subvector_dim)
+        return ScalarQuantizer(self.dim)
+
+    @property
+    def vectors(self):
+        """Full-precision rows, memory-mapped from disk"""
+        if self._size == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._mmap is None or len(self._mmap) != self._size:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._size, self.dim))
+        return self._mmap
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            return None
+        return self._codes[:self._size]
+
+    def _append_codes(self, codes):
+        start = self._size - len(codes)
+        if self._codes is None:
+            self._codes = np.zeros((max(1024, self._size), codes.shape[1]), dtype=codes.dtype)
+        elif self._size > len(self._codes):
+            grown = np.zeros((max(self._size, 2 * len(self._codes)), codes.shape[1]), dtype=codes.dtype)
+            grown[:start] = self._codes[:start]
+            self._codes = grown
+        self._codes[start:self._size] = codes
+
+    def _train(self):
+        print(f"Training {self.mode} quantizer on {self._size} vectors...")
+        self.quantizer = self._new_quantizer()
+        self.quantizer.train(np.asarray(self.vectors))
+        self._codes = None
+        self._append_codes(self.quantizer.encode(np.asarray(self.vectors)))
+
+    def add(self, vectors):
+        """
+        Append vectors: full precision to disk, codes to memory.
+
+        Args:
+            vectors (array-like): 2D array of shape (n, dim)
+
+        Returns:
+            np.ndarray: Row ids assigned to the new vectors
+        """
+        vectors = normalize(np.atleast_2d(vectors))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+
+        start = self._size
+        self._size += len(vectors)
+        self._mmap = None
+
+        if self.quantizer is not None:
+            self._append_codes(self.quantizer.encode(vectors))
+        elif self._size >= self.train_size:
+            self._train()
+
+        return np.arange(start, self._size)
+
+    def search(self, query, k=5, rows=None):
+        """
+        Find the k rows most similar to the query.
+
+        Args:
+            query (array-like): Query vector
+            k (int): Number of results to return
+            rows (np.ndarray, optional): Restrict scoring to these row ids
+
+        Returns:
+            tuple: (row ids, similarity scores), best first
+        """
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = normalize(query)
+        candidates = np.arange(self._size) if rows is None else np.asarray(rows, dtype=np.int64)
+
+        if self.quantizer is not None and len(candidates) > k * self.shortlist_factor:
+            codes = self.codes if rows is None else self.codes[candidates]
+            approx = self.quantizer.score(codes, query)
+            candidates = candidates[top_k(approx, k * self.shortlist_factor)]
+
+        # Exact re-ranking; sorted access keeps memory-mapped reads sequential
+        candidates = np.sort(candidates)
+        scores = np.asarray(self.vectors[candidates]) @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def compacted(self, rows, vectors_path):
+        """
+        Copy of the index holding only the given rows, in order, with its raw
+        vectors written to vectors_path. The quantizer and codes are reused,
+        and this index is left untouched so it can keep serving searches
+        (and appending rows) while the copy is built.
+
+        Args:
+            rows (np.ndarray): Row ids to keep
+            vectors_path (str): Raw vectors file of the copy
+
+        Returns:
+            QuantizedIndex: The compacted index
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = self.codes  # Read before the quantizer: codes only exist once it is trained
+        quantizer = self.quantizer
+        index = QuantizedIndex(vectors_path, self.mode, dim=self.dim, pq_subvector_dim=self.pq_subvector_dim,
+                               train_size=self.train_size, shortlist_factor=self.shortlist_factor)
+        source = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(int(rows[-1]) + 1, self.dim)) \
+            if len(rows) else None
+        with open(vectors_path, 'wb') as f:
+            for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+                f.write(np.asarray(source[rows[start:start + SCORE_BLOCK_ROWS]]).tobytes())
+        index._size = len(rows)
+
+        if quantizer is not None:
+            index.quantizer = quantizer
+            if codes is not None:
+                kept = codes[rows]
+            else:
+                kept = np.concatenate([quantizer.encode(np.asarray(index.vectors[start:start + SCORE_BLOCK_ROWS]))
+                                       for start in range(0, len(rows), SCORE_BLOCK_ROWS)]) if len(rows) else None
+            if kept is not None and len(kept):
+                index._append_codes(kept)
+        elif index._size >= index.train_size:
+            index._train()
+        return index
+
+    def memory_bytes(self):
+        """Bytes held in memory for scoring (codes plus quantizer parameters)"""
+        total = self._codes.nbytes if self._codes is not None else 0
+        if self.quantizer is not None:
+            total += sum(value.nbytes for value in self.quantizer.state().values())
+        return total
+
+    def save(self, path):
+        """Write codes and quantizer parameters (the raw vectors file is already on disk)"""
+        state = {"dim": np.array(self.dim or 0), "size": np.array(self._size)}
+        if self.quantizer is not None:
+            state["codes"] = self.codes
+            state.update(self.quantizer.state())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **state)
+        os.replace(tmp_path, path)
+
+    def load(self, path, rows=None, dim=None):
+        """
+        Load codes and quantizer parameters written with save().
+
+        Rows appended to the raw vectors file after that save are encoded
+        again (or trigger training), so codes only need saving now and then.
+
+        Args:
+            path (str): File written by save(); may be missing if codes were never saved
+            rows (int, optional): Rows of the raw vectors file to load. Defaults to the saved count.
+            dim (int, optional): Vector dimension, if nothing was saved yet
+        """
+        self._codes = None
+        self._mmap = None
+        self.quantizer = None
+        self.dim = dim
+        saved = 0
+        if os.path.exists(path):
+            with np.load(path) as state:
+                self.dim = int(state["dim"]) or dim
+                saved = int(state["size"])
+                if "codes" in state:
+                    self.quantizer = self._new_quantizer()
+                    self.quantizer.load_state({key: state[key] for key in state.files
+                                               if key not in ("dim", "size", "codes")})
+                    self._size = saved
+                    self._append_codes(state["codes"])
+        rows = saved if rows is None else rows
+        if rows < saved and self._codes is not None:
+            self._codes = self._codes[:rows].copy()
+        self._size = rows
+
+        # Drop rows appended after the last recorded one (e.g. after a crash)
+        expected_bytes = self._size * (self.dim or 0) * 4
+        actual_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if actual_bytes < expected_bytes:
+            raise ValueError(f"{self.vectors_path} holds fewer than {rows} vectors")
+        if actual_bytes > expected_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(expected_bytes)
+
+        if self._size > saved:
+            if self.quantizer is not None:
+                print(f"Encoding {self._size - saved} vectors added since the codes were saved")
+                vectors = self.vectors
+                total = self._size
+                for start in range(saved, total, SCORE_BLOCK_ROWS):
+                    end = min(start + SCORE_BLOCK_ROWS, total)
+                    self._size = end
+                    self._append_codes(self.quantizer.encode(np.asarray(vectors[start:end])))
+            elif self._size >= self.train_size:
+                self._train()
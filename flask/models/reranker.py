@@ -0,0 +1,169 @@
+"""
+Batched reranking shared by the Cohere reranker and a local offline scorer.
+"""
+import heapq
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from config import RERANK_BATCH_SIZE, RERANK_MAX_CONCURRENCY
+from models.bm25_index import tokenize
+
+
+def to_rerank_documents(chunks):
+    """
+    Normalize chunks (dicts with 'text' or plain strings) to dicts with 'text' and 'id'.
+
+    Args:
+        chunks (list): Chunks to rerank
+
+    Returns:
+        list: Dicts with 'text', 'id' and any other metadata of the chunk
+    """
+    documents = []
+    for i, chunk in enumerate(chunks):
+        if isinstance(chunk, dict) and 'text' in chunk:
+            doc = {
+                "text": chunk['text'],
+                "id": chunk.get('id', f"chunk_{i}")
+            }
+            # Add any additional metadata
+            for key, value in chunk.items():
+                if key not in ['text', 'id']:
+                    doc[key] = value
+            documents.append(doc)
+        else:
+            documents.append({
+                "text": chunk,
+                "id": f"chunk_{i}"
+            })
+    return documents
+
+
+def source_chunk_ids(chunks):
+    """
+    IDs the chunks carry themselves, or None for chunks without one.
+
+    Positional IDs assigned by to_rerank_documents differ between calls, so
+    only these are safe to cache scores under.
+    """
+    return [chunk.get('id') if isinstance(chunk, dict) else None for chunk in chunks]
+
+
+def rerank_in_batches(query, documents, top_n, score_batch, batch_size=RERANK_BATCH_SIZE,
+                      max_concurrency=RERANK_MAX_CONCURRENCY, score_cache=None, model=None, chunk_ids=None):
+    """
+    Score documents in bounded batches, concurrently, and merge into a global top-n.
+
+    With a score cache, documents already scored for this query are served
+    from it and only the misses are sent to score_batch.
+
+    Args:
+        query (str): The user query
+        documents (list): Dicts with at least a 'text' field
+        top_n (int): Number of documents to return
+        score_batch (callable): Takes (query, texts) and returns one relevance score per text
+        batch_size (int): Maximum documents per scoring call
+        max_concurrency (int): Maximum scoring calls in flight
+        score_cache (RerankScoreCache, optional): Cache of scores by (model, query, chunk ID)
+        model (str, optional): Model name used in the cache key
+        chunk_ids (list, optional): Cache key of each document, None to never cache it
+
+    Returns:
+        list: Up to top_n documents with a 'score' field, best first
+    """
+    if not documents or top_n <= 0:
+        return []
+
+    if score_cache is not None and chunk_ids is not None:
+        scores = score_cache.get_many(model, query, chunk_ids)
+    else:
+        scores = [None] * len(documents)
+
+    missing = [i for i, value in enumerate(scores) if value is None]
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+
+    def score(batch):
+        return score_batch(query, [documents[i]["text"] for i in batch])
+
+    if len(batches) == 1:
+        batch_scores = [score(batches[0])]
+    elif batches:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+            batch_scores = list(executor.map(score, batches))
+    else:
+        batch_scores = []
+
+    for batch, values in zip(batches, batch_scores):
+        for i, value in zip(batch, values):
+            scores[i] = float(value)
+
+    if score_cache is not None and chunk_ids is not None and missing:
+        score_cache.put_many(model, query, [chunk_ids[i] for i in missing], [scores[i] for i in missing])
+
+    # Ties are broken by input position, so results do not depend on batch timing or caching
+    best = heapq.nlargest(top_n, range(len(documents)), key=lambda i: (scores[i], -i))
+    return [{**documents[i], "score": scores[i]} for i in best]
+
+
+class LocalReranker:
+    """
+    Deterministic offline stand-in for the Cohere reranker.
+
+    Scores by saturated term overlap with the query. Each score depends
+    only on the query and the document, so batches can be merged like
+    Cohere's.
+    """
+    model_name = "local-term-overlap"
+
+    def __init__(self, batch_size=RERANK_BATCH_SIZE, max_concurrency=RERANK_MAX_CONCURRENCY, k1=1.2,
+                 score_cache=None):
+        """
+        Args:
+            batch_size (int): Maximum documents per scoring call
+            max_concurrency (int): Maximum scoring calls in flight
+            k1 (float): Term frequency saturation
+            score_cache (RerankScoreCache, optional): Cache of scores by (model, query, chunk ID)
+        """
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.k1 = k1
+        self.score_cache = score_cache
+
+    def score(self, query, texts):
+        """
+        Relevance of each text to the query, between 0 and 1.
+
+        Args:
+            query (str): The user query
+            texts (list): Texts to score
+
+        Returns:
+            list: One score per text
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return [0.0] * len(texts)
+
+        scores = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            matched = sum(counts[term] / (counts[term] + self.k1) for term in terms)
+            scores.append(matched / len(terms))
+        return scores
+
+    def rerank_chunks(self, query, chunks, top_n=5):
+        """
+        Rerank document chunks based on relevance to the query.
+
+        Args:
+            query (str): The user query
+            chunks (list): List of text chunks to rerank
+            top_n (int): Number of top chunks to return
+
+        Returns:
+            list: Ranked document chunks with scores and metadata
+        """
+        return rerank_in_batches(query, to_rerank_documents(chunks), top_n, self.score,
+                                 batch_size=self.batch_size, max_concurrency=self.max_concurrency,
+                                 score_cache=self.score_cache, model=f"{self.model_name}-k1={self.k1}",
+                                 chunk_ids=source_chunk_ids(chunks))
@@ -0,0 +1,658 @@
+"""
+Session-sharded wrapper around the local VectorStore.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from config import (
+    VECTOR_STORE_FOLDER, VECTOR_SHARD_MEMORY_BUDGET, VECTOR_SHARD_QUERY_LIMIT, INGEST_BATCH_SIZE, HYBRID_FUSION,
+    SEARCH_MODES, HYBRID_CANDIDATES_FACTOR, MMR_CANDIDATES_FACTOR
+)
+from models.bm25_index import tokenize
+from models.vector_store import VectorStore, read_documents, fuse_rankings, diversify_hits
+from utils.retrieval_cache import ContentGenerations
+
+SAFE_SHARD_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ShardedVectorStore:
+    """
+    Vector store that keeps one VectorStore (vectors, HNSW graph and BM25
+    index) per session.
+
+    Shards are opened on first access with their float32 vectors
+    memory-mapped, and the least recently used ones are dropped once the
+    resident shards exceed `memory_budget` bytes. A small catalog of
+    document metadata stays in memory so listing documents and routing
+    document or session scoped requests never opens a shard. Each shard's
+    BM25 statistics are kept in a small file next to it, so a search over
+    several shards opens each of them once, and at most `query_limit`.
+
+    Documents without a session live in the default shard at the root of
+    `store_dir`, which is also where an unsharded store keeps its data, so
+    existing stores keep working.
+    """
+    DEFAULT_SHARD = ''
+
+    def __init__(self, store_dir=None, memory_budget=VECTOR_SHARD_MEMORY_BUDGET,
+                 query_limit=VECTOR_SHARD_QUERY_LIMIT, **store_options):
+        """
+        Args:
+            store_dir (str, optional): Root directory of the store
+            memory_budget (int): Bytes the resident shards may use before LRU eviction
+            query_limit (int, optional): Most shards one search opens. None searches all.
+            **store_options: Passed to every shard's VectorStore (embeddings, storage, ...)
+        """
+        self.store_dir = store_dir or VECTOR_STORE_FOLDER
+        self.shards_dir = os.path.join(self.store_dir, 'shards')
+        self.memory_budget = memory_budget
+        self.query_limit = query_limit
+        self.store_options = store_options
+
+        self.catalog = {}            # Document id -> document metadata plus its shard key
+        self._shard_documents = {}   # Shard key -> document ids
+        self._session_documents = {} # Session id -> document ids
+        self._shards = OrderedDict() # Shard key -> VectorStore, least recently used first
+        self._shard_bytes = {}       # Shard key -> estimated resident bytes
+        self._pins = {}              # Shard key -> operations in progress
+        self._loading = {}           # Shard key -> lock held while the shard is opened
+        self._lexical_stats = {}     # Shard key -> BM25Index.term_stats() of the shard, read on first use
+        self.generations = ContentGenerations()  # Shared by all shards, so eviction does not reset them
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+        os.makedirs(self.shards_dir, exist_ok=True)
+        self._load_catalog()
+
+    # Catalog
+
+    @property
+    def _catalog_path(self):
+        return os.path.join(self.store_dir, 'catalog.json')
+
+    def _load_catalog(self):
+        """Load the document catalog, rebuilding it from the shards if it is missing"""
+        if os.path.exists(self._catalog_path):
+            try:
+                with open(self._catalog_path, 'r') as f:
+                    for document_id, document in json.load(f).items():
+                        self._remember(document_id, document)
+                print(f"Loaded catalog of {len(self.catalog)} documents in {len(self._shard_documents)} shards")
+                return
+            except Exception as e:
+                print(f"Error loading shard catalog, rebuilding it: {e}")
+                self.catalog, self._shard_documents, self._session_documents = {}, {}, {}
+
+        sources = [(self.DEFAULT_SHARD, self.store_dir)]
+        sources += [(None, os.path.join(self.shards_dir, name)) for name in sorted(os.listdir(self.shards_dir))]
+        for shard_key, path in sources:
+            if not os.path.exists(os.path.join(path, 'documents.json')):
+                continue
+            try:
+                documents = read_documents(path)
+            except Exception as e:
+                print(f"Error reading the documents of {path}: {e}")
+                continue
+            for document_id, document in documents.items():
+                key = shard_key if shard_key is not None else document.get("session_id") or self.DEFAULT_SHARD
+                self._remember(document_id, {**document, "shard": key})
+
+        if self.catalog:
+            self._save_catalog()
+            print(f"Rebuilt catalog of {len(self.catalog)} documents in {len(self._shard_documents)} shards")
+
+    def _save_catalog(self):
+        with self._lock:
+            try:
+                tmp_path = self._catalog_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.catalog, f)
+                os.replace(tmp_path, self._catalog_path)
+            except Exception as e:
+                print(f"Error saving shard catalog: {e}")
+
+    def _remember(self, document_id, document):
+        self._forget(document_id)
+        self.catalog[document_id] = document
+        self._shard_documents.setdefault(document["shard"], set()).add(document_id)
+        if document.get("session_id"):
+            self._session_documents.setdefault(document["session_id"], set()).add(document_id)
+
+    def _forget(self, document_id):
+        document = self.catalog.pop(document_id, None)
+        if document is None:
+            return
+        for index, key in ((self._shard_documents, document["shard"]),
+                           (self._session_documents, document.get("session_id"))):
+            if key in index:
+                index[key].discard(document_id)
+                if not index[key]:
+                    del index[key]
+
+    def _shard_keys(self, session_id=None, document_id=None):
+        """Shards holding documents that match the filters"""
+        with self._lock:
+            if document_id:
+                document = self.catalog.get(document_id)
+                if document is None or (session_id and document.get("session_id") != session_id):
+                    return []
+                return [document["shard"]]
+            if session_id:
+                return sorted({self.catalog[doc_id]["shard"] for doc_id in self._session_documents.get(session_id, ())})
+            return sorted(self._shard_documents)
+
+    # Lexical statistics
+
+    def _lexical_stats_path(self, key):
+        return os.path.join(self._shard_dir(key), 'lexical_stats.json')
+
+    def _update_lexical_stats(self, key, shard):
+        """Record the BM25 statistics of an open shard after it changed"""
+        # Serialized, so statistics taken earlier are never written over later ones
+        with self._stats_lock:
+            with self._lock:
+                document_count = len(self._shard_documents.get(key, ()))
+            stats = shard.lexical_index.term_stats()
+            with self._lock:
+                self._lexical_stats[key] = stats
+            try:
+                path = self._lexical_stats_path(key)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({"documents": document_count, "units": stats[0], "length": stats[1], "dfs": stats[2]}, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Error saving lexical statistics of shard {key!r}: {e}")
+        return stats
+
+    def _shard_lexical_stats(self, key):
+        """
+        BM25 statistics of a shard, read from its statistics file without opening it.
+
+        A shard without an up-to-date file is opened once to compute them.
+        """
+        with self._lock:
+            stats = self._lexical_stats.get(key)
+            document_count = len(self._shard_documents.get(key, ()))
+        if stats is not None:
+            return stats
+        try:
+            with open(self._lexical_stats_path(key), 'r') as f:
+                data = json.load(f)
+            # Written after every change; a count that differs means a change was not recorded
+            if data["documents"] == document_count:
+                stats = (data["units"], data["length"], data["dfs"])
+                with self._lock:
+                    self._lexical_stats[key] = stats
+                return stats
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading lexical statistics of shard {key!r}, recomputing them: {e}")
+        with self._use_shard(key) as shard:
+            return self._update_lexical_stats(key, shard)
+
+    def _query_stats(self, query, keys):
+        """
+        BM25 statistics of a query summed over shards, as BM25Index.query_stats would return for them as one.
+
+        Returns:
+            tuple: (stats, {shard key: units containing a query term})
+        """
+        terms = set(tokenize(query))
+        num_docs, total_length, dfs, matches = 0, 0, dict.fromkeys(terms, 0), {}
+        for key in keys:
+            shard_docs, shard_length, shard_dfs = self._shard_lexical_stats(key)
+            num_docs += shard_docs
+            total_length += shard_length
+            matches[key] = 0
+            for term in terms:
+                df = shard_dfs.get(term, 0)
+                dfs[term] += df
+                matches[key] += df
+        return (num_docs, total_length, dfs), matches
+
+    def _select_shards(self, keys, matches=None):
+        """
+        Shards one search opens, at most query_limit of them.
+
+        Resident shards come first since they cost nothing to search, then
+        those where the query's terms occur most, then the largest.
+
+        Args:
+            keys (list): Shards matching the search filters
+            matches (dict, optional): Shard key -> units containing a query term
+
+        Returns:
+            list: Shard keys
+        """
+        if self.query_limit is None or len(keys) <= self.query_limit:
+            return keys
+        with self._lock:
+            ranked = sorted(keys, key=lambda key: (key not in self._shards,
+                                                   -(matches or {}).get(key, 0),
+                                                   -len(self._shard_documents.get(key, ()))))
+        print(f"Searching {self.query_limit} of {len(keys)} shards")
+        return ranked[:self.query_limit]
+
+    # Shard residency
+
+    def _shard_dir(self, key):
+        if key == self.DEFAULT_SHARD:
+            return self.store_dir
+        if SAFE_SHARD_NAME.match(key):
+            name = key
+        else:
+            name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.shards_dir, name)
+
+    @contextmanager
+    def _use_shard(self, key):
+        """
+        Open a shard (or reuse the resident one) and keep it from being evicted while in use.
+
+        Shards are opened outside the store lock, so loading one from disk
+        does not hold up requests to the others.
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+            shard = self._shards.get(key)
+            if shard is None:
+                loading = self._loading.setdefault(key, threading.Lock())
+
+        try:
+            if shard is None:
+                with loading:
+                    # Another request may have opened it meanwhile
+                    with self._lock:
+                        shard = self._shards.get(key)
+                    if shard is None:
+                        shard = VectorStore(store_dir=self._shard_dir(key), mmap_vectors=True,
+                                            generations=self.generations, **self.store_options)
+                        with self._lock:
+                            self._shards[key] = shard
+                            self.loads += 1
+            with self._lock:
+                if key in self._shards:
+                    self._shards.move_to_end(key)
+            yield shard
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                if key in self._shards:
+                    self._shard_bytes[key] = shard.resident_bytes()
+                self._enforce_budget()
+
+    def _evictable(self, key):
+        shard = self._shards[key]
+        maintaining = shard._maintenance_thread is not None and shard._maintenance_thread.is_alive()
+        return key not in self._pins and not maintaining
+
+    def _enforce_budget(self):
+        """Drop least recently used shards until the resident ones fit the memory budget"""
+        total = sum(self._shard_bytes.get(key, 0) for key in self._shards)
+        # The most recently used shard always stays, even if it alone exceeds the budget
+        for key in list(self._shards)[:-1]:
+            if total <= self.memory_budget:
+                break
+            if self._evictable(key):
+                total -= self._shard_bytes.get(key, 0)
+                self._unload(key)
+                self.evictions += 1
+
+    def _unload(self, key):
+        shard = self._shards.pop(key, None)
+        self._shard_bytes.pop(key, None)
+        if shard is not None:
+            shard.release()
+
+    def _drop_if_empty(self, key):
+        """Delete the files of a session shard that no longer holds documents"""
+        while True:
+            with self._lock:
+                if key == self.DEFAULT_SHARD or key in self._shard_documents or key in self._pins:
+                    return
+                shard = self._shards.get(key)
+                thread = shard._maintenance_thread if shard is not None else None
+                if thread is None or not thread.is_alive():
+                    self._unload(key)
+                    self._loading.pop(key, None)
+                    self._lexical_stats.pop(key, None)
+                    shutil.rmtree(self._shard_dir(key), ignore_errors=True)
+                    return
+            # Let a running compaction or checkpoint finish first, without blocking other shards
+            thread.join()
+
+    # VectorStore interface
+
+    def add_document(self, document_id: str, title: str, content: str, source_path: Optional[str] = None,
+                     session_id: Optional[str] = None, metadata: Optional[Dict] = None) -> bool:
+        """
+        Chunk, embed and index a document in its session's shard.
+
+        Args:
+            document_id (str): Document identifier
+            title (str): Document title
+            content (str): Full text of the document
+            source_path (str, optional): Path of the original file
+            session_id (str, optional): Session to associate with the document
+            metadata (dict, optional): Additional document metadata
+
+        Returns:
+            bool: Success status
+        """
+        result = self.add_documents([{
+            "document_id": document_id,
+            "title": title,
+            "content": content,
+            "source_path": source_path,
+            "session_id": session_id,
+            "metadata": metadata
+        }])
+        return not result["failed"]
+
+    def add_documents(self, documents: List[Dict], batch_size: int = INGEST_BATCH_SIZE) -> Dict:
+        """
+        Index several documents, each in the shard of its session.
+
+        Args:
+            documents (list): Dicts as accepted by VectorStore.add_documents
+            batch_size (int): Chunks per embedding call
+
+        Returns:
+            dict: {"document_ids": ids of indexed documents,
+                   "failed": [{"document_id", "reason"}, ...]}
+        """
+        groups = {}
+        for document in documents:
+            groups.setdefault(document.get("session_id") or self.DEFAULT_SHARD, []).append(document)
+
+        indexed, failed = [], []
+        for key, group in groups.items():
+            # A document re-added under another session moves shards
+            with self._lock:
+                moved = [document["document_id"] for document in group
+                         if self.catalog.get(document["document_id"], {}).get("shard", key) != key]
+            for document_id in moved:
+                self.delete_document(document_id)
+
+            try:
+                with self._use_shard(key) as shard:
+                    result = shard.add_documents(group, batch_size=batch_size)
+                    with self._lock:
+                        for document_id in result["document_ids"]:
+                            self._remember(document_id, {**shard.documents[document_id], "shard": key})
+                    if result["document_ids"]:
+                        self._update_lexical_stats(key, shard)
+                indexed.extend(result["document_ids"])
+                failed.extend(result["failed"])
+            except Exception as e:
+                print(f"Error adding documents to shard {key!r}: {e}")
+                traceback.print_exc()
+                failed.extend({"document_id": document["document_id"], "reason": str(e)} for document in group)
+
+        if indexed:
+            self._save_catalog()
+        return {"document_ids": indexed, "failed": failed}
+
+    def search_similar(self, query: str, limit: int = 5, session_id: Optional[str] = None,
+                       document_id: Optional[str] = None, mode: str = 'vector',
+                       fusion: str = HYBRID_FUSION, mmr_lambda: Optional[float] = None,
+                       max_per_document: Optional[int] = None) -> List[Dict]:
+        """
+        Find the chunks most relevant to a query.
+
+        A query touching one shard is answered by it. Otherwise every
+        matching shard contributes its best candidates of each leg, lexical
+        scores computed with BM25 statistics summed over those shards, and
+        fusion and MMR run over the merged lists, so results rank as if
+        the shards were one store. The statistics come from the shards'
+        statistics files, so each shard is opened once; a lexical search
+        skips shards without any query term, and at most query_limit
+        shards are searched.
+
+        Args:
+            query (str): Search query
+            limit (int): Maximum number of results
+            session_id (str, optional): Only search documents from this session
+            document_id (str, optional): Only search this document
+            mode (str): 'vector', 'lexical' or 'hybrid'
+            fusion (str): How hybrid results are combined: 'rrf' or 'weighted'
+            mmr_lambda (float, optional): MMR relevance/novelty trade-off. None disables MMR.
+            max_per_document (int, optional): Results one document may contribute while others are left
+
+        Returns:
+            List[Dict]: Matching chunks, most relevant first
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        keys = self._shard_keys(session_id, document_id)
+        if len(keys) == 1:
+            with self._use_shard(keys[0]) as shard:
+                return shard.search_similar(query, limit=limit, session_id=session_id, document_id=document_id,
+                                            mode=mode, fusion=fusion, mmr_lambda=mmr_lambda,
+                                            max_per_document=max_per_document)
+
+        diversify = mmr_lambda is not None or bool(max_per_document)
+        shortlist = limit * MMR_CANDIDATES_FACTOR if diversify else limit
+        candidates = max(limit * HYBRID_CANDIDATES_FACTOR, shortlist) if mode == 'hybrid' else shortlist
+
+        stats, matches = None, None
+        if mode != 'vector':
+            # Corpus-wide document frequencies, so BM25 scores compare across shards
+            stats, matches = self._query_stats(query, keys)
+            if mode == 'lexical':
+                keys = [key for key in keys if matches[key]]
+        keys = self._select_shards(keys, matches)
+
+        # Shards stay open (and pinned) until the results are built, so none is
+        # evicted and opened again within the search; there are at most query_limit
+        opened = {}  # Shard key -> (ExitStack releasing it, shard)
+        try:
+            vector_hits, lexical_hits, owners = [], [], {}
+            for key in keys:
+                stack = ExitStack()
+                shard = stack.enter_context(self._use_shard(key))
+                opened[key] = (stack, shard)
+                if mode != 'lexical':
+                    hits = shard._vector_search(query, candidates, session_id, document_id)
+                    vector_hits.extend(hits)
+                    owners.update((chunk_id, key) for chunk_id, _ in hits)
+                if mode != 'vector':
+                    hits = shard._lexical_search(query, candidates, session_id, document_id, stats=stats)
+                    lexical_hits.extend(hits)
+                    owners.update((chunk_id, key) for chunk_id, _ in hits)
+            vector_hits = sorted(vector_hits, key=lambda hit: hit[1], reverse=True)[:candidates]
+            lexical_hits = sorted(lexical_hits, key=lambda hit: hit[1], reverse=True)[:candidates]
+
+            # Shards left without candidates are not needed any more
+            kept = {owners[chunk_id] for chunk_id, _ in vector_hits + lexical_hits}
+            for key in [key for key in opened if key not in kept]:
+                opened.pop(key)[0].close()
+
+            scores = {}
+            if mode == 'vector':
+                hits = vector_hits[:shortlist]
+            elif mode == 'lexical':
+                hits = lexical_hits[:shortlist]
+            else:
+                hits = fuse_rankings(vector_hits, lexical_hits, shortlist, fusion=fusion)
+                scores = {"vector_scores": dict(vector_hits), "lexical_scores": dict(lexical_hits)}
+
+            if diversify:
+                found = {}
+                for key, group in self._group_by_shard(hits, owners).items():
+                    group, vectors, documents = opened[key][1]._hit_vectors(group)
+                    found.update((chunk_id, (vector, document))
+                                 for (chunk_id, _), vector, document in zip(group, vectors, documents))
+                hits = [hit for hit in hits if hit[0] in found]
+                if hits:
+                    hits = diversify_hits(hits, np.array([found[chunk_id][0] for chunk_id, _ in hits]),
+                                          [found[chunk_id][1] for chunk_id, _ in hits], limit,
+                                          1.0 if mmr_lambda is None else mmr_lambda, max_per_document)
+            hits = hits[:limit]
+
+            results = {}
+            for key, group in self._group_by_shard(hits, owners).items():
+                results.update((result["chunk_id"], result) for result in opened[key][1]._build_results(group, **scores))
+            return [results[chunk_id] for chunk_id, _ in hits if chunk_id in results]
+        finally:
+            for stack, _ in opened.values():
+                stack.close()
+
+    @staticmethod
+    def _group_by_shard(hits, owners):
+        """Split (chunk id, score) hits by the shard holding them, keeping their order"""
+        groups = {}
+        for hit in hits:
+            groups.setdefault(owners[hit[0]], []).append(hit)
+        return groups
+
+    def content_generation(self, session_id: Optional[str] = None, document_id: Optional[str] = None) -> tuple:
+        """Generation of the content a search with these filters can see (see VectorStore.content_generation)"""
+        return self.generations.current(session_id, document_id)
+
+    def get_document_chunks(self, document_id: str) -> List[Dict]:
+        """
+        Get all chunks of a document in reading order.
+
+        Args:
+            document_id (str): Document identifier
+
+        Returns:
+            List[Dict]: List of chunks
+        """
+        for key in self._shard_keys(document_id=document_id):
+            with self._use_shard(key) as shard:
+                return shard.get_document_chunks(document_id)
+        return []
+
+    def _public(self, document):
+        return {k: v for k, v in document.items() if k != "shard"}
+
+    def get_documents_by_session(self, session_id: str) -> List[Dict]:
+        """
+        Get all documents for a specific session.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            List[Dict]: List of documents
+        """
+        with self._lock:
+            return [self._public(self.catalog[doc_id]) for doc_id in self._session_documents.get(session_id, ())]
+
+    def get_all_documents(self) -> List[Dict]:
+        """
+        Get all documents in the store.
+
+        Returns:
+            List[Dict]: List of documents
+        """
+        with self._lock:
+            return [self._public(document) for document in self.catalog.values()]
+
+    def delete_document(self, document_id: str) -> bool:
+        """
+        Delete a document and all its chunks.
+
+        Args:
+            document_id (str): Document identifier
+
+        Returns:
+            bool: Success status
+        """
+        keys = self._shard_keys(document_id=document_id)
+        if not keys:
+            return False
+
+        with self._use_shard(keys[0]) as shard:
+            deleted = shard.delete_document(document_id)
+            with self._lock:
+                self._forget(document_id)
+            self._update_lexical_stats(keys[0], shard)
+        self._save_catalog()
+        self._drop_if_empty(keys[0])
+        return deleted
+
+    def delete_session_documents(self, session_id: str) -> List[str]:
+        """
+        Delete every document of a session, removing its shard.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            List[str]: IDs of the deleted documents
+        """
+        deleted = []
+        keys = self._shard_keys(session_id=session_id)
+        for key in keys:
+            with self._use_shard(key) as shard:
+                shard_deleted = shard.delete_session_documents(session_id)
+                with self._lock:
+                    for document_id in shard_deleted:
+                        self._forget(document_id)
+                self._update_lexical_stats(key, shard)
+            deleted.extend(shard_deleted)
+        if deleted:
+            self._save_catalog()
+            print(f"Deleted {len(deleted)} documents of session {session_id}")
+        for key in keys:
+            self._drop_if_empty(key)
+        return deleted
+
+    def index_report(self, sample_size=200, k=10, session_id=None):
+        """
+        Report shard residency, or the HNSW report of one session's shards.
+
+        Args:
+            sample_size (int): Number of queries per shard report
+            k (int): Number of neighbours to compare
+            session_id (str, optional): Session whose shards to report on
+
+        Returns:
+            dict: Report
+        """
+        if session_id:
+            reports = {}
+            for key in self._shard_keys(session_id=session_id):
+                with self._use_shard(key) as shard:
+                    reports[key or "default"] = shard.index_report(sample_size=sample_size, k=k)
+            return {"sharded": True, "session_id": session_id, "shards": reports}
+
+        with self._lock:
+            return {
+                "sharded": True,
+                "shards": len(self._shard_documents),
+                "documents": len(self.catalog),
+                "resident_shards": len(self._shards),
+                "resident_bytes": sum(self._shard_bytes.get(key, 0) for key in self._shards),
+                "memory_budget": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+    def close(self):
+        """Flush every resident shard and the catalog to disk."""
+        with self._lock:
+            for key in list(self._shards):
+                self._shards.pop(key).close()
+            self._shard_bytes = {}
+        self._save_catalog()
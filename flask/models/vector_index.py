@@ -0,0 +1,424 @@
+"""
+In-process vector index structures used by the local VectorStore.
+"""
+import os
+import time
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+def normalize(vectors):
+    """
+    L2-normalize vectors so that the inner product equals cosine similarity.
+
+    Args:
+        vectors (array-like): A single vector or a 2D array of vectors
+
+    Returns:
+        np.ndarray: float32 array of unit-length vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Return the positions of the k highest scores, best first.
+
+    Uses argpartition so only the shortlist is fully sorted.
+
+    Args:
+        scores (np.ndarray): 1D array of scores
+        k (int): Number of positions to return
+
+    Returns:
+        np.ndarray: Positions into `scores`
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def mmr_select(relevance, vectors, k, lambda_mult=0.5, groups=None, max_per_group=None):
+    """
+    Greedy maximal marginal relevance selection over a shortlist.
+
+    Pairwise similarities come from a single matrix product; each step
+    then only updates the running maximum similarity to the selection.
+
+    Args:
+        relevance (np.ndarray): Relevance of each candidate, scaled to [0, 1]
+        vectors (np.ndarray): Unit-length candidate vectors, shape (n, dim)
+        k (int): Number of candidates to select
+        lambda_mult (float): 1 ranks by relevance only, 0 by novelty only
+        groups (array-like, optional): Group of each candidate, e.g. its document
+        max_per_group (int, optional): Candidates selected from one group before the
+            other groups are preferred; lifted once only capped groups remain
+
+    Returns:
+        list: Positions of the selected candidates, in selection order
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(n, dtype=np.float32)  # Max similarity to anything selected so far
+    available = np.ones(n, dtype=bool)
+    capped = np.zeros(n, dtype=bool)
+    if groups is not None and max_per_group:
+        _, group_codes = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+        group_counts = np.zeros(group_codes.max() + 1, dtype=np.int64)
+
+    selected = []
+    while len(selected) < k and available.any():
+        eligible = available & ~capped
+        if not eligible.any():
+            eligible = available  # Too few groups to fill k within the cap
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~eligible] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+        if groups is not None and max_per_group:
+            group = group_codes[best]
+            group_counts[group] += 1
+            if group_counts[group] >= max_per_group:
+                capped[group_codes == group] = True
+    return selected
+
+
+class FlatIndex:
+    """
+    Exact nearest-neighbour index over a contiguous float32 matrix.
+    Vectors are normalized on insert, so scores are cosine similarities.
+    With mmap=True a loaded matrix stays memory-mapped (read-only) until
+    the first insert copies it into memory.
+    With a vectors_path every inserted row is also appended to that raw
+    float32 file, so persisting the index never rewrites earlier rows.
+    """
+    def __init__(self, dim=None, initial_capacity=1024, mmap=False, vectors_path=None):
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.mmap = mmap
+        self.vectors_path = vectors_path
+        self._matrix = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        """View of the populated rows of the matrix"""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def _reserve(self, rows):
+        """Grow the backing matrix (amortized doubling) to hold `rows` rows"""
+        if self._matrix is None:
+            capacity = max(self.initial_capacity, rows)
+            self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        elif rows > len(self._matrix):
+            capacity = max(rows, 2 * len(self._matrix))
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+
+    def add(self, vectors):
+        """
+        Append vectors to the index.
+
+        Args:
+            vectors (array-like): 2D array of shape (n, dim)
+
+        Returns:
+            np.ndarray: Row ids assigned to the new vectors
+        """
+        vectors = normalize(np.atleast_2d(vectors))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+
+        if self.vectors_path:
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+
+        start = self._size
+        self._reserve(start + len(vectors))
+        self._matrix[start:start + len(vectors)] = vectors
+        self._size += len(vectors)
+        return np.arange(start, self._size)
+
+    def search(self, query, k=5, rows=None):
+        """
+        Find the k rows most similar to the query.
+
+        Args:
+            query (array-like): Query vector
+            k (int): Number of results to return
+            rows (np.ndarray, optional): Restrict scoring to these row ids
+
+        Returns:
+            tuple: (row ids, similarity scores), best first
+        """
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = normalize(query)
+        if rows is None:
+            scores = self.vectors @ query
+            best = top_k(scores, k)
+            return best, scores[best]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = self._matrix[rows] @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def compacted(self, rows, vectors_path):
+        """
+        Copy of the index holding only the given rows, in order, written to
+        vectors_path. This index is left untouched, so it can keep serving
+        searches (and appending rows) while the copy is built.
+
+        Args:
+            rows (np.ndarray): Row ids to keep
+            vectors_path (str): Raw vectors file of the copy
+
+        Returns:
+            FlatIndex: The compacted index
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        index = FlatIndex(self.dim, self.initial_capacity, mmap=self.mmap, vectors_path=vectors_path)
+        if len(rows):
+            # Rows below the current size never change, even if add() reallocates the matrix meanwhile
+            matrix = self._matrix
+            index._reserve(len(rows))
+            index._matrix[:len(rows)] = matrix[rows]
+            index._size = len(rows)
+        index.save_raw(vectors_path)
+        return index
+
+    def memory_bytes(self):
+        """Bytes held in memory by the matrix (for a memory map, the most it can page in)"""
+        return self._matrix.nbytes if self._matrix is not None else 0
+
+    def save(self, path):
+        """Write the populated rows to a .npy file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.vectors)
+        os.replace(tmp_path, path)
+
+    def save_raw(self, path):
+        """Write the populated rows to a raw float32 file, as add() appends them to vectors_path"""
+        tmp_path = path + '.tmp'
+        self.vectors.tofile(tmp_path)
+        os.replace(tmp_path, path)
+
+    def load_raw(self, path, rows, dim):
+        """
+        Load the first rows of a raw float32 file written by add() or save_raw().
+
+        Rows beyond them, appended before a crash, are dropped from the file.
+
+        Args:
+            path (str): Raw vectors file
+            rows (int): Number of rows to load
+            dim (int): Vector dimension
+        """
+        expected_bytes = rows * dim * 4
+        if os.path.getsize(path) < expected_bytes:
+            raise ValueError(f"{path} holds fewer than {rows} vectors")
+        if os.path.getsize(path) > expected_bytes:
+            with open(path, 'r+b') as f:
+                f.truncate(expected_bytes)
+
+        self.dim = dim
+        self._matrix = None
+        self._size = 0
+        if rows:
+            if self.mmap:
+                # Full, so the next add() copies it into a growable in-memory matrix
+                self._matrix = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dim))
+            else:
+                self._reserve(rows)
+                self._matrix[:rows] = np.fromfile(path, dtype=np.float32, count=rows * dim).reshape(rows, dim)
+            self._size = rows
+
+    def load(self, path):
+        """Load rows previously written with save()"""
+        vectors = np.load(path, mmap_mode='r' if self.mmap else None)
+        self._matrix = None
+        self._size = 0
+        if len(vectors):
+            self.dim = vectors.shape[1]
+            if self.mmap:
+                # Full, so the next add() copies it into a growable in-memory matrix
+                self._matrix = vectors
+            else:
+                self._reserve(len(vectors))
+                self._matrix[:len(vectors)] = vectors
+            self._size = len(vectors)
+
+
+class HNSWIndex:
+    """
+    Approximate nearest-neighbour index backed by an hnswlib HNSW graph.
+    Labels are the row ids of the companion FlatIndex, so results can be
+    mapped straight back to chunk metadata.
+    """
+    def __init__(self, dim, M=16, ef_construction=200, ef_search=64, initial_capacity=10000):
+        """
+        Args:
+            dim (int): Vector dimension
+            M (int): Number of graph neighbours per node
+            ef_construction (int): Candidate list size while inserting
+            ef_search (int): Candidate list size while querying
+            initial_capacity (int): Number of elements to allocate up front
+        """
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed. Install it with: pip install hnswlib")
+
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+        self._index = hnswlib.Index(space='ip', dim=dim)
+        self._index.init_index(max_elements=max(initial_capacity, 1), M=M, ef_construction=ef_construction)
+        self._index.set_ef(ef_search)
+
+    def __len__(self):
+        return self._index.get_current_count()
+
+    def add(self, vectors, rows):
+        """
+        Insert vectors into the graph.
+
+        Args:
+            vectors (array-like): 2D array of shape (n, dim)
+            rows (array-like): Row ids used as labels
+        """
+        vectors = normalize(np.atleast_2d(vectors))
+        needed = len(self) + len(vectors)
+        capacity = self._index.get_max_elements()
+        if needed > capacity:
+            self._index.resize_index(max(needed, 2 * capacity))
+        self._index.add_items(vectors, np.asarray(rows, dtype=np.int64))
+
+    def search(self, query, k=5, allowed=None):
+        """
+        Find approximately the k rows most similar to the query.
+
+        Args:
+            query (array-like): Query vector
+            k (int): Number of results to return
+            allowed (RoaringBitmap, optional): Only return rows in this set
+
+        Returns:
+            tuple: (row ids, similarity scores), best first
+        """
+        k = min(k, len(self) if allowed is None else len(allowed))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # ef must be at least k for hnswlib to return k results
+        self._index.set_ef(max(self.ef_search, k))
+        if allowed is None:
+            labels, distances = self._index.knn_query(normalize(query), k=k)
+        else:
+            labels, distances = self._index.knn_query(normalize(query), k=k, filter=allowed.__contains__)
+        # The 'ip' space reports 1 - inner product as the distance
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def save(self, path):
+        """Write the graph to disk"""
+        tmp_path = path + '.tmp'
+        self._index.save_index(tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, dim, ef_search=64):
+        """
+        Load a graph previously written with save().
+
+        Args:
+            path (str): Index file path
+            dim (int): Vector dimension
+            ef_search (int): Candidate list size while querying
+
+        Returns:
+            HNSWIndex: The loaded index
+        """
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed. Install it with: pip install hnswlib")
+
+        index = cls.__new__(cls)
+        index.dim = dim
+        index.ef_search = ef_search
+        index._index = hnswlib.Index(space='ip', dim=dim)
+        index._index.load_index(path)
+        index._index.set_ef(ef_search)
+        index.M = index._index.M
+        index.ef_construction = index._index.ef_construction
+        return index
+
+
+def recall_report(exact_index, ann_index, queries, k=10):
+    """
+    Compare an approximate index against exact search.
+
+    Args:
+        exact_index (FlatIndex): Index used as ground truth
+        ann_index (HNSWIndex): Approximate index under test
+        queries (array-like): 2D array of query vectors
+        k (int): Number of neighbours to compare
+
+    Returns:
+        dict: recall@k and per-query latency statistics in milliseconds
+    """
+    hits = 0
+    exact_times = []
+    ann_times = []
+
+    for query in np.atleast_2d(queries):
+        start = time.perf_counter()
+        exact_rows, _ = exact_index.search(query, k)
+        exact_times.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        ann_rows, _ = ann_index.search(query, k)
+        ann_times.append((time.perf_counter() - start) * 1000)
+
+        hits += len(set(exact_rows.tolist()) & set(ann_rows.tolist()))
+
+    total = max(len(exact_times) * min(k, len(exact_index)), 1)
+    return {
+        f"recall@{k}": hits / total,
+        "queries": len(exact_times),
+        "indexed_vectors": len(exact_index),
+        "exact_ms_mean": float(np.mean(exact_times)) if exact_times else 0.0,
+        "exact_ms_p95": float(np.percentile(exact_times, 95)) if exact_times else 0.0,
+        "ann_ms_mean": float(np.mean(ann_times)) if ann_times else 0.0,
+        "ann_ms_p95": float(np.percentile(ann_times, 95)) if ann_times else 0.0,
+        "M": ann_index.M,
+        "ef_construction": ann_index.ef_construction,
+        "ef_search": ann_index.ef_search
+    }
@@ -1,7 +1,12 @@
 import os
+import re
 import sys
 import json
+import hashlib
+import time
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pathlib import Path
 from datetime import datetime
@@ -21,43 +26,189 @@ from langchain import hub
 from langchain.agents import AgentExecutor
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
+from config import (
+    VECTOR_STORE_FOLDER, CHUNK_SIZE, CHUNK_OVERLAP, INGEST_BATCH_SIZE,
+    PARENT_CHILD_RETRIEVAL, CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP, PARENT_CHUNK_SIZE,
+    HNSW_MIN_CHUNKS, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, FILTERED_EXACT_MAX_ROWS,
+    VECTOR_STORAGE, PQ_SUBVECTOR_DIM, QUANTIZER_TRAIN_SIZE, QUANTIZED_SHORTLIST_FACTOR,
+    SEARCH_MODES, HYBRID_FUSION, HYBRID_CANDIDATES_FACTOR, RRF_K, HYBRID_VECTOR_WEIGHT,
+    COMPACTION_DEAD_FRACTION, CHECKPOINT_JOURNAL_FRACTION, CHECKPOINT_MIN_JOURNAL_ROWS, MMR_CANDIDATES_FACTOR
+)
+from models.vector_index import FlatIndex, HNSWIndex, hnswlib, recall_report, mmr_select, normalize
+from models.quantization import QuantizedIndex
+from models.bm25_index import BM25Index
+from utils.pdf_utils import chunk_text, chunk_spans, parent_span
+from utils.bitmap import RoaringBitmap
+from utils.embedding_cache import CachedEmbeddings, get_embedding_cache, embedding_model_name, embed_query_cached
+from utils.retrieval_cache import ContentGenerations
 
 
 # Load environment variables
 load_dotenv()
 
+# Process-wide embedding model and AstraDB client, created on first use
+_shared_lock = threading.Lock()
+_shared_embeddings = None
+_shared_vstore = None
+
+def get_embeddings():
+    """
+    Return the shared embedding model, loading it on first use.
+
+    Returns:
+        HuggingFaceEmbeddings: The process-wide embedding model
+    """
+    global _shared_embeddings
+    if _shared_embeddings is None:
+        with _shared_lock:
+            if _shared_embeddings is None:
+                start = time.time()
+                _shared_embeddings = HuggingFaceEmbeddings()
+                print(f"Loaded embedding model in {time.time() - start:.2f} seconds")
+    return _shared_embeddings
+
 def connect_to_vstore():
-    embeddings = HuggingFaceEmbeddings()
-    ASTRA_DB_API_ENDPOINT = os.getenv("ASTRA_DB_API_ENDPOINT")
-    ASTRA_DB_APPLICATION_TOKEN = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
-
-    vstore = AstraDBVectorStore(
-        embedding=embeddings,
-        collection_name="Doc",
-        api_endpoint=ASTRA_DB_API_ENDPOINT,
-        token=ASTRA_DB_APPLICATION_TOKEN,
-        namespace="MedDocs",
-    )
-    return vstore
+    """
+    Return the shared AstraDB vector store client, connecting on first use.
 
-def add_documents_to_vstore(texts: list):
+    Returns:
+        AstraDBVectorStore: The process-wide store client
+    """
+    global _shared_vstore
+    if _shared_vstore is None:
+        embeddings = get_embeddings()
+        with _shared_lock:
+            if _shared_vstore is None:
+                ASTRA_DB_API_ENDPOINT = os.getenv("ASTRA_DB_API_ENDPOINT")
+                ASTRA_DB_APPLICATION_TOKEN = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
+
+                # Chunks already embedded by this model are not sent to it again
+                _shared_vstore = AstraDBVectorStore(
+                    embedding=CachedEmbeddings(embeddings, get_embedding_cache()),
+                    collection_name="Doc",
+                    api_endpoint=ASTRA_DB_API_ENDPOINT,
+                    token=ASTRA_DB_APPLICATION_TOKEN,
+                    namespace="MedDocs",
+                )
+    return _shared_vstore
+
+def warm_up(connect_store=True):
+    """
+    Load the embedding model (and optionally connect to AstraDB) ahead of the first request.
+
+    Args:
+        connect_store (bool): Also open the AstraDB connection if credentials are configured
+
+    Returns:
+        dict: Health probe result after warming up
+    """
     try:
-        vstore = connect_to_vstore()
+        # One embedding call pulls the model weights into memory
+        get_embeddings().embed_query("warm up")
+    except Exception as e:
+        print(f"Error warming up embedding model: {e}")
+        traceback.print_exc()
 
-        for text in texts:
-            id=f"doc_{uuid.uuid4().hex[:10]}",
-            document = Document(
-                id=id,
-                page_content=text, 
-            )
-            
-            vstore.add_documents([document]) 
-        
-        return True, id
+    if connect_store and os.getenv("ASTRA_DB_API_ENDPOINT") and os.getenv("ASTRA_DB_APPLICATION_TOKEN"):
+        try:
+            connect_to_vstore()
+        except Exception as e:
+            print(f"Error connecting to AstraDB: {e}")
+            traceback.print_exc()
+
+    return health_probe()
+
+def health_probe():
+    """
+    Report the state of the shared embedding model and store client without loading them.
+
+    Returns:
+        dict: Readiness of each shared resource
+    """
+    return {
+        "embedding_model_loaded": _shared_embeddings is not None,
+        "embedding_model": getattr(_shared_embeddings, "model_name", None),
+        "astra_db_connected": _shared_vstore is not None,
+        "astra_db_configured": bool(os.getenv("ASTRA_DB_API_ENDPOINT") and os.getenv("ASTRA_DB_APPLICATION_TOKEN"))
+    }
+
+def bulk_add_documents_to_vstore(texts: list, ids: Optional[List[str]] = None,
+                                 metadatas: Optional[List[Dict]] = None, batch_size: int = INGEST_BATCH_SIZE) -> Dict:
+    """
+    Chunk texts and write them to AstraDB in batches.
+
+    Chunks of all texts are pooled so every write embeds and inserts up to
+    `batch_size` chunks at once. A failing batch only fails the documents
+    that had chunks in it; the remaining batches are still written.
+
+    Args:
+        texts (list): Document texts
+        ids (list, optional): Document ids, one per text. Generated if omitted.
+        metadatas (list, optional): Metadata dicts, one per text
+        batch_size (int): Chunks per embedding/write batch
+
+    Returns:
+        dict: {"document_ids": ids of fully written documents,
+               "failed": [{"index", "document_id", "reason"}, ...]}
+    """
+    ids = list(ids) if ids else [f"doc_{uuid.uuid4().hex[:10]}" for _ in texts]
+    metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+    failed = {}
+
+    chunks = []
+    for index, (document_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+        pieces = chunk_text(text or "", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        if not pieces:
+            failed[document_id] = {"index": index, "document_id": document_id, "reason": "No text to index"}
+            continue
+        for chunk_index, piece in enumerate(pieces):
+            chunks.append(Document(
+                id=f"{document_id}_chunk_{chunk_index}",
+                page_content=piece,
+                metadata={**metadata, "document_id": document_id, "chunk_index": chunk_index}
+            ))
 
+    try:
+        vstore = connect_to_vstore()
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error connecting to vector store: {e}")
+        traceback.print_exc()
+        return {
+            "document_ids": [],
+            "failed": [{"index": index, "document_id": document_id, "reason": str(e)}
+                       for index, document_id in enumerate(ids)]
+        }
+
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        try:
+            vstore.add_documents(batch, ids=[chunk.id for chunk in batch])
+        except Exception as e:
+            print(f"Error writing chunks {start}-{start + len(batch) - 1}: {e}")
+            for chunk in batch:
+                document_id = chunk.metadata["document_id"]
+                failed.setdefault(document_id, {
+                    "index": ids.index(document_id), "document_id": document_id, "reason": str(e)
+                })
+
+    return {
+        "document_ids": [document_id for document_id in ids if document_id not in failed],
+        "failed": sorted(failed.values(), key=lambda item: item["index"])
+    }
+
+def add_documents_to_vstore(texts: list):
+    """
+    Add texts to AstraDB.
+
+    Returns:
+        tuple: (success, id of the last document)
+    """
+    result = bulk_add_documents_to_vstore(texts)
+    if result["failed"] or not result["document_ids"]:
+        for failure in result["failed"]:
+            print(f"Error: {failure['document_id']}: {failure['reason']}")
         return False, 0
+    return True, result["document_ids"][-1]
 
 def query_database(query, k=1):
     vstore = connect_to_vstore()
@@ -91,34 +242,6 @@ def ask_llm(query, context):
 
     return result.content
 
-def get_documents_by_session(self, session_id: str) -> List[Dict]:
-    """
-    Get all documents for a specific session.
-
-    Args:
-        session_id (str): Session identifier
-
-    Returns:
-        List[Dict]: List of documents
-    """
-    pass
-
-def delete_document(self, document_id: str) -> bool:
-    """
-    Delete a document and all its chunks.
-
-    Args:
-        document_id (str): Document identifier
-
-    Returns:
-        bool: Success status
-    """
-    pass
-
-def close(self):
-    """Close the database connection."""
-    pass
-
 def summarizer(text):
     """Summarize the text using the Google Generative AI model."""
 
@@ -151,5 +274,1388 @@ def get_documents_by_ids(document_ids):
     return documents
 
 
+def fuse_rankings(vector_hits, lexical_hits, limit, fusion='rrf', rrf_k=RRF_K, vector_weight=HYBRID_VECTOR_WEIGHT):
+    """
+    Merge two ranked result lists into one.
+
+    Args:
+        vector_hits (list): (key, score) tuples from vector search, best first
+        lexical_hits (list): (key, score) tuples from BM25 search, best first
+        limit (int): Number of results to return
+        fusion (str): 'rrf' sums 1 / (rrf_k + rank) over both lists; 'weighted'
+            blends the min-max normalized scores using vector_weight
+        rrf_k (int): Rank offset of reciprocal-rank fusion
+        vector_weight (float): Weight of the vector scores in weighted fusion
+
+    Returns:
+        list: (key, fused score) tuples, best first
+    """
+    fused = {}
+    if fusion == 'rrf':
+        for hits in (vector_hits, lexical_hits):
+            for rank, (key, _) in enumerate(hits, start=1):
+                fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    elif fusion == 'weighted':
+        for hits, weight in ((vector_hits, vector_weight), (lexical_hits, 1.0 - vector_weight)):
+            if not hits:
+                continue
+            scores = [score for _, score in hits]
+            low, high = min(scores), max(scores)
+            for key, score in hits:
+                normalized = (score - low) / (high - low) if high > low else 1.0
+                fused[key] = fused.get(key, 0.0) + weight * normalized
+    else:
+        raise ValueError(f"Unknown fusion method: {fusion}")
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def diversify_hits(hits, vectors, documents, limit, mmr_lambda, max_per_document=None):
+    """
+    Re-select ranked hits with maximal marginal relevance.
+
+    Args:
+        hits (list): (key, score) tuples, best first
+        vectors (np.ndarray): Normalized vector of each hit
+        documents (list): Document id of each hit
+        limit (int): Number of hits to keep
+        mmr_lambda (float): Relevance/novelty trade-off
+        max_per_document (int, optional): Per-document cap
+
+    Returns:
+        list: Selected (key, score) tuples
+    """
+    if len(hits) <= 1:
+        return hits[:limit]
+
+    # Scores differ in scale between modes; MMR needs relevance comparable to cosine similarity
+    relevance = np.array([score for _, score in hits], dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+    selected = mmr_select(relevance, vectors, limit, lambda_mult=mmr_lambda,
+                          groups=documents, max_per_group=max_per_document)
+    return [hits[i] for i in selected]
+
+
+CHECKPOINT_FILE_PATTERN = re.compile(r"^(?:chunks|documents|bm25|hnsw|journal|codes_\w+|vectors)(?:\.(\d+))?\.(?:json|jsonl|bin|npz|f32)$")
+
+
+def generation_file(name, generation):
+    """
+    Name of a VectorStore checkpoint file in the given generation.
+
+    Generation 0 is the unversioned layout stores had before the manifest.
+
+    Args:
+        name (str): Unversioned file name, e.g. 'chunks.json'
+        generation (int): Checkpoint generation
+
+    Returns:
+        str: File name, e.g. 'chunks.3.json'
+    """
+    if not generation:
+        return name
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{generation}{extension}"
+
+
+def read_manifest(store_dir):
+    """
+    Current checkpoint of a saved VectorStore.
+
+    manifest.json names the generation whose files make up the last
+    complete checkpoint and the raw vectors file they refer to. It is
+    replaced in one step once all of them are written.
+
+    Args:
+        store_dir (str): Directory of the store
+
+    Returns:
+        tuple: (generation, vectors file name); (0, 'vectors.f32') without a manifest
+    """
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return 0, 'vectors.f32'
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    return manifest["generation"], manifest["vectors"]
+
+
+def read_journal(path):
+    """
+    Read the change journal a VectorStore keeps next to its last full save.
+
+    A torn last line (a crash while appending) ends the journal.
+
+    Args:
+        path (str): Journal file
+
+    Returns:
+        tuple: (header dict, list of change records); ({}, []) if there is no journal
+    """
+    if not os.path.exists(path):
+        return {}, []
+    header, records = {}, []
+    with open(path, 'r') as f:
+        for number, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Ignoring a truncated entry at the end of {path}")
+                break
+            if number == 0 and "checkpoint_rows" in record:
+                header = record
+            else:
+                records.append(record)
+    return header, records
+
+
+def read_documents(store_dir):
+    """
+    Document metadata of a saved VectorStore, without loading its chunks or vectors.
+
+    Args:
+        store_dir (str): Directory of the store
+
+    Returns:
+        dict: Document id -> document metadata
+    """
+    documents = {}
+    generation = read_manifest(store_dir)[0]
+    documents_path = os.path.join(store_dir, generation_file('documents.json', generation))
+    if os.path.exists(documents_path):
+        with open(documents_path, 'r') as f:
+            documents = json.load(f)
+    for record in read_journal(os.path.join(store_dir, generation_file('journal.jsonl', generation)))[1]:
+        if record["op"] == "add":
+            documents[record["document"]["document_id"]] = record["document"]
+        elif record["op"] == "delete":
+            documents.pop(record["document_id"], None)
+    return documents
+
+
+class VectorStore:
+    """
+    In-process vector store for document chunks.
+
+    Chunk embeddings live in a contiguous float32 matrix (FlatIndex) and are
+    scored with a single vectorized dot product per query, so retrieval does
+    not leave the process. Once the store grows past HNSW_MIN_CHUNKS an HNSW
+    graph is built over the same rows and used for unfiltered queries.
+    With storage='int8' or 'pq' only compressed codes stay in memory and the
+    float32 rows are memory-mapped from disk for exact re-ranking. No HNSW
+    graph is built over compressed storage: hnswlib keeps its own float32
+    copy of every vector, which would cancel the memory saving.
+    Per-session and per-document posting bitmaps restrict filtered queries to
+    the admissible rows, so their cost follows the session size.
+    A BM25 index over the same chunks backs lexical and hybrid search.
+    Deletes only tombstone rows and append a line to a journal replayed
+    over the last full save; a background compaction physically drops
+    them, and rewrites the metadata, once they make up
+    COMPACTION_DEAD_FRACTION of the store.
+    With parent-child retrieval, small child windows are embedded and
+    matched, and each result carries the larger parent span around its
+    window, read by byte offset from the document text stored once per
+    document.
+    Chunk and document metadata are kept alongside and everything is
+    persisted under VECTOR_STORE_FOLDER: vectors are appended to a raw file
+    and every added or deleted document to the journal as it happens, while
+    the full metadata, BM25 index, codes and HNSW graph are only rewritten
+    by a background checkpoint once the journal has grown, by compaction
+    and on close. Rows added to the graph since it was saved are inserted
+    again on load.
+    Each checkpoint is written as a new generation of files (compaction
+    also writes a new vectors file) and manifest.json is switched to it
+    only once all of them are on disk, so a crash or a concurrent reader
+    never sees a half-written set.
+    """
+    def __init__(self, store_dir=None, embeddings=None, chunk_size=None, chunk_overlap=None,
+                 hnsw_min_chunks=HNSW_MIN_CHUNKS, hnsw_m=HNSW_M, hnsw_ef_construction=HNSW_EF_CONSTRUCTION,
+                 hnsw_ef_search=HNSW_EF_SEARCH, storage=VECTOR_STORAGE, embedding_cache=None,
+                 compaction_dead_fraction=COMPACTION_DEAD_FRACTION, mmap_vectors=False, generations=None,
+                 parent_size=PARENT_CHUNK_SIZE if PARENT_CHILD_RETRIEVAL else None):
+        """
+        Initialize the VectorStore and load any previously saved state.
+
+        Args:
+            store_dir (str, optional): Directory holding the persisted index
+            embeddings (Embeddings, optional): LangChain embeddings object. Defaults to the shared model.
+            chunk_size (int, optional): Size of text chunks for embedding. Defaults to CHILD_CHUNK_SIZE
+                with parent-child retrieval, CHUNK_SIZE without.
+            chunk_overlap (int, optional): Overlap between chunks. Defaults like chunk_size.
+            hnsw_min_chunks (int): Chunk count at which the HNSW graph is built. None disables it, as does
+                compressed storage.
+            hnsw_m (int): HNSW neighbours per node
+            hnsw_ef_construction (int): HNSW candidate list size while inserting
+            hnsw_ef_search (int): HNSW candidate list size while querying
+            storage (str): 'float32' keeps full vectors in memory; 'int8' or 'pq' keeps compressed codes
+            embedding_cache (EmbeddingCache, optional): Cache of chunk embeddings. Defaults to the shared cache.
+            compaction_dead_fraction (float): Fraction of deleted rows that triggers compaction. None disables it.
+            mmap_vectors (bool): Memory-map saved float32 vectors instead of reading them into memory
+            generations (ContentGenerations, optional): Change counters to bump, e.g. shared by the shards of a store
+            parent_size (int, optional): Characters of context served around each matched chunk. None serves
+                the chunk itself.
+        """
+        self.store_dir = store_dir or VECTOR_STORE_FOLDER
+        self.parent_size = parent_size
+        if chunk_size is None:
+            chunk_size = CHILD_CHUNK_SIZE if parent_size else CHUNK_SIZE
+        if chunk_overlap is None:
+            chunk_overlap = CHILD_CHUNK_OVERLAP if parent_size else CHUNK_OVERLAP
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._embeddings = embeddings
+        self._embedding_cache = embedding_cache
+
+        self.hnsw_min_chunks = hnsw_min_chunks if hnswlib is not None else None
+        self.hnsw_params = {
+            "M": hnsw_m,
+            "ef_construction": hnsw_ef_construction,
+            "ef_search": hnsw_ef_search
+        }
+        if hnsw_min_chunks is not None and hnswlib is None:
+            print("Warning: hnswlib not installed, vector search will use exact scoring only")
+        if storage != 'float32':
+            # The graph would hold a float32 copy of every vector next to the codes
+            self.hnsw_min_chunks = None
+
+        self.storage = storage
+        self.mmap_vectors = mmap_vectors
+        self.index = None  # Vector index, created by _load over the checkpoint's vectors file
+        self.ann_index = None  # HNSW graph over the same rows, built lazily
+        self.chunks = []      # Row id -> chunk metadata
+        self.documents = {}   # Document id -> document metadata
+        self.session_rows = {}   # Session id -> RoaringBitmap of row ids
+        self.document_rows = {}  # Document id -> RoaringBitmap of row ids
+        self.live_rows = RoaringBitmap()  # Rows not tombstoned
+        self.dead_rows = RoaringBitmap()  # Tombstoned rows awaiting compaction
+        self.compaction_dead_fraction = compaction_dead_fraction
+        self._maintenance_thread = None  # Background compaction or checkpoint
+        self._checkpoint_rows = 0  # Chunk rows in the last full save, which the journal applies to
+        self._journal_rows = 0     # Rows added or deleted since then
+        self.checkpoint_journal_fraction = CHECKPOINT_JOURNAL_FRACTION
+        self.checkpoint_min_journal_rows = CHECKPOINT_MIN_JOURNAL_ROWS
+        self.generations = generations or ContentGenerations()  # Invalidate cached retrieval results
+        self.filtered_exact_max_rows = FILTERED_EXACT_MAX_ROWS
+        self._lock = threading.RLock()  # Guards the in-memory state; searches hold it briefly
+        self._write_lock = threading.RLock()  # Serializes changes and saves, taken before _lock
+        self._compaction_lock = threading.Lock()
+        self._compaction_deletes = None  # Documents deleted while a compaction is building, in order
+        self._compaction_generation = None  # Generation a running compaction writes its files under
+        self._generation = 0  # Checkpoint generation loaded or last saved; 0 is the unversioned layout
+        self._next_generation = 1
+        self._vectors_name = 'vectors.f32'  # Raw vectors file of that checkpoint, appended to since
+        self._search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hybrid-search')
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.lexical_index = BM25Index()  # Keyed by chunk_id, loaded with the checkpoint
+        self.chunk_rows = {}  # Chunk id -> row id
+        self._load()
+
+    @property
+    def embeddings(self):
+        """Embedding model, created on first use"""
+        if self._embeddings is None:
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    @property
+    def embedding_cache(self):
+        """Chunk embedding cache, opened on first use"""
+        if self._embedding_cache is None:
+            self._embedding_cache = get_embedding_cache()
+        return self._embedding_cache
+
+    def _embed_documents(self, texts):
+        """Embed chunk texts, reusing cached embeddings of identical chunks"""
+        return self.embedding_cache.embed(
+            embedding_model_name(self.embeddings), texts, self.embeddings.embed_documents
+        )
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name)
+
+    def _generation_path(self, name, generation=None):
+        """Path of a checkpoint file in a generation, the current one by default"""
+        return self._path(generation_file(name, self._generation if generation is None else generation))
+
+    @property
+    def _codes_name(self):
+        return f'codes_{self.storage}.npz'
+
+    def _new_index(self):
+        """Create an empty index for the configured storage mode"""
+        if self.storage == 'float32':
+            return FlatIndex(mmap=self.mmap_vectors, vectors_path=self._path(self._vectors_name))
+
+        return QuantizedIndex(
+            self._path(self._vectors_name),
+            mode=self.storage,
+            pq_subvector_dim=PQ_SUBVECTOR_DIM,
+            train_size=QUANTIZER_TRAIN_SIZE,
+            shortlist_factor=QUANTIZED_SHORTLIST_FACTOR
+        )
+
+    def _load(self):
+        """
+        Load the persisted index and metadata, if any.
+
+        Raises:
+            Exception: If the saved store cannot be read. Its files are left
+                untouched so nothing is lost; the error says what to repair.
+        """
+        self._generation, self._vectors_name = read_manifest(self.store_dir)
+        self._next_generation = max([self._generation] + self._stored_generations()) + 1
+        self.index = self._new_index()
+        chunks_path = self._generation_path('chunks.json')
+        documents_path = self._generation_path('documents.json')
+        bm25_path = self._generation_path('bm25.json')
+
+        if not self._generation and not os.path.exists(chunks_path) and not os.path.exists(self._journal_path):
+            self._set_aside_raw_vectors()
+            return
+
+        try:
+            if os.path.exists(chunks_path):
+                with open(chunks_path, 'r') as f:
+                    self.chunks = json.load(f)
+                with open(documents_path, 'r') as f:
+                    self.documents = json.load(f)
+            if os.path.exists(bm25_path):
+                self.lexical_index.load(bm25_path)
+            self._checkpoint_rows = len(self.chunks)
+            dim = self._replay_journal()
+            migrated = False
+            if self.chunks:
+                migrated = self._load_vectors(dim)
+            self._rebuild_postings()
+            self._load_ann()
+            if len(self.lexical_index) != len(self.live_rows):
+                self._build_lexical_index()
+            print(f"Loaded {len(self.documents)} documents ({len(self.live_rows)} chunks, "
+                  f"{len(self.dead_rows)} deleted) into vector store")
+            if migrated:
+                self.save()
+        except Exception as e:
+            print(f"Error loading vector store from {self.store_dir}, leaving its files as they are: {e}")
+            traceback.print_exc()
+            raise
+
+    @property
+    def _journal_path(self):
+        return self._generation_path('journal.jsonl')
+
+    def _append_journal(self, record, rows):
+        """Record a change made since the last full save (caller holds the lock)"""
+        if not os.path.exists(self._journal_path):
+            self._reset_journal()
+        with open(self._journal_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self._journal_rows += rows
+
+    def _reset_journal(self, path=None, checkpoint_rows=None, dim=None):
+        """Start an empty journal on top of a checkpoint, the current one by default"""
+        path = path or self._journal_path
+        header = {
+            "checkpoint_rows": self._checkpoint_rows if checkpoint_rows is None else checkpoint_rows,
+            "dim": self.index.dim if dim is None else dim
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+        os.replace(tmp_path, path)
+
+    def _replay_journal(self):
+        """
+        Apply the changes journaled since the last full save to the loaded metadata.
+
+        Returns:
+            int: Vector dimension recorded in the journal, or None
+        """
+        header, records = read_journal(self._journal_path)
+        dim = header.get("dim")
+        if not records:
+            return dim
+        if header.get("checkpoint_rows") != self._checkpoint_rows:
+            # Written before the metadata that was loaded, which already includes it
+            print("Ignoring a vector store journal older than the saved metadata")
+            return dim
+
+        document_rows = {}
+        for row, chunk in enumerate(self.chunks):
+            if not chunk.get("deleted"):
+                document_rows.setdefault(chunk["document_id"], []).append(row)
+        for record in records:
+            if record["op"] == "add":
+                if record["row"] != len(self.chunks):
+                    print(f"Vector store journal does not match the saved rows at row {record['row']}, "
+                          f"ignoring the rest of it")
+                    break
+                document = record["document"]
+                document_rows[document["document_id"]] = list(range(record["row"], record["row"] + len(record["chunks"])))
+                self.documents[document["document_id"]] = document
+                for chunk in record["chunks"]:
+                    self.chunks.append(chunk)
+                    self.lexical_index.add(chunk["chunk_id"], chunk["content"], document_id=chunk["document_id"])
+                dim = dim or record.get("dim")
+                self._journal_rows += len(record["chunks"])
+            elif record["op"] == "delete":
+                document_id = record["document_id"]
+                self.documents.pop(document_id, None)
+                rows = document_rows.pop(document_id, ())
+                for row in rows:
+                    self.chunks[row]["deleted"] = True
+                self.lexical_index.remove_document(document_id)
+                self._journal_rows += len(rows)
+        print(f"Replayed {len(records)} journaled vector store changes")
+        return dim
+
+    def _build_lexical_index(self):
+        """Re-index every chunk in the BM25 index"""
+        print(f"Building BM25 index over {len(self.live_rows)} chunks...")
+        self.lexical_index.clear()
+        for chunk in self.chunks:
+            if not chunk.get("deleted"):
+                self.lexical_index.add(chunk["chunk_id"], chunk["content"], document_id=chunk["document_id"])
+
+    def _rebuild_postings(self):
+        """Recompute the session and document bitmaps from chunk metadata"""
+        (self.chunk_rows, self.session_rows, self.document_rows,
+         self.live_rows, self.dead_rows) = self._build_postings(self.chunks)
+
+    @staticmethod
+    def _build_postings(chunks, include_deleted=False):
+        """
+        Build the row postings of a chunk list.
+
+        Args:
+            chunks (list): Chunk metadata by row
+            include_deleted (bool): Treat tombstoned rows as live, for chunks that may be tombstoned meanwhile
+
+        Returns:
+            tuple: (chunk id -> row, session id -> bitmap, document id -> bitmap, live rows, dead rows)
+        """
+        chunk_rows = {}
+        session_groups = {}
+        document_groups = {}
+        live = []
+        dead = []
+        for row, chunk in enumerate(chunks):
+            if chunk.get("deleted") and not include_deleted:
+                dead.append(row)
+                continue
+            live.append(row)
+            chunk_rows[chunk["chunk_id"]] = row
+            document_groups.setdefault(chunk["document_id"], []).append(row)
+            if chunk.get("session_id"):
+                session_groups.setdefault(chunk["session_id"], []).append(row)
+        session_rows = {session_id: RoaringBitmap(rows) for session_id, rows in session_groups.items()}
+        document_rows = {document_id: RoaringBitmap(rows) for document_id, rows in document_groups.items()}
+        return chunk_rows, session_rows, document_rows, RoaringBitmap(live), RoaringBitmap(dead)
+
+    def _stored_generations(self):
+        """Generation numbers of the checkpoint files in the store directory"""
+        generations = []
+        for name in os.listdir(self.store_dir):
+            match = CHECKPOINT_FILE_PATTERN.match(name)
+            if match and match.group(1):
+                generations.append(int(match.group(1)))
+        return generations
+
+    def _remove_stale_files(self):
+        """
+        Delete checkpoint files the manifest no longer refers to: earlier
+        generations, ones left by a crash, and the legacy embeddings.npy.
+        Files of a compaction still being written are kept (caller holds the write lock).
+        """
+        for name in os.listdir(self.store_dir):
+            match = CHECKPOINT_FILE_PATTERN.match(name)
+            if name != 'embeddings.npy':
+                if not match or name == self._vectors_name:
+                    continue
+                if int(match.group(1) or 0) in (self._generation, self._compaction_generation):
+                    continue
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass  # Still open elsewhere (e.g. memory-mapped on Windows); removed after the next save
+
+    def _set_aside_raw_vectors(self):
+        """Rename raw vectors that no saved metadata refers to, so new rows do not land behind them"""
+        raw_path = self._path(self._vectors_name)
+        if os.path.exists(raw_path) and os.path.getsize(raw_path):
+            aside_path = f"{raw_path}.orphaned-{int(time.time())}"
+            print(f"Moving raw vectors without metadata to {aside_path}")
+            os.replace(raw_path, aside_path)
+
+    def _load_vectors(self, dim):
+        """
+        Load the vectors of every chunk row from vectors.f32, converting a
+        store saved as embeddings.npy by earlier versions.
+
+        Args:
+            dim (int): Vector dimension recorded in the journal, if any
+
+        Returns:
+            bool: True if the vectors were converted and need a full save
+        """
+        legacy_path = self._path('embeddings.npy')
+        raw_path = self._path(self._vectors_name)
+        rows = len(self.chunks)
+
+        if os.path.exists(legacy_path):
+            vectors = np.load(legacy_path)
+            print(f"Converting {len(vectors)} stored vectors to {self.storage} storage")
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+            self.index.add(vectors)
+            return True
+        if not os.path.exists(raw_path):
+            raise FileNotFoundError("No stored vectors found for the saved chunks")
+
+        if self.storage != 'float32':
+            self.index.load(self._generation_path(self._codes_name), rows=rows, dim=dim)
+            return False
+
+        if dim is None:
+            # Saved by the quantized storage modes, which record the dimension with their codes
+            for name in ('codes_int8.npz', 'codes_pq.npz'):
+                if os.path.exists(self._generation_path(name)):
+                    with np.load(self._generation_path(name)) as state:
+                        dim = int(state["dim"]) or None
+                if dim:
+                    break
+        if dim is None:
+            raise ValueError("Unknown dimension of the stored vectors")
+        self.index.load_raw(raw_path, rows, dim)
+        return False
+
+    def _load_ann(self):
+        """Load the persisted HNSW graph, rebuilding it if it is missing or stale"""
+        if self.hnsw_min_chunks is None or len(self.index) < self.hnsw_min_chunks:
+            return
+
+        hnsw_path = self._generation_path('hnsw.bin')
+        if os.path.exists(hnsw_path):
+            try:
+                ann_index = HNSWIndex.load(hnsw_path, self.index.dim, ef_search=self.hnsw_params["ef_search"])
+                if len(ann_index) <= len(self.index):
+                    # Rows added since the graph was last saved
+                    missing = np.arange(len(ann_index), len(self.index))
+                    if len(missing):
+                        print(f"Adding {len(missing)} rows to the saved HNSW index")
+                        ann_index.add(self.index.vectors[missing], missing)
+                    self.ann_index = ann_index
+                    return
+                print("HNSW index is out of date, rebuilding")
+            except Exception as e:
+                print(f"Error loading HNSW index: {e}")
+
+        self._build_ann()
+
+    def _build_ann(self):
+        """Build the HNSW graph over every row of the flat index"""
+        self.ann_index = self._new_ann(self.index)
+
+    def _new_ann(self, index):
+        """HNSW graph over every row of an index"""
+        print(f"Building HNSW index over {len(index)} chunks...")
+        ann_index = HNSWIndex(
+            index.dim,
+            M=self.hnsw_params["M"],
+            ef_construction=self.hnsw_params["ef_construction"],
+            ef_search=self.hnsw_params["ef_search"],
+            initial_capacity=len(index)
+        )
+        ann_index.add(index.vectors, np.arange(len(index)))
+        return ann_index
+
+    def _update_ann(self, rows):
+        """Insert newly added rows into the HNSW graph, building it once the threshold is crossed"""
+        if self.ann_index is not None:
+            self.ann_index.add(self.index.vectors[rows], rows)
+        elif self.hnsw_min_chunks is not None and len(self.index) >= self.hnsw_min_chunks:
+            self._build_ann()
+
+    def save(self):
+        """
+        Write a full checkpoint: codes, HNSW graph, chunk and document
+        metadata, the BM25 index and an empty journal, as a new generation.
+
+        Vectors are already on disk, appended as they were added. Changes
+        wait for the checkpoint; searches keep running.
+        """
+        with self._write_lock:
+            try:
+                start = time.time()
+                with self._lock:
+                    generation = self._next_generation
+                    self._next_generation += 1
+                self._write_checkpoint(generation, self._vectors_name, self.index, self.ann_index, self.chunks)
+                with self._lock:
+                    self._generation = generation
+                    self._checkpoint_rows = len(self.chunks)
+                    self._journal_rows = 0
+                self._remove_stale_files()
+                print(f"Saved vector store checkpoint of {len(self.chunks)} rows in {time.time() - start:.2f} seconds")
+            except Exception as e:
+                print(f"Error saving vector store: {e}")
+
+    def _write_checkpoint(self, generation, vectors_name, index, ann_index, chunks):
+        """
+        Write every file of a checkpoint generation, then point the manifest at it (caller holds the write lock).
+
+        Args:
+            generation (int): Generation to write, not yet in use
+            vectors_name (str): Raw vectors file holding the rows of index
+            index (FlatIndex or QuantizedIndex): Vector index
+            ann_index (HNSWIndex, optional): Graph over the index
+            chunks (list): Chunk metadata by row
+        """
+        if self.storage != 'float32':
+            index.save(self._generation_path(self._codes_name, generation))
+        if ann_index is not None:
+            ann_index.save(self._generation_path('hnsw.bin', generation))
+        self.lexical_index.save(self._generation_path('bm25.json', generation))
+        for name, data in (('chunks.json', chunks), ('documents.json', self.documents)):
+            with open(self._generation_path(name, generation), 'w') as f:
+                json.dump(data, f)
+        self._reset_journal(self._generation_path('journal.jsonl', generation), len(chunks), index.dim)
+
+        tmp_path = self._path('manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({"generation": generation, "vectors": vectors_name}, f)
+        os.replace(tmp_path, self._path('manifest.json'))
+
+    def add_document(self, document_id: str, title: str, content: str, source_path: Optional[str] = None,
+                     session_id: Optional[str] = None, metadata: Optional[Dict] = None) -> bool:
+        """
+        Chunk, embed and index a document.
+
+        Args:
+            document_id (str): Document identifier
+            title (str): Document title
+            content (str): Full text of the document
+            source_path (str, optional): Path of the original file
+            session_id (str, optional): Session to associate with the document
+            metadata (dict, optional): Additional document metadata
+
+        Returns:
+            bool: Success status
+        """
+        result = self.add_documents([{
+            "document_id": document_id,
+            "title": title,
+            "content": content,
+            "source_path": source_path,
+            "session_id": session_id,
+            "metadata": metadata
+        }])
+        return not result["failed"]
+
+    def add_documents(self, documents: List[Dict], batch_size: int = INGEST_BATCH_SIZE) -> Dict:
+        """
+        Chunk, embed and index several documents at once.
+
+        Chunks of all documents are embedded together in batches of
+        `batch_size`, then inserted; each document's vectors and journal
+        entry are appended to disk as it is inserted. A failing embedding
+        batch only fails the documents that had chunks in it.
+
+        Args:
+            documents (list): Dicts with document_id, title and content, and
+                optionally source_path, session_id and metadata
+            batch_size (int): Chunks per embedding call
+
+        Returns:
+            dict: {"document_ids": ids of indexed documents,
+                   "failed": [{"document_id", "reason"}, ...]}
+        """
+        failed = {}
+        pending = []  # (document, chunk texts, parent byte spans)
+        for document in documents:
+            document_id = document["document_id"]
+            texts, parents = self._chunk_document(document.get("content") or "")
+            if texts:
+                pending.append((document, texts, parents))
+            else:
+                print(f"No text to index for document {document_id}")
+                failed[document_id] = "No text to index"
+
+        # Embed the pooled chunks batch by batch
+        owners = [document["document_id"] for document, texts, _ in pending for _ in texts]
+        all_texts = [text for _, texts, _ in pending for text in texts]
+        all_vectors = [None] * len(all_texts)
+        for start in range(0, len(all_texts), batch_size):
+            try:
+                vectors = self._embed_documents(all_texts[start:start + batch_size])
+                all_vectors[start:start + len(vectors)] = vectors
+            except Exception as e:
+                print(f"Error embedding chunks {start}-{start + batch_size - 1}: {e}")
+                traceback.print_exc()
+                for document_id in set(owners[start:start + batch_size]):
+                    failed.setdefault(document_id, str(e))
+
+        indexed = []
+        with self._write_lock, self._lock:
+            offset = 0
+            for document, texts, parents in pending:
+                document_id = document["document_id"]
+                vectors = all_vectors[offset:offset + len(texts)]
+                offset += len(texts)
+                if document_id in failed:
+                    continue
+                try:
+                    self._insert_document(document, texts, vectors, parents)
+                    indexed.append(document_id)
+                    print(f"Indexed document {document_id} with {len(texts)} chunks")
+                except Exception as e:
+                    print(f"Error adding document {document_id} to vector store: {e}")
+                    traceback.print_exc()
+                    failed[document_id] = str(e)
+
+        # Re-added documents leave their previous rows tombstoned
+        self._maybe_maintain()
+        return {
+            "document_ids": indexed,
+            "failed": [{"document_id": document_id, "reason": reason} for document_id, reason in failed.items()]
+        }
+
+    def _chunk_document(self, content):
+        """
+        Split a document into the chunks that are embedded.
+
+        Returns:
+            tuple: (chunk texts, parent (start, end) byte offsets into the
+                UTF-8 content per chunk, or None without parent-child retrieval)
+        """
+        spans = chunk_spans(content, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        texts = [content[start:end] for start, end in spans]
+        if not self.parent_size:
+            return texts, None
+
+        parents = [parent_span(content, start, end, self.parent_size) for start, end in spans]
+        # Character offsets to byte offsets, encoding each stretch of the text once
+        offsets = sorted({offset for parent in parents for offset in parent})
+        byte_offsets = {}
+        position, size = 0, 0
+        for offset in offsets:
+            size += len(content[position:offset].encode('utf-8'))
+            byte_offsets[offset] = size
+            position = offset
+        return texts, [[byte_offsets[start], byte_offsets[end]] for start, end in parents]
+
+    def _text_path(self, document_id):
+        """File holding a document's full text, read by parent spans"""
+        name = hashlib.sha1(document_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, 'texts', f"{name}.txt")
+
+    def _read_parent(self, document_id, start, end):
+        """Read a parent span (byte offsets) from a document's stored text, or None if it is gone"""
+        try:
+            with open(self._text_path(document_id), 'rb') as f:
+                f.seek(start)
+                return f.read(end - start).decode('utf-8')
+        except OSError:
+            return None
+
+    def _insert_document(self, document, texts, vectors, parents=None):
+        """Add an embedded document's rows, postings and metadata (caller holds the lock)"""
+        document_id = document["document_id"]
+        session_id = document.get("session_id")
+        if document_id in self.documents:
+            self._tombstone_document(document_id)
+
+        if parents is not None:
+            # Stored once per document; results read their parent spans from it
+            text_path = self._text_path(document_id)
+            os.makedirs(os.path.dirname(text_path), exist_ok=True)
+            with open(text_path, 'wb') as f:
+                f.write((document.get("content") or "").encode('utf-8'))
+
+        rows = self.index.add(vectors)  # Appended to vectors.f32
+        self._update_ann(rows)
+        self.live_rows.add_many(rows)
+        self.document_rows[document_id] = RoaringBitmap(rows)
+        if session_id:
+            self.session_rows.setdefault(session_id, RoaringBitmap()).add_many(rows)
+        for chunk_index, (row, text) in enumerate(zip(rows, texts)):
+            chunk_id = f"{document_id}_chunk_{chunk_index}"
+            chunk = {
+                "chunk_id": chunk_id,
+                "document_id": document_id,
+                "session_id": session_id,
+                "title": document["title"],
+                "chunk_index": chunk_index,
+                "content": text
+            }
+            if parents is not None:
+                chunk["parent_offsets"] = parents[chunk_index]
+            self.chunks.append(chunk)
+            self.chunk_rows[chunk_id] = int(row)
+            self.lexical_index.add(chunk_id, text, document_id=document_id)
+
+        self.documents[document_id] = {
+            "document_id": document_id,
+            "title": document["title"],
+            "source_path": document.get("source_path"),
+            "session_id": session_id,
+            "metadata": document.get("metadata") or {},
+            "chunk_count": len(texts),
+            "created_at": datetime.now().isoformat()
+        }
+        self._append_journal({
+            "op": "add",
+            "row": int(rows[0]),
+            "dim": self.index.dim,
+            "document": self.documents[document_id],
+            "chunks": self.chunks[int(rows[0]):]
+        }, len(rows))
+        self.generations.bump(session_id, document_id)
+
+    def _filter_rows(self, session_id=None, document_id=None):
+        """
+        Admissible rows for the filters.
+
+        Returns:
+            RoaringBitmap: Matching row ids, or None when unfiltered
+        """
+        if not session_id and not document_id:
+            return None
+
+        allowed = None
+        if document_id:
+            allowed = self.document_rows.get(document_id, RoaringBitmap())
+        if session_id:
+            session = self.session_rows.get(session_id, RoaringBitmap())
+            allowed = session if allowed is None else allowed & session
+        return allowed
+
+    def search_similar(self, query: str, limit: int = 5, session_id: Optional[str] = None,
+                       document_id: Optional[str] = None, mode: str = 'vector',
+                       fusion: str = HYBRID_FUSION, mmr_lambda: Optional[float] = None,
+                       max_per_document: Optional[int] = None) -> List[Dict]:
+        """
+        Find the chunks most relevant to a query.
+
+        With mmr_lambda or max_per_document set, a shortlist of
+        limit * MMR_CANDIDATES_FACTOR hits is re-selected with maximal
+        marginal relevance, so overlapping windows of the same passage do
+        not fill the results.
+
+        Args:
+            query (str): Search query
+            limit (int): Maximum number of results
+            session_id (str, optional): Only search documents from this session
+            document_id (str, optional): Only search this document
+            mode (str): 'vector' (embedding similarity), 'lexical' (BM25) or 'hybrid' (both, fused)
+            fusion (str): How hybrid results are combined: 'rrf' or 'weighted'
+            mmr_lambda (float, optional): MMR relevance/novelty trade-off, 1 = relevance only. None disables MMR.
+            max_per_document (int, optional): Results one document may contribute while others are left
+
+        Returns:
+            List[Dict]: Matching chunks, most relevant first (in MMR selection order when diversified)
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        with self._lock:
+            if not self.live_rows:
+                return []
+            allowed = self._filter_rows(session_id, document_id)
+            if allowed is not None and not allowed:
+                return []
+
+        diversify = mmr_lambda is not None or bool(max_per_document)
+        shortlist = limit * MMR_CANDIDATES_FACTOR if diversify else limit
+        scores = {}
+
+        if mode == 'vector':
+            hits = self._vector_search(query, shortlist, session_id, document_id)
+        elif mode == 'lexical':
+            hits = self._lexical_search(query, shortlist, session_id, document_id)
+        else:
+            # Both legs run at once; the lexical one finishes while the query is being embedded
+            candidates = max(limit * HYBRID_CANDIDATES_FACTOR, shortlist)
+            lexical_future = self._search_executor.submit(
+                self._lexical_search, query, candidates, session_id, document_id
+            )
+            vector_hits = self._vector_search(query, candidates, session_id, document_id)
+            lexical_hits = lexical_future.result()
+            hits = fuse_rankings(vector_hits, lexical_hits, shortlist, fusion=fusion)
+            scores = {"vector_scores": dict(vector_hits), "lexical_scores": dict(lexical_hits)}
+
+        if diversify:
+            hits = self._diversify(hits, limit, 1.0 if mmr_lambda is None else mmr_lambda, max_per_document)
+        return self._build_results(hits, **scores)
+
+    def _diversify(self, hits, limit, mmr_lambda, max_per_document=None):
+        """
+        Re-select hits with maximal marginal relevance over their stored vectors.
+
+        Args:
+            hits (list): (chunk id, score) tuples, best first
+            limit (int): Number of hits to keep
+            mmr_lambda (float): Relevance/novelty trade-off
+            max_per_document (int, optional): Per-document cap
+
+        Returns:
+            list: Selected (chunk id, score) tuples
+        """
+        hits, vectors, documents = self._hit_vectors(hits)
+        return diversify_hits(hits, vectors, documents, limit, mmr_lambda, max_per_document)
+
+    def _hit_vectors(self, hits):
+        """
+        Stored vectors and document ids of hits, for MMR.
+
+        Args:
+            hits (list): (chunk id, score) tuples
+
+        Returns:
+            tuple: (hits still indexed, their normalized vectors, their document ids)
+        """
+        with self._lock:
+            hits = [(chunk_id, score) for chunk_id, score in hits if chunk_id in self.chunk_rows]
+            if not hits:
+                return [], np.empty((0, self.index.dim or 0), dtype=np.float32), []
+            rows = np.array([self.chunk_rows[chunk_id] for chunk_id, _ in hits], dtype=np.int64)
+            vectors = normalize(self.index.vectors[rows])
+            documents = [self.chunks[row]["document_id"] for row in rows]
+        return hits, vectors, documents
+
+    def _vector_search(self, query, limit, session_id=None, document_id=None):
+        """
+        Embedding similarity leg of search_similar.
+
+        Returns:
+            list: (chunk id, cosine similarity) tuples, best first
+        """
+        query_vector = embed_query_cached(self.embeddings, query)
+
+        with self._lock:
+            # Re-read the postings: the store may have changed while embedding
+            allowed = self._filter_rows(session_id, document_id)
+            if allowed is None and self.dead_rows:
+                # Tombstoned rows are still indexed until compaction, so search the live ones
+                allowed = self.live_rows
+            if allowed is None:
+                if self.ann_index is not None:
+                    best_rows, scores = self.ann_index.search(query_vector, k=limit)
+                else:
+                    best_rows, scores = self.index.search(query_vector, k=limit)
+            elif not allowed:
+                return []
+            elif self.ann_index is not None and len(allowed) > self.filtered_exact_max_rows:
+                best_rows, scores = self.ann_index.search(query_vector, k=limit, allowed=allowed)
+            else:
+                best_rows, scores = self.index.search(query_vector, k=limit, rows=allowed.to_array())
+            return [(self.chunks[row]["chunk_id"], float(score)) for row, score in zip(best_rows, scores)]
+
+    def _lexical_search(self, query, limit, session_id=None, document_id=None, stats=None):
+        """
+        BM25 leg of search_similar.
+
+        Args:
+            stats (tuple, optional): Corpus statistics to score against (see BM25Index.query_stats)
+
+        Returns:
+            list: (chunk id, BM25 score) tuples, best first
+        """
+        allowed_keys = None
+        with self._lock:
+            allowed = self._filter_rows(session_id, document_id)
+            if allowed is not None:
+                allowed_keys = {self.chunks[row]["chunk_id"] for row in allowed}
+        return self.lexical_index.search(query, k=limit, allowed=allowed_keys, stats=stats)
+
+    def _build_results(self, hits, vector_scores=None, lexical_scores=None):
+        """
+        Attach chunk and document metadata to (chunk id, score) hits.
+
+        Chunks with a parent span return it as their content (the matched
+        window moves to 'matched_text'); hits whose parent spans overlap in
+        the same document are merged into the better-ranked one.
+        """
+        results = []
+        parents_by_document = {}  # Document id -> results carrying parent spans
+        with self._lock:
+            for chunk_id, score in hits:
+                row = self.chunk_rows.get(chunk_id)
+                if row is None:
+                    continue  # Deleted while searching
+                chunk = self.chunks[row]
+                document = self.documents.get(chunk["document_id"], {})
+
+                offsets = chunk.get("parent_offsets")
+                if offsets:
+                    merged = False
+                    for other in parents_by_document.get(chunk["document_id"], []):
+                        other_offsets = other["parent_offsets"]
+                        if offsets[0] < other_offsets[1] and other_offsets[0] < offsets[1]:
+                            other["parent_offsets"] = [min(offsets[0], other_offsets[0]),
+                                                       max(offsets[1], other_offsets[1])]
+                            merged = True
+                            break
+                    if merged:
+                        continue
+
+                result = {
+                    **chunk,
+                    "metadata": document.get("metadata", {}),
+                    "similarity": float(score)
+                }
+                if vector_scores is not None:
+                    result["vector_similarity"] = vector_scores.get(chunk_id)
+                    result["lexical_score"] = lexical_scores.get(chunk_id)
+                if offsets:
+                    result["parent_offsets"] = list(offsets)
+                    parents_by_document.setdefault(chunk["document_id"], []).append(result)
+                results.append(result)
+
+        for result in results:
+            if "parent_offsets" in result:
+                parent = self._read_parent(result["document_id"], *result["parent_offsets"])
+                if parent is not None:
+                    result["matched_text"] = result["content"]
+                    result["content"] = parent
+        return results
+
+    def get_document_chunks(self, document_id: str) -> List[Dict]:
+        """
+        Get all chunks of a document in reading order.
+
+        Args:
+            document_id (str): Document identifier
+
+        Returns:
+            List[Dict]: List of chunks
+        """
+        with self._lock:
+            rows = self.document_rows.get(document_id, RoaringBitmap()).to_array()
+            chunks = [dict(self.chunks[row]) for row in rows]
+        return sorted(chunks, key=lambda chunk: chunk["chunk_index"])
+
+    def get_documents_by_session(self, session_id: str) -> List[Dict]:
+        """
+        Get all documents for a specific session.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            List[Dict]: List of documents
+        """
+        with self._lock:
+            return [dict(doc) for doc in self.documents.values() if doc.get("session_id") == session_id]
+
+    def get_all_documents(self) -> List[Dict]:
+        """
+        Get all documents in the store.
+
+        Returns:
+            List[Dict]: List of documents
+        """
+        with self._lock:
+            return [dict(doc) for doc in self.documents.values()]
+
+    def delete_document(self, document_id: str) -> bool:
+        """
+        Delete a document and all its chunks.
+
+        Rows are tombstoned immediately, which only appends a line to the
+        journal, and dropped from the index by a background compaction later.
+
+        Args:
+            document_id (str): Document identifier
+
+        Returns:
+            bool: Success status
+        """
+        with self._write_lock, self._lock:
+            if document_id not in self.documents:
+                return False
+
+            self._tombstone_document(document_id)
+        self._maybe_maintain()
+        return True
+
+    def delete_session_documents(self, session_id: str) -> List[str]:
+        """
+        Delete every document of a session.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            List[str]: IDs of the deleted documents
+        """
+        with self._write_lock, self._lock:
+            document_ids = [doc_id for doc_id, doc in self.documents.items() if doc.get("session_id") == session_id]
+            for document_id in document_ids:
+                self._tombstone_document(document_id)
+        if document_ids:
+            print(f"Deleted {len(document_ids)} documents of session {session_id}")
+            self._maybe_maintain()
+        return document_ids
+
+    def _tombstone_document(self, document_id):
+        """Mark a document's rows as deleted and drop it from the postings (caller holds the lock)"""
+        rows = self.document_rows.pop(document_id, RoaringBitmap())
+        row_array = rows.to_array()
+        session_id = self.documents.pop(document_id).get("session_id")
+
+        self.live_rows.discard_many(row_array)
+        self.dead_rows.add_many(row_array)
+        if session_id in self.session_rows:
+            self.session_rows[session_id].discard_many(row_array)
+            if not self.session_rows[session_id]:
+                del self.session_rows[session_id]
+        for row in row_array:
+            chunk = self.chunks[row]
+            chunk["deleted"] = True
+            self.chunk_rows.pop(chunk["chunk_id"], None)
+        self.lexical_index.remove_document(document_id)
+        if os.path.exists(self._text_path(document_id)):
+            os.remove(self._text_path(document_id))
+        self._append_journal({"op": "delete", "document_id": document_id}, len(row_array))
+        if self._compaction_deletes is not None:
+            self._compaction_deletes.append(document_id)
+        self.generations.bump(session_id, document_id)
+
+    def content_generation(self, session_id: Optional[str] = None, document_id: Optional[str] = None) -> tuple:
+        """
+        Generation of the content a search with these filters can see.
+
+        It changes whenever a matching document is added or deleted, so
+        cached search results keyed by it are never served stale.
+
+        Args:
+            session_id (str, optional): Session filter
+            document_id (str, optional): Document filter
+
+        Returns:
+            tuple: Opaque generation counters
+        """
+        return self.generations.current(session_id, document_id)
+
+    @property
+    def dead_fraction(self):
+        """Fraction of indexed rows that are tombstoned"""
+        return len(self.dead_rows) / len(self.chunks) if self.chunks else 0.0
+
+    def _maybe_maintain(self):
+        """
+        Start a background compaction if enough rows are tombstoned, or a
+        checkpoint if the journal has grown enough, unless one is running.
+        """
+        compact = self.compaction_dead_fraction is not None and self.dead_fraction >= self.compaction_dead_fraction
+        checkpoint = self._journal_rows >= max(self.checkpoint_min_journal_rows,
+                                               self.checkpoint_journal_fraction * self._checkpoint_rows)
+        if not compact and not checkpoint:
+            return
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(
+                target=self.compact if compact else self.save,
+                name="vector-store-compaction" if compact else "vector-store-checkpoint", daemon=True
+            )
+            self._maintenance_thread.start()
+
+    def compact(self):
+        """
+        Drop tombstoned rows from the vectors, chunk list and HNSW graph.
+
+        The compacted index, postings and graph are built from a snapshot
+        while searches and changes carry on against the current ones; rows
+        added and documents deleted in the meantime are applied to them
+        when they are swapped in.
+
+        Returns:
+            int: Number of rows removed
+        """
+        with self._compaction_lock:
+            with self._lock:
+                removed = len(self.dead_rows)
+                if removed == 0:
+                    return 0
+
+                start = time.time()
+                keep_rows = self.live_rows.to_array()
+                snapshot_rows = len(self.chunks)
+                source_chunks = self.chunks  # Only appended to, so its first rows stay put
+                self._compaction_deletes = []
+                generation = self._next_generation
+                self._next_generation += 1
+                self._compaction_generation = generation
+
+            vectors_name = generation_file('vectors.f32', generation)
+            try:
+                index = self.index.compacted(keep_rows, self._path(vectors_name))
+                chunks = [source_chunks[row] for row in keep_rows]
+                # Rows may be tombstoned while this runs; those deletes are replayed below
+                chunk_rows, session_rows, document_rows, live_rows, dead_rows = \
+                    self._build_postings(chunks, include_deleted=True)
+                ann_index = None
+                if self.hnsw_min_chunks is not None and len(index) >= self.hnsw_min_chunks:
+                    ann_index = self._new_ann(index)
+                self._swap_compacted(generation, vectors_name, index, ann_index, snapshot_rows, chunks,
+                                     chunk_rows, session_rows, document_rows, live_rows, dead_rows)
+            except Exception:
+                with self._write_lock:
+                    self._compaction_deletes = None
+                    self._compaction_generation = None
+                    self._remove_stale_files()  # Whatever of the new generation was written
+                raise
+            print(f"Compacted vector store: removed {removed} rows in {time.time() - start:.2f} seconds")
+            return removed
+
+    def _swap_compacted(self, generation, vectors_name, index, ann_index, snapshot_rows, chunks,
+                        chunk_rows, session_rows, document_rows, live_rows, dead_rows):
+        """
+        Bring a compacted snapshot up to date, checkpoint it and make it current.
+
+        Changes wait while this runs. Searches keep using the current rows
+        until the new generation is fully on disk, then switch to it.
+        """
+        with self._write_lock:
+            # Documents deleted meanwhile lose their snapshot rows
+            for document_id in self._compaction_deletes:
+                rows = document_rows.pop(document_id, None)
+                if rows is None:
+                    continue
+                row_array = rows.to_array()
+                live_rows.discard_many(row_array)
+                dead_rows.add_many(row_array)
+                session_id = chunks[row_array[0]].get("session_id")
+                if session_id in session_rows:
+                    session_rows[session_id].discard_many(row_array)
+                    if not session_rows[session_id]:
+                        del session_rows[session_id]
+                for row in row_array:
+                    chunk_rows.pop(chunks[row]["chunk_id"], None)
+            self._compaction_deletes = None
+
+            # Rows added meanwhile are appended after the kept ones
+            tail = np.arange(snapshot_rows, len(self.chunks))
+            if len(tail):
+                rows = index.add(np.asarray(self.index.vectors[tail]))
+                if ann_index is not None:
+                    ann_index.add(index.vectors[rows], rows)
+                for row, old_row in zip(rows.tolist(), tail.tolist()):
+                    chunk = self.chunks[old_row]
+                    chunks.append(chunk)
+                    if chunk.get("deleted"):
+                        dead_rows.add(row)
+                        continue
+                    live_rows.add(row)
+                    chunk_rows[chunk["chunk_id"]] = row
+                    document_rows.setdefault(chunk["document_id"], RoaringBitmap()).add(row)
+                    if chunk.get("session_id"):
+                        session_rows.setdefault(chunk["session_id"], RoaringBitmap()).add(row)
+
+            if ann_index is None and self.hnsw_min_chunks is not None and len(index) >= self.hnsw_min_chunks:
+                ann_index = self._new_ann(index)
+
+            # Written before anything is swapped, so a crash leaves the previous generation in place
+            self._write_checkpoint(generation, vectors_name, index, ann_index, chunks)
+            with self._lock:
+                self.index = index
+                self.chunks = chunks
+                self.chunk_rows = chunk_rows
+                self.session_rows = session_rows
+                self.document_rows = document_rows
+                self.live_rows = live_rows
+                self.dead_rows = dead_rows
+                self.ann_index = ann_index
+                self._generation = generation
+                self._vectors_name = vectors_name
+                self._checkpoint_rows = len(chunks)
+                self._journal_rows = 0
+                self._compaction_generation = None
+            self._remove_stale_files()
+
+    def index_report(self, sample_size=200, k=10):
+        """
+        Report HNSW recall@k and latency against exact search.
+
+        Queries are stored chunk vectors with a little noise added, so the
+        report needs no embedding calls.
+
+        Args:
+            sample_size (int): Number of queries to run
+            k (int): Number of neighbours to compare
+
+        Returns:
+            dict: Report, or an explanation if no HNSW index is active. Memory
+                figures count the vector index and the HNSW graph separately.
+        """
+        with self._lock:
+            if self.ann_index is None:
+                if self.storage != 'float32':
+                    message = f"HNSW is not used with {self.storage} storage; searches scan the codes"
+                else:
+                    message = "HNSW index not built; searches use exact scoring"
+                return {
+                    "ann_enabled": False,
+                    "storage": self.storage,
+                    "vector_memory_bytes": self.index.memory_bytes(),
+                    "ann_memory_bytes": 0,
+                    "indexed_vectors": len(self.index),
+                    "hnsw_min_chunks": self.hnsw_min_chunks,
+                    "message": message
+                }
+
+            rng = np.random.default_rng(0)
+            rows = rng.choice(len(self.index), size=min(sample_size, len(self.index)), replace=False)
+            queries = self.index.vectors[rows]
+            queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+
+            report = recall_report(self.index, self.ann_index, queries, k=k)
+            report["ann_enabled"] = True
+            report["storage"] = self.storage
+            report["vector_memory_bytes"] = self.index.memory_bytes()
+            report["ann_memory_bytes"] = self._ann_memory_bytes()
+            return report
+
+    def _ann_memory_bytes(self):
+        """Estimated bytes held by the HNSW graph: a float32 copy of every vector plus its links"""
+        if self.ann_index is None:
+            return 0
+        return len(self.ann_index) * (self.index.dim * 4 + self.ann_index.M * 2 * 4)
+
+    def resident_bytes(self):
+        """
+        Rough estimate of the memory held by the store.
+
+        Counts the vector index, the HNSW graph (vectors plus links) and the
+        chunk text, which is held both in the chunk list and the BM25 index.
+
+        Returns:
+            int: Estimated bytes
+        """
+        with self._lock:
+            total = self.index.memory_bytes() + self._ann_memory_bytes()
+            total += 2 * sum(len(chunk["content"]) for chunk in self.chunks)
+            return total
+
+    def release(self):
+        """
+        Wait for a running compaction or checkpoint, then stop the search
+        threads. Every change is already journaled, so the store can then be dropped.
+        """
+        thread = self._maintenance_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._search_executor.shutdown(wait=False)
+
+    def close(self):
+        """Flush the store to disk and stop its search threads."""
+        self.save()
+        self.release()
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -12,15 +12,20 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Import the GeminiClient and VectorStore
 from models.gemini_client import GeminiClient
 from models.vector_store import VectorStore
+from utils.pdf_extraction import extract_text_from_pdf, start_workers
 
-def process_pdf_to_vector_store(pdf_path, vector_store, session_id=None):
+def process_pdf_to_vector_store(pdf_path, vector_store, session_id=None, file_hash=None):
     """
-    Process a PDF file, extract text using Gemini, and store in vector database.
+    Process a PDF file, extract its text, and store it in the vector database.
+
+    Text is extracted locally; only pages without a usable text layer are
+    sent to Gemini.
 
     Args:
         pdf_path (str): Path to the PDF file
         vector_store (VectorStore): Instance of the vector store
         session_id (str, optional): Session ID to associate with the document
+        file_hash (str, optional): SHA-256 of the file, when computed while it was uploaded
 
     Returns:
         str: Document ID if successful, None otherwise
@@ -32,29 +37,22 @@ def process_pdf_to_vector_store(pdf_path, vector_store, session_id=None):
     base_filename = os.path.splitext(pdf_filename)[0]
     title = base_filename.replace("_", " ").title()
 
-    # Initialize the Gemini client for text extraction
+    # Gemini is only needed for pages without a text layer
     print("Initializing Gemini client...")
-    client = GeminiClient()
-    print("Client initialized successfully!")
-
-    # Extract text from PDF using Gemini's direct PDF processing
-    extraction_prompt = """
-    Extract all meaningful text content from this PDF document.
-    Include all text from paragraphs, headers, bullet points, tables, and captions.
-    Maintain the original structure as much as possible.
-    Do not include your own commentary or analysis.
-    """
+    try:
+        client = GeminiClient()
+        print("Client initialized successfully!")
+    except Exception as e:
+        print(f"Gemini client not available, using the text layer only: {e}")
+        client = None
 
     try:
-        # Process the PDF with Gemini to extract text
-        print("Extracting text from PDF using Gemini...")
+        # Extract text locally, sending only pages without a text layer to Gemini
+        print("Extracting text from PDF...")
         start_time = time.time()
 
-        # Send PDF directly to Gemini
-        result = client.process_pdf(pdf_path, prompt=extraction_prompt)
-
-        # Extract the text from the result
-        extracted_text = result["text"]
+        extracted_text = extract_text_from_pdf(pdf_path, fallback=client.extract_pdf_pages if client else None,
+                                               file_hash=file_hash)
         print(f"Text extracted successfully in {time.time() - start_time:.2f} seconds")
         print(f"Extracted {len(extracted_text)} characters")
 
@@ -236,6 +234,7 @@ def main():
 
 if __name__ == "__main__":
     try:
+        start_workers()
         main()
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Check that long WAV files split into segments small enough for Whisper, offline.
+Usage: python -m flask.tests.test_audio_split [--seconds 120] [--max-kb 500]
+
+The segments must each fit the size limit and hold the source's frames in order.
+"""
+
+import argparse
+import os
+import sys
+import wave
+import tempfile
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.audio_utils import split_wav
+
+def test_split_wav(seconds=30, max_kb=200):
+    """Split a synthetic stereo WAV and reassemble it from the segments"""
+    print("=" * 80)
+    print(f"🎧 TESTING WAV SPLITTING ({seconds} s, segments up to {max_kb} KB)")
+    print("=" * 80)
+
+    max_bytes = max_kb * 1024
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'lecture.wav')
+        frames = bytes(i % 251 for i in range(seconds * 16000 * 4))
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(frames)
+
+        joined, sizes = b"", []
+        for segment_path in split_wav(path, max_bytes, temp_dir):
+            sizes.append(os.path.getsize(segment_path))
+            with wave.open(segment_path, 'rb') as f:
+                joined += f.readframes(f.getnframes())
+
+    print(f"Source:   {len(frames) / 1e6:.1f} MB of frames")
+    print(f"Segments: {len(sizes)}, largest {max(sizes) / 1024:.0f} KB")
+    matches = joined == frames and max(sizes) <= max_bytes
+
+    if matches:
+        print("\n✅ Segments fit the limit and rebuild the audio")
+    else:
+        print("\n❌ Segments are too large or lose audio")
+
+    assert matches
+    return matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split a synthetic WAV file for Whisper offline')
+    parser.add_argument('--seconds', '-s', type=int, default=120, help='Length of the audio')
+    parser.add_argument('--max-kb', '-m', type=int, default=500, help='Largest segment in KB')
+    args = parser.parse_args()
+
+    test_split_wav(args.seconds, args.max_kb)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Check that BM25 index changes persist through its journal and checkpoints.
+Usage: python -m flask.tests.test_bm25_journal [--units 2000]
+
+Runs offline; times a save after a single change against a full rewrite.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tempfile
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.bm25_index import BM25Index
+
+def index_state(index):
+    """Everything a reopened index must reproduce"""
+    return index.postings, index.doc_lengths, index.documents, index.total_length
+
+def test_bm25_journal(num_units=500):
+    """Add and remove units, save, and compare the reopened index"""
+    print("=" * 80)
+    print(f"📒 TESTING BM25 INDEX JOURNAL ({num_units} units)")
+    print("=" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bm25_index.json')
+        index = BM25Index(path, checkpoint_min_journal=num_units * 2)
+        for i in range(num_units):
+            index.add(f"unit_{i}", f"Paragraph {i} on queues, stacks and binary trees. " * 5,
+                      {"text": f"Paragraph {i}"}, document_id=f"doc_{i % 10}")
+        index.save()
+        matches = not os.path.exists(path)
+
+        # A single change only appends to the journal
+        index.remove_document("doc_3")
+        index.add("unit_new", "Heaps and priority queues", document_id="doc_new")
+        start = time.time()
+        index.save()
+        journal_duration = time.time() - start
+
+        start = time.time()
+        index.save(os.path.join(temp_dir, 'full.json'))
+        full_duration = time.time() - start
+        print(f"Journaled save: {journal_duration * 1000:.2f} ms, full rewrite: {full_duration * 1000:.2f} ms")
+
+        reopened = BM25Index(path)
+        matches = matches and index_state(reopened) == index_state(index)
+        matches = matches and reopened.document_keys("doc_3") == set()
+
+        # Once the journal is large enough it is folded into a checkpoint
+        index.checkpoint_min_journal = 0
+        index.clear()
+        index.add("unit_last", "Graphs and shortest paths")
+        index.save()
+        reopened = BM25Index(path)
+        matches = matches and os.path.exists(path) and not os.path.exists(index._journal_path)
+        matches = matches and index_state(reopened) == index_state(index) and len(reopened) == 1
+
+    if matches:
+        print("\n✅ Reopened index matches the saved one")
+    else:
+        print("\n❌ Reopened index differs from the saved one")
+
+    assert matches
+    return matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the BM25 index journal offline')
+    parser.add_argument('--units', '-u', type=int, default=2000, help='Number of indexed units')
+    args = parser.parse_args()
+
+    test_bm25_journal(args.units)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Check streamed page chunking against chunking the whole text, offline.
+Usage: python -m flask.tests.test_chunking [--documents 1000] [--seed 0]
+
+chunk_pages must yield exactly the chunks chunk_text returns for the
+pages joined with blank lines, each with the page its text starts on.
+"""
+
+import argparse
+import os
+import sys
+import random
+from bisect import bisect_right
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.pdf_utils import chunk_text, chunk_spans, chunk_pages
+
+PIECES = ["queue", "stack", "graph", "tree", "heap.", "array.", "list", "hash", " ", "  ", "\n", "\n\n", ". ", "x" * 40]
+
+def make_pages(rng):
+    """Random pages with sentence, paragraph and whitespace breaks in awkward places"""
+    pages = []
+    for page_number in range(1, rng.randint(1, 12)):
+        words = [rng.choice(PIECES) for _ in range(rng.randint(0, 300))]
+        pages.append((page_number, rng.choice(["", " ", "\n"]) + " ".join(words) + rng.choice(["", " ", "\n\n"])))
+    return pages
+
+def expected_chunks(pages, chunk_size, chunk_overlap):
+    """chunk_text over the joined pages, with the page each chunk starts on"""
+    text, offsets, numbers = "", [], []
+    for page_number, page_text in pages:
+        if not page_text:
+            continue
+        if text:
+            text += "\n\n"
+        offsets.append(len(text))
+        numbers.append(page_number)
+        text += page_text
+    chunks = chunk_text(text, chunk_size, chunk_overlap)
+    starts = [start for start, _ in chunk_spans(text, chunk_size, chunk_overlap)]
+    return [(chunk, numbers[max(bisect_right(offsets, start) - 1, 0)]) for chunk, start in zip(chunks, starts)]
+
+def test_chunk_pages(num_documents=1000, seed=0):
+    """Chunk random multi-page documents both ways and compare"""
+    print("=" * 80)
+    print(f"📄 TESTING STREAMED PAGE CHUNKING ({num_documents} documents)")
+    print("=" * 80)
+
+    rng = random.Random(seed)
+    mismatches = 0
+    for i in range(num_documents):
+        pages = make_pages(rng)
+        chunk_size = rng.randint(20, 400)
+        chunk_overlap = rng.randint(0, chunk_size - 1)
+        expected = expected_chunks(pages, chunk_size, chunk_overlap)
+        streamed = list(chunk_pages(iter(pages), chunk_size, chunk_overlap))
+        if streamed != expected:
+            if not mismatches:
+                print(f"First mismatch: document {i}, chunk size {chunk_size}, overlap {chunk_overlap}")
+            mismatches += 1
+
+    if mismatches:
+        print(f"\n❌ {mismatches} of {num_documents} documents chunked differently when streamed")
+    else:
+        print(f"\n✅ Streamed chunks match chunk_text for all {num_documents} documents")
+
+    assert mismatches == 0
+    return mismatches == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare streamed page chunking with chunk_text offline')
+    parser.add_argument('--documents', '-d', type=int, default=1000, help='Number of random documents')
+    parser.add_argument('--seed', '-s', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    test_chunk_pages(args.documents, args.seed)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Round-trip a synthetic document store through the columnar snapshot and time its warm start.
+Usage: python -m flask.tests.test_document_snapshot [--documents 2000] [--chunks 50]
+
+Runs offline; compares the snapshot against the legacy JSON store it replaces,
+and checks that changes persist through the delta log and new snapshot versions.
+"""
+
+import argparse
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.document_snapshot import SnapshotDocumentStore, write_snapshot
+
+def make_store(num_documents, chunks_per_document):
+    """Build a document store shaped like DocumentProcessor's"""
+    store = {}
+    for i in range(num_documents):
+        doc_id = f"doc_{i:06d}"
+        store[doc_id] = {
+            'filename': f"lecture_{i}.pdf",
+            'path': None,
+            'chunk_count': chunks_per_document,
+            'session_id': f"session_{i % 10}" if i % 7 else None,
+            'chunks': [
+                {"id": f"{doc_id}_chunk_{j}", "text": f"Chunk {j} of lecture {i}: queues, stacks and trées. " * 10,
+                 "source": f"lecture_{i}.pdf", "page": j // 2}
+                for j in range(chunks_per_document)
+            ]
+        }
+    return store
+
+def test_document_snapshot(num_documents=500, chunks_per_document=20):
+    """Write a snapshot, reopen it and compare every document"""
+    print("=" * 80)
+    print(f"🗄️ TESTING DOCUMENT SNAPSHOT ({num_documents} documents x {chunks_per_document} chunks)")
+    print("=" * 80)
+
+    store = make_store(num_documents, chunks_per_document)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_path = os.path.join(temp_dir, 'document_store.json')
+        snapshot_path = os.path.join(temp_dir, 'document_store.snap')
+        with open(json_path, 'w') as f:
+            json.dump(store, f)
+        write_snapshot(snapshot_path, store)
+
+        start = time.time()
+        with open(json_path, 'r') as f:
+            json.load(f)
+        json_duration = time.time() - start
+
+        start = time.time()
+        snapshot_store = SnapshotDocumentStore.open(snapshot_path)
+        open_duration = time.time() - start
+
+        print(f"JSON store:  {os.path.getsize(json_path) / 1e6:.1f} MB, loaded in {json_duration * 1000:.1f} ms")
+        print(f"Snapshot:    {os.path.getsize(snapshot_path) / 1e6:.1f} MB, opened in {open_duration * 1000:.2f} ms")
+
+        matches = len(snapshot_store) == len(store) and all(snapshot_store[doc_id] == store[doc_id] for doc_id in store)
+        session_ids = sorted(doc_id for doc_id, doc in store.items() if doc['session_id'] == 'session_3')
+        matches = matches and sorted(snapshot_store.session_document_ids('session_3')) == session_ids
+
+        # Saved changes go to the delta log, leaving the snapshot as it is
+        del snapshot_store["doc_000001"]
+        snapshot_store["doc_new"] = {'filename': 'new.txt', 'session_id': 'session_3', 'chunks': []}
+        snapshot_size = os.path.getsize(snapshot_path)
+        snapshot_store.save()
+        reopened = SnapshotDocumentStore.open(snapshot_path)
+        matches = matches and os.path.getsize(snapshot_path) == snapshot_size
+        matches = matches and "doc_000001" not in reopened and reopened["doc_new"]["filename"] == 'new.txt'
+        matches = matches and len(reopened) == len(store)
+        reopened.close()
+
+        # A rebuild writes the next version instead of replacing the mapped file
+        snapshot_store.rebuild()
+        reopened = SnapshotDocumentStore.open(snapshot_path)
+        matches = matches and os.path.exists(os.path.join(temp_dir, 'document_store.1.snap'))
+        matches = matches and "doc_000001" not in reopened and len(reopened) == len(store)
+        reopened.close()
+
+        # Reads running while a new snapshot version is swapped in finish on the old one
+        errors = []
+        saving = threading.Event()
+        saving.set()
+        def read_chunks():
+            try:
+                while saving.is_set():
+                    if snapshot_store.chunks("doc_000002") != store["doc_000002"]["chunks"]:
+                        errors.append("wrong chunks")
+            except Exception as e:
+                errors.append(e)
+        readers = [threading.Thread(target=read_chunks) for _ in range(4)]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Interleave the threads as often as possible
+        try:
+            for reader in readers:
+                reader.start()
+            for _ in range(5):
+                snapshot_store.rebuild()
+            saving.clear()
+            for reader in readers:
+                reader.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        if errors:
+            print(f"Concurrent reads failed: {errors[0]!r}")
+        matches = matches and not errors
+        snapshot_store.close()
+
+    if matches:
+        print("\n✅ Snapshot round-trips the document store")
+    else:
+        print("\n❌ Snapshot differs from the document store")
+
+    assert matches
+    return matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Round-trip and time the document snapshot offline')
+    parser.add_argument('--documents', '-d', type=int, default=2000, help='Number of documents')
+    parser.add_argument('--chunks', '-c', type=int, default=50, help='Chunks per document')
+    args = parser.parse_args()
+
+    test_document_snapshot(args.documents, args.chunks)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Check batched reranking against a single-batch run, offline.
+Usage: python -m flask.tests.test_rerank [--chunks 2000] [--batch-size 100] [--concurrency 4]
+
+Uses the local deterministic reranker, so no API key or server is needed.
+Batched and unbatched runs must return the same top-n, and a repeated
+(re-spaced, re-cased) query must be served from the rerank score cache.
+"""
+
+import argparse
+import os
+import sys
+import time
+import random
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.reranker import LocalReranker
+from utils.rerank_cache import RerankScoreCache
+from config import RERANK_BATCH_SIZE, RERANK_MAX_CONCURRENCY
+
+WORDS = ["queue", "stack", "graph", "tree", "heap", "array", "list", "hash",
+         "node", "edge", "pointer", "sort", "search", "insert", "delete", "balance"]
+
+def make_chunks(num_chunks, words_per_chunk=120, seed=0):
+    """Generate chunks of random data-structure vocabulary"""
+    rng = random.Random(seed)
+    return [
+        {"id": f"chunk_{i}", "text": " ".join(rng.choice(WORDS) for _ in range(words_per_chunk)), "source": "synthetic"}
+        for i in range(num_chunks)
+    ]
+
+def test_batched_rerank(num_chunks=2000, batch_size=RERANK_BATCH_SIZE, concurrency=RERANK_MAX_CONCURRENCY,
+                        top_n=10, query="queue insert delete"):
+    """Rerank in batches and in one batch and compare the results"""
+    print("=" * 80)
+    print(f"🔀 TESTING BATCHED RERANK ({num_chunks} chunks, batch size {batch_size}, concurrency {concurrency})")
+    print("=" * 80)
+
+    chunks = make_chunks(num_chunks)
+
+    start = time.time()
+    single = LocalReranker(batch_size=num_chunks).rerank_chunks(query, chunks, top_n=top_n)
+    single_duration = time.time() - start
+
+    start = time.time()
+    batched = LocalReranker(batch_size=batch_size, max_concurrency=concurrency).rerank_chunks(query, chunks, top_n=top_n)
+    batched_duration = time.time() - start
+
+    print(f"Single batch: {single_duration * 1000:.1f} ms")
+    print(f"Batched:      {batched_duration * 1000:.1f} ms")
+
+    print("\n📊 TOP RESULTS")
+    print("-" * 80)
+    for i, result in enumerate(batched[:5]):
+        print(f"{i+1}. {result['id']} (score: {result['score']:.4f}, source: {result['source']})")
+
+    matches = [a["id"] for a in single] == [b["id"] for b in batched]
+    if matches:
+        print(f"\n✅ Batched top-{top_n} matches the single-batch ranking")
+    else:
+        print(f"\n❌ Batched top-{top_n} differs from the single-batch ranking")
+
+    assert matches
+    return matches
+
+class CountingReranker(LocalReranker):
+    """Local reranker that counts the texts it actually scores"""
+    scored = 0
+
+    def score(self, query, texts):
+        self.scored += len(texts)
+        return super().score(query, texts)
+
+def test_rerank_score_cache(num_chunks=500, top_n=10, query="queue insert delete"):
+    """Rerank twice with a score cache, then delete a document's chunks"""
+    print("=" * 80)
+    print(f"🗃️ TESTING RERANK SCORE CACHE ({num_chunks} chunks)")
+    print("=" * 80)
+
+    chunks = make_chunks(num_chunks)
+    cache = RerankScoreCache(max_entries=num_chunks * 2)
+    reranker = CountingReranker(score_cache=cache)
+
+    first = reranker.rerank_chunks(query, chunks, top_n=top_n)
+    first_scored = reranker.scored
+
+    # A near-identical follow-up query, plus one chunk not seen yet
+    extra = {"id": "chunk_extra", "text": "queue insert delete", "source": "synthetic"}
+    second = reranker.rerank_chunks(f"  {query.upper()} ", chunks + [extra], top_n=top_n)
+    second_scored = reranker.scored - first_scored
+
+    print(f"First query scored {first_scored} chunks, follow-up scored {second_scored}")
+    print(f"Cache: {cache.stats()}")
+
+    dropped = cache.invalidate_chunks([chunk["id"] for chunk in chunks[:100]])
+    print(f"Invalidated {dropped} cached scores")
+    reranker.rerank_chunks(query, chunks, top_n=top_n)
+    third_scored = reranker.scored - first_scored - second_scored
+
+    ok = (first_scored == num_chunks and second_scored == 1 and dropped == 100 and third_scored == 100
+          and [r["id"] for r in first] == [r["id"] for r in second if r["id"] != "chunk_extra"][:len(first)])
+    if ok:
+        print("\n✅ Cached pairs were served without rescoring, misses and invalidated chunks were rescored")
+    else:
+        print("\n❌ Unexpected rerank cache behaviour")
+
+    assert ok
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare batched and single-batch reranking offline')
+    parser.add_argument('--chunks', '-n', type=int, default=2000, help='Number of chunks to rerank')
+    parser.add_argument('--batch-size', '-b', type=int, default=RERANK_BATCH_SIZE, help='Documents per batch')
+    parser.add_argument('--concurrency', '-c', type=int, default=RERANK_MAX_CONCURRENCY, help='Batches in flight')
+    parser.add_argument('--top-n', type=int, default=10, help='Results to compare')
+    parser.add_argument('--query', '-q', type=str, default="queue insert delete", help='Query to rerank for')
+    args = parser.parse_args()
+
+    test_batched_rerank(args.chunks, args.batch_size, args.concurrency, args.top_n, args.query)
+    test_rerank_score_cache(args.chunks, args.top_n, args.query)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test script for resumable uploads of large PDFs and audio files.
+Usage: python -m flask.tests.test_resumable_upload path/to/large_file.pdf [--part-size 8388608] [--upload-id ID]
+
+Pass --upload-id with the ID of an interrupted upload to send only its missing parts.
+"""
+
+import argparse
+import os
+import sys
+import time
+import hashlib
+import requests
+from pprint import pprint
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BASE_URL = 'http://localhost:5000'
+
+
+def test_resumable_upload(file_path, part_size=None, upload_id=None, session_id=None, timeout=600):
+    """Upload a file in parts, complete it and wait until it has been processed"""
+    if not os.path.exists(file_path):
+        print(f"Error: File {file_path} does not exist")
+        return None
+
+    file_size = os.path.getsize(file_path)
+    print(f"Testing resumable upload of {file_path} ({file_size/1024/1024:.2f} MB)")
+
+    try:
+        if upload_id:
+            # Resume: ask the server which parts it still needs
+            response = requests.get(f"{BASE_URL}/api/uploads/{upload_id}")
+            if response.status_code != 200:
+                print(f"\n❌ Could not resume upload {upload_id}: {response.status_code}")
+                pprint(response.json())
+                return None
+            upload = response.json()
+            print(f"Resuming upload {upload_id}: {len(upload['missing_parts'])} of {upload['part_count']} parts missing")
+        else:
+            payload = {"filename": os.path.basename(file_path), "size": file_size}
+            if part_size:
+                payload["part_size"] = part_size
+            if session_id:
+                payload["session_id"] = session_id
+            response = requests.post(f"{BASE_URL}/api/uploads", json=payload)
+            if response.status_code != 201:
+                print(f"\n❌ Could not start upload: {response.status_code}")
+                pprint(response.json())
+                return None
+            upload = response.json()
+            upload_id = upload['upload_id']
+            upload['missing_parts'] = list(range(upload['part_count']))
+            print(f"Started upload {upload_id}: {upload['part_count']} parts of {upload['part_size']} bytes")
+
+        # Send the missing parts
+        start_time = time.time()
+        with open(file_path, 'rb') as f:
+            for part_number in upload['missing_parts']:
+                f.seek(part_number * upload['part_size'])
+                data = f.read(upload['part_size'])
+                response = requests.put(f"{BASE_URL}/api/uploads/{upload_id}/parts/{part_number}", data=data)
+                if response.status_code != 200:
+                    print(f"\n❌ Part {part_number} failed with status code {response.status_code}")
+                    pprint(response.json())
+                    print(f"Resume with: --upload-id {upload_id}")
+                    return None
+                print(f"  Part {part_number + 1}/{upload['part_count']} sent")
+        print(f"Sent parts in {time.time() - start_time:.2f} seconds")
+
+        # Complete and compare the server's hash with the local file
+        response = requests.post(f"{BASE_URL}/api/uploads/{upload_id}/complete")
+        if response.status_code != 202:
+            print(f"\n❌ Completing the upload failed with status code {response.status_code}")
+            pprint(response.json())
+            return None
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        if response.json()['file_hash'] != digest.hexdigest():
+            print("\n❌ The assembled file does not match the local file")
+            return None
+        print("✅ Upload assembled, hash matches the local file")
+
+        # Wait for processing
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = requests.get(f"{BASE_URL}/api/uploads/{upload_id}").json()
+            if status['status'] == 'done':
+                print(f"\n✅ Processed as document {status['document_id']}")
+                return status['document_id']
+            if status['status'] == 'failed':
+                print(f"\n❌ Processing failed: {status['error']}")
+                return None
+            time.sleep(2)
+        print(f"\n❌ Upload still processing after {timeout} seconds")
+        return None
+
+    except requests.exceptions.ConnectionError:
+        print(f"\n❌ Connection error: Could not connect to {BASE_URL}")
+        print("Make sure your Flask app is running and accessible")
+        return None
+    except Exception as e:
+        print(f"\n❌ Error during upload: {str(e)}")
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Test resumable uploads to Flask application')
+    parser.add_argument('file_path', help='PDF or audio file to upload')
+    parser.add_argument('--part-size', type=int, default=None, help='Bytes per part (default: server setting)')
+    parser.add_argument('--upload-id', default=None, help='Resume this interrupted upload')
+    parser.add_argument('--session-id', default=None, help='Session to add the document to')
+    args = parser.parse_args()
+
+    document_id = test_resumable_upload(args.file_path, args.part_size, args.upload_id, args.session_id)
+
+    if document_id:
+        print("\n🔍 Next step: Test vectorized search using this document ID")
+        print(f"  Run: python -m flask.tests.test_search \"{document_id}\"")
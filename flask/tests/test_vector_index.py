@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark the HNSW index against exact search on synthetic embeddings.
+Usage: python -m flask.tests.test_vector_index [--vectors 50000] [--dim 768] [--queries 200]
+
+This runs offline (no server or embedding model needed) and prints a recall@10
+and latency report for the current HNSW settings.
+"""
+
+import argparse
+import os
+import sys
+import json
+import time
+import numpy as np
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models.vector_index import FlatIndex, HNSWIndex, recall_report
+from config import HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+
+def make_embeddings(num_vectors, dim, latent_dim=32, seed=0):
+    """
+    Generate vectors that loosely resemble text embeddings: a low intrinsic
+    dimension projected into `dim` dimensions, plus a little noise.
+    """
+    projection = np.random.default_rng(1234).normal(size=(latent_dim, dim)).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(num_vectors, latent_dim)).astype(np.float32)
+    return latent @ projection + 0.1 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+
+def test_hnsw_recall(num_vectors=20000, dim=128, num_queries=200, k=10,
+                     M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+    """Build both indexes over the same vectors and compare their results"""
+    print("=" * 80)
+    print(f"🧭 TESTING HNSW RECALL ({num_vectors} vectors, dim {dim})")
+    print("=" * 80)
+
+    vectors = make_embeddings(num_vectors, dim)
+    queries = make_embeddings(num_queries, dim, seed=1)
+
+    exact_index = FlatIndex(dim=dim)
+    exact_index.add(vectors)
+
+    print(f"Building HNSW index (M={M}, ef_construction={ef_construction})...")
+    build_start = time.time()
+    ann_index = HNSWIndex(dim, M=M, ef_construction=ef_construction, ef_search=ef_search,
+                          initial_capacity=num_vectors)
+    ann_index.add(vectors, np.arange(num_vectors))
+    build_duration = time.time() - build_start
+    print(f"Index built in {build_duration:.2f} seconds")
+
+    report = recall_report(exact_index, ann_index, queries, k=k)
+    report["build_seconds"] = build_duration
+
+    print("\n📊 RECALL REPORT")
+    print("-" * 80)
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+    output_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = os.path.join(output_dir, f"vector_index_report_{int(time.time())}.json")
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {output_path}")
+
+    recall = report[f"recall@{k}"]
+    if recall >= 0.9:
+        print(f"\n✅ HNSW recall@{k} is {recall:.3f}")
+    else:
+        print(f"\n❌ HNSW recall@{k} is only {recall:.3f}; consider raising ef_search or M")
+
+    return recall >= 0.9
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare HNSW against exact vector search')
+    parser.add_argument('--vectors', '-n', type=int, default=50000, help='Number of indexed vectors')
+    parser.add_argument('--dim', '-d', type=int, default=768, help='Embedding dimension')
+    parser.add_argument('--queries', '-q', type=int, default=200, help='Number of queries')
+    parser.add_argument('--k', type=int, default=10, help='Neighbours compared per query')
+    parser.add_argument('--M', type=int, default=HNSW_M, help='HNSW neighbours per node')
+    parser.add_argument('--ef-construction', type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument('--ef-search', type=int, default=HNSW_EF_SEARCH)
+    args = parser.parse_args()
+
+    test_hnsw_recall(args.vectors, args.dim, args.queries, args.k,
+                     M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search)
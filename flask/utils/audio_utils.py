@@ -0,0 +1,35 @@
+import os
+import wave
+
+def split_wav(path, max_bytes, folder):
+    """
+    Split a WAV file into consecutive segments of at most max_bytes each.
+
+    Segments are cut on frame boundaries and keep the source's format, so
+    they can be transcribed one by one and the texts joined in order.
+
+    Args:
+        path (str): Path to the WAV file
+        max_bytes (int): Largest segment file size, header included
+        folder (str): Folder to write the segments to
+
+    Yields:
+        str: Path of each segment, in order; it may be deleted once used
+    """
+    base = os.path.splitext(os.path.basename(path))[0]
+    with wave.open(path, 'rb') as source:
+        params = source.getparams()
+        frame_size = params.nchannels * params.sampwidth
+        # Leave room for the header written in front of the frames
+        frames_per_segment = max((max_bytes - 1024) // frame_size, 1)
+        segment = 0
+        while True:
+            frames = source.readframes(frames_per_segment)
+            if not frames:
+                break
+            segment_path = os.path.join(folder, f"{base}_part{segment:03d}.wav")
+            with wave.open(segment_path, 'wb') as target:
+                target.setparams(params)
+                target.writeframes(frames)
+            yield segment_path
+            segment += 1
@@ -0,0 +1,144 @@
+"""
+Compressed integer sets used as posting lists for filtered search.
+"""
+import numpy as np
+
+# Containers holding more values than this switch from sorted arrays to bitsets
+ARRAY_CONTAINER_MAX = 4096
+BITSET_WORDS = 1024  # 65536 bits per container
+
+
+def _pack(lows):
+    """Store sorted uint16 values as an array container or a bitset, whichever is smaller"""
+    if len(lows) <= ARRAY_CONTAINER_MAX:
+        return lows.astype(np.uint16)
+    bits = np.zeros(BITSET_WORDS * 64, dtype=bool)
+    bits[lows] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def _is_bitset(container):
+    return container.dtype == np.uint64
+
+
+def _values(container):
+    """Sorted uint16 values of a container"""
+    if _is_bitset(container):
+        bits = np.unpackbits(container.view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits).astype(np.uint16)
+    return container
+
+
+def _cardinality(container):
+    if _is_bitset(container):
+        return int(np.unpackbits(container.view(np.uint8)).sum())
+    return len(container)
+
+
+class RoaringBitmap:
+    """
+    Roaring-style compressed set of non-negative integers.
+
+    Values are grouped by their high 16 bits; each group is stored either as
+    a sorted uint16 array (sparse) or a 65536-bit bitset (dense).
+    """
+    def __init__(self, values=None):
+        self._containers = {}
+        if values is not None:
+            self.add_many(values)
+
+    @staticmethod
+    def _groups(values):
+        """Yield (high bits, sorted unique low bits) for the given values"""
+        values = np.unique(np.asarray(values, dtype=np.int64))
+        if len(values) == 0:
+            return
+        highs = values >> 16
+        boundaries = np.flatnonzero(np.diff(highs)) + 1
+        for group in np.split(values, boundaries):
+            yield int(group[0] >> 16), (group & 0xFFFF).astype(np.uint16)
+
+    def add(self, value):
+        self.add_many([value])
+
+    def add_many(self, values):
+        """Add an array of values"""
+        for high, lows in self._groups(values):
+            existing = self._containers.get(high)
+            if existing is not None:
+                lows = np.union1d(_values(existing), lows).astype(np.uint16)
+            self._containers[high] = _pack(lows)
+
+    def discard_many(self, values):
+        """Remove an array of values, ignoring ones not present"""
+        for high, lows in self._groups(values):
+            existing = self._containers.get(high)
+            if existing is None:
+                continue
+            remaining = np.setdiff1d(_values(existing), lows, assume_unique=True)
+            if len(remaining):
+                self._containers[high] = _pack(remaining)
+            else:
+                del self._containers[high]
+
+    def __contains__(self, value):
+        container = self._containers.get(int(value) >> 16)
+        if container is None:
+            return False
+        low = int(value) & 0xFFFF
+        if _is_bitset(container):
+            return bool((int(container[low >> 6]) >> (low & 63)) & 1)
+        position = np.searchsorted(container, low)
+        return position < len(container) and container[position] == low
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self._containers.values())
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def to_array(self):
+        """All values as a sorted int64 array"""
+        if not self._containers:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            (high << 16) + _values(self._containers[high]).astype(np.int64)
+            for high in sorted(self._containers)
+        ])
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __and__(self, other):
+        result = RoaringBitmap()
+        for high in self._containers.keys() & other._containers.keys():
+            a, b = self._containers[high], other._containers[high]
+            if _is_bitset(a) and _is_bitset(b):
+                words = a & b
+                lows = _values(words) if words.any() else np.empty(0, dtype=np.uint16)
+            else:
+                lows = np.intersect1d(_values(a), _values(b), assume_unique=True)
+            if len(lows):
+                result._containers[high] = _pack(lows)
+        return result
+
+    def __or__(self, other):
+        result = self.copy()
+        for high, container in other._containers.items():
+            existing = result._containers.get(high)
+            if existing is None:
+                result._containers[high] = container.copy()
+            elif _is_bitset(existing) and _is_bitset(container):
+                result._containers[high] = existing | container
+            else:
+                result._containers[high] = _pack(np.union1d(_values(existing), _values(container)))
+        return result
+
+    def copy(self):
+        result = RoaringBitmap()
+        result._containers = {high: container.copy() for high, container in self._containers.items()}
+        return result
+
+    def memory_bytes(self):
+        """Bytes used by the container payloads"""
+        return sum(container.nbytes for container in self._containers.values())
@@ -0,0 +1,238 @@
+"""
+Persistent, content-addressed cache of text embeddings, plus an in-memory
+cache of query embeddings.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+from config import (
+    EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL
+)
+from utils.lru_cache import LRUCache
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Collapse whitespace so reflowed copies of the same text share a cache entry"""
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def cache_key(model, text):
+    """
+    Cache key of a text for a given embedding model.
+
+    Args:
+        model (str): Embedding model name
+        text (str): Text that was embedded
+
+    Returns:
+        str: Hex SHA-256 of the model name and the normalized text
+    """
+    digest = hashlib.sha256(model.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed embedding cache with least-recently-used eviction.
+
+    Entries are keyed by (model, normalized text hash), so identical chunks
+    from re-uploads, other sessions or generated lectures are embedded once.
+    """
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path (str): SQLite database file
+            max_entries (int): Entries kept before the least recently used are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, texts):
+        """
+        Look up cached embeddings.
+
+        Args:
+            model (str): Embedding model name
+            texts (list): Texts to look up
+
+        Returns:
+            list: One list of floats per text, or None where it is not cached
+        """
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in found])
+                self._db.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+                for key in keys]
+
+    def put_many(self, model, texts, vectors):
+        """
+        Store embeddings, evicting the least recently used entries beyond max_entries.
+
+        Args:
+            model (str): Embedding model name
+            texts (list): Texts that were embedded
+            vectors (list): Their embeddings
+        """
+        now = time.time()
+        rows = [(cache_key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            excess = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+            self._db.commit()
+
+    def embed(self, model, texts, embed_fn):
+        """
+        Embed texts, calling embed_fn only for the ones not cached yet.
+
+        Duplicate texts within the call are embedded once.
+
+        Args:
+            model (str): Embedding model name
+            texts (list): Texts to embed
+            embed_fn (callable): Embeds a list of texts, returning a list of vectors
+
+        Returns:
+            list: One embedding per text, in input order
+        """
+        texts = list(texts)
+        vectors = self.get_many(model, texts)
+
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_text(texts[i]), []).append(i)
+        if missing:
+            unique_texts = [texts[positions[0]] for positions in missing.values()]
+            new_vectors = [list(vector) for vector in embed_fn(unique_texts)]
+            self.put_many(model, unique_texts, new_vectors)
+            for positions, vector in zip(missing.values(), new_vectors):
+                for i in positions:
+                    vectors[i] = vector
+        return vectors
+
+    def stats(self):
+        """Hit and miss counts since startup plus the current size"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self), "max_entries": self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbeddings:
+    """
+    Wraps a LangChain embeddings object so embed_documents goes through an
+    EmbeddingCache and embed_query through the shared query embedding cache.
+    """
+    def __init__(self, embeddings, cache, model_name=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name or embedding_model_name(embeddings)
+
+    def embed_documents(self, texts):
+        return self.cache.embed(self.model_name, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return embed_query_cached(self.embeddings, text, self.model_name)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+
+def embedding_model_name(embeddings):
+    """Name identifying an embeddings object's model in cache keys"""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide embedding cache, opening it on first use.
+
+    Returns:
+        EmbeddingCache: The shared cache
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = EmbeddingCache()
+    return _shared_cache
+
+
+_query_cache = LRUCache(max_entries=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL)
+
+
+def get_query_embedding_cache():
+    """Return the process-wide LRU cache of query embeddings"""
+    return _query_cache
+
+
+def embed_query_cached(embeddings, query, model_name=None):
+    """
+    Embed a search query, reusing the embedding of an identical recent query.
+
+    Args:
+        embeddings: LangChain embeddings object
+        query (str): Search query
+        model_name (str, optional): Model name used in the cache key
+
+    Returns:
+        list: Query embedding
+    """
+    key = (model_name or embedding_model_name(embeddings), normalize_text(query))
+    return _query_cache.get_or_compute(key, lambda: embeddings.embed_query(query))
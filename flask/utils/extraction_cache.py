@@ -0,0 +1,197 @@
+"""
+Persistent, content-addressed cache of PDF extraction results.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from config import EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_ENTRIES
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """
+    SHA-256 of a file's contents, read in blocks.
+
+    Args:
+        path (str): File to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of extracted page texts and chunk lists, with
+    least-recently-used eviction.
+
+    Entries are keyed by (file hash, extractor), where the extractor string
+    names the extraction code version and settings, so an identical PDF is
+    extracted once and a change to the extractor invalidates old results.
+    Chunk lists are stored alongside, one per chunking configuration.
+    """
+    def __init__(self, path=EXTRACTION_CACHE_PATH, max_entries=EXTRACTION_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path (str): SQLite database file
+            max_entries (int): Extractions kept before the least recently used are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " file_hash TEXT NOT NULL,"
+            " extractor TEXT NOT NULL,"
+            " pages TEXT NOT NULL,"
+            " chunks TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (file_hash, extractor))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)")
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+
+    def _row(self, file_hash, extractor):
+        """Look up an entry and mark it used (caller holds the lock)"""
+        row = self._db.execute("SELECT pages, chunks FROM extractions WHERE file_hash = ? AND extractor = ?",
+                               (file_hash, extractor)).fetchone()
+        if row is not None:
+            self._db.execute("UPDATE extractions SET last_used = ? WHERE file_hash = ? AND extractor = ?",
+                             (time.time(), file_hash, extractor))
+            self._db.commit()
+        return row
+
+    def get_pages(self, file_hash, extractor):
+        """
+        Look up the extracted pages of a file.
+
+        Args:
+            file_hash (str): Hash of the file contents
+            extractor (str): Extractor version and settings
+
+        Returns:
+            list: Page texts in order, or None if not cached
+        """
+        with self._lock:
+            row = self._row(file_hash, extractor)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put_pages(self, file_hash, extractor, pages):
+        """
+        Store the extracted pages of a file, evicting the least recently used
+        entries beyond max_entries.
+
+        Args:
+            file_hash (str): Hash of the file contents
+            extractor (str): Extractor version and settings
+            pages (list): Page texts in order
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO extractions VALUES (?, ?, ?, '{}', ?) "
+                "ON CONFLICT (file_hash, extractor) DO UPDATE SET pages = excluded.pages, "
+                "chunks = '{}', last_used = excluded.last_used",
+                (file_hash, extractor, json.dumps(pages), time.time())
+            )
+            excess = self._db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM extractions WHERE rowid IN "
+                    "(SELECT rowid FROM extractions ORDER BY last_used LIMIT ?)", (excess,)
+                )
+            self._db.commit()
+
+    def get_chunks(self, file_hash, extractor, chunk_size, chunk_overlap):
+        """
+        Look up the chunk list of a file for a chunking configuration.
+
+        Args:
+            file_hash (str): Hash of the file contents
+            extractor (str): Extractor version and settings
+            chunk_size (int): Chunk size the list was built with
+            chunk_overlap (int): Chunk overlap the list was built with
+
+        Returns:
+            list: (chunk text, page number) pairs, or None if not cached
+        """
+        with self._lock:
+            row = self._row(file_hash, extractor)
+            chunks = json.loads(row[1]).get(f"{chunk_size}/{chunk_overlap}") if row is not None else None
+            if chunks is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [tuple(chunk) for chunk in chunks]
+
+    def put_chunks(self, file_hash, extractor, chunk_size, chunk_overlap, chunks):
+        """
+        Store the chunk list of a file whose pages are already cached.
+
+        Args:
+            file_hash (str): Hash of the file contents
+            extractor (str): Extractor version and settings
+            chunk_size (int): Chunk size the list was built with
+            chunk_overlap (int): Chunk overlap the list was built with
+            chunks (list): (chunk text, page number) pairs
+        """
+        with self._lock:
+            row = self._db.execute("SELECT chunks FROM extractions WHERE file_hash = ? AND extractor = ?",
+                                   (file_hash, extractor)).fetchone()
+            if row is None:
+                return
+            stored = json.loads(row[0])
+            stored[f"{chunk_size}/{chunk_overlap}"] = [list(chunk) for chunk in chunks]
+            self._db.execute("UPDATE extractions SET chunks = ? WHERE file_hash = ? AND extractor = ?",
+                             (json.dumps(stored), file_hash, extractor))
+            self._db.commit()
+
+    def stats(self):
+        """Hit and miss counts since startup plus the current size"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self), "max_entries": self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """
+    Return the process-wide extraction cache, opening it on first use.
+
+    Returns:
+        ExtractionCache: The shared cache
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = ExtractionCache()
+    return _shared_cache
@@ -0,0 +1,313 @@
+"""
+Page-parallel, local-first PDF text extraction.
+
+A PDF is split into page ranges that worker processes extract with
+PyMuPDF independently, so a long reader uses every core instead of one
+request thread. The workers are forked once by start_workers() while
+the process is still single-threaded; without them, pages are extracted
+in the calling thread. Pages are yielded in order as soon as their range is
+done, so chunking starts before the last page is extracted.
+
+Pages without a usable text layer (scans, photographed slides) are
+detected while extracting; only runs of such pages are handed to a
+fallback extractor such as Gemini, so digital-native PDFs never leave
+the machine.
+
+Results are cached by file hash and extractor version, so re-uploading
+an identical PDF skips extraction altogether.
+"""
+import os
+import re
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+
+from config import PDF_EXTRACTION_WORKERS, PDF_PAGES_PER_TASK, PDF_MIN_TEXT_DENSITY
+from utils.pdf_utils import chunk_pages
+from utils.extraction_cache import get_extraction_cache, hash_file
+
+EXTRACTOR_VERSION = 1  # Bump when extraction output changes, to invalidate cached results
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def start_workers():
+    """
+    Fork the extraction worker processes.
+
+    Call at startup, before any other thread runs: forking a multithreaded
+    process can copy a lock another thread holds into the child, which then
+    deadlocks. Every worker is forked here, so the pool never forks again.
+    Spawned or forkserver workers are not an option, as they re-import the
+    main module, which for app.py would start a second copy of the app in
+    every worker.
+
+    Returns:
+        ProcessPoolExecutor: The pool, or None if extraction stays in the calling thread
+    """
+    global _executor
+    if PDF_EXTRACTION_WORKERS <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    with _executor_lock:
+        if _executor is None:
+            if threading.active_count() > 1:
+                print("Warning: other threads are already running, so PDF pages will be extracted "
+                      "in the request thread instead of worker processes")
+                return None
+            executor = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS,
+                                           mp_context=multiprocessing.get_context('fork'))
+            # A fork pool starts all its workers on the first task
+            executor.submit(os.getpid).result()
+            _executor = executor
+            print(f"Started {PDF_EXTRACTION_WORKERS} PDF extraction workers")
+        return _executor
+
+
+def extractor_id(fallback=None):
+    """
+    Name of the extraction code and settings, used in cache keys.
+
+    Args:
+        fallback (callable, optional): Fallback extractor in use
+
+    Returns:
+        str: Extractor identifier
+    """
+    extractor = f"pymupdf-{getattr(fitz, 'VersionBind', '')}/v{EXTRACTOR_VERSION}/density-{PDF_MIN_TEXT_DENSITY}"
+    return extractor + "/fallback" if fallback is not None else extractor
+
+
+def clean_page_text(text):
+    """Collapse runs of whitespace within a page"""
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+def lacks_text_layer(page, text, min_density=PDF_MIN_TEXT_DENSITY):
+    """
+    Whether a page's text must come from somewhere other than its text layer.
+
+    A page qualifies when it has little extractable text for its area (or
+    the text is mostly undecodable glyphs) but does draw images or vector
+    graphics, so it is not simply blank.
+
+    Args:
+        page (fitz.Page): The page
+        text (str): Its cleaned text layer
+        min_density (float): Characters per 1000 square points below which the layer counts as missing
+
+    Returns:
+        bool: True if the page should go to the fallback extractor
+    """
+    area = page.rect.width * page.rect.height / 1000
+    undecodable = text.count('\ufffd')
+    readable = len(text) - undecodable
+    if area and readable / area >= min_density and undecodable <= readable * 0.1:
+        return False
+    return bool(page.get_images(full=False) or page.get_drawings())
+
+
+def extract_page_range(pdf_path, start, end):
+    """
+    Extract the text of pages [start, end) of a PDF.
+
+    Runs in a worker process, so it opens its own document.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        start (int): First page (0-based)
+        end (int): Page after the last one
+
+    Returns:
+        list: (cleaned text, lacks text layer) per page
+    """
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for i in range(start, end):
+            page = doc[i]
+            text = clean_page_text(page.get_text())
+            pages.append((text, lacks_text_layer(page, text)))
+    return pages
+
+
+def _iter_local_pages(pdf_path, pages_per_task):
+    """Yield (page number, text, lacks text layer) for every page, extracting ranges in parallel"""
+    global _executor
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    ranges = [(start, min(start + pages_per_task, page_count))
+              for start in range(0, page_count, pages_per_task)]
+
+    executor = _executor if len(ranges) > 1 else None
+    if executor is None:
+        # Small PDF, or no worker processes
+        for start, end in ranges:
+            for offset, (text, missing) in enumerate(extract_page_range(pdf_path, start, end)):
+                yield start + offset + 1, text, missing
+        return
+
+    futures = [executor.submit(extract_page_range, pdf_path, start, end) for start, end in ranges]
+    try:
+        for (start, _), future in zip(ranges, futures):
+            for offset, (text, missing) in enumerate(future.result()):
+                yield start + offset + 1, text, missing
+    except BrokenProcessPool:
+        # A worker died. Forking a new pool now that threads run is unsafe,
+        # so later extractions run in the calling thread
+        with _executor_lock:
+            if _executor is executor:
+                print("PDF extraction workers died; extracting in the request thread from now on")
+                _executor = None
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _resolve_run(pdf_path, run, fallback, report):
+    """
+    Replace the local text of a run of consecutive pages lacking a text layer.
+
+    The fallback's text is attributed to the run's first page, since it
+    does not report page boundaries; if it fails, the local text is kept.
+    """
+    first_page, last_page = run[0][0], run[-1][0]
+    try:
+        text = clean_page_text(fallback(pdf_path, first_page, last_page))
+        print(f"Extracted pages {first_page}-{last_page} of {os.path.basename(pdf_path)} with the fallback extractor")
+        report["fallback_pages"] = report.get("fallback_pages", 0) + len(run)
+        return [(first_page, text)] + [(page_number, "") for page_number, _ in run[1:]]
+    except Exception as e:
+        print(f"Fallback extraction of pages {first_page}-{last_page} failed, keeping the text layer: {e}")
+        report["fallback_failures"] = report.get("fallback_failures", 0) + 1
+        return run
+
+
+def iter_pdf_pages(pdf_path, fallback=None, pages_per_task=PDF_PAGES_PER_TASK, report=None):
+    """
+    Extract the pages of a PDF in parallel, yielding them in page order.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        fallback (callable, optional): fallback(pdf_path, first_page, last_page) -> str, called
+            for each run of consecutive pages that lack a text layer. Without it those pages
+            keep whatever text they have.
+        pages_per_task (int): Pages extracted per worker task
+        report (dict, optional): Receives 'fallback_pages' and 'fallback_failures' counts
+
+    Yields:
+        tuple: (1-based page number, page text)
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+    report = {} if report is None else report
+
+    run = []  # Consecutive pages lacking a text layer, held back for the fallback
+    for page_number, text, missing in _iter_local_pages(pdf_path, pages_per_task):
+        if missing and fallback is not None:
+            run.append((page_number, text))
+            continue
+        if run:
+            yield from _resolve_run(pdf_path, run, fallback, report)
+            run = []
+        yield page_number, text
+    if run:
+        yield from _resolve_run(pdf_path, run, fallback, report)
+
+
+def extract_pdf_pages(pdf_path, fallback=None, file_hash=None):
+    """
+    Extract the text of every page of a PDF, reusing the cached result of
+    an identical file.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        fallback (callable, optional): Extractor for pages lacking a text layer, see iter_pdf_pages
+        file_hash (str, optional): SHA-256 of the file, if already known
+
+    Returns:
+        list: Page texts, in order
+    """
+    cache = get_extraction_cache()
+    file_hash = file_hash or hash_file(pdf_path)
+    extractor = extractor_id(fallback)
+    pages = cache.get_pages(file_hash, extractor)
+    if pages is not None:
+        print(f"Reusing cached extraction of {os.path.basename(pdf_path)}")
+        return pages
+
+    report = {}
+    pages = [text for _, text in iter_pdf_pages(pdf_path, fallback=fallback, report=report)]
+    # A failed fallback left pages incomplete; extract them again next time
+    if not report.get("fallback_failures"):
+        cache.put_pages(file_hash, extractor, pages)
+    return pages
+
+
+def extract_pdf_chunks(pdf_path, chunk_size, chunk_overlap, fallback=None, file_hash=None):
+    """
+    Extract and chunk a PDF, reusing the cached chunks of an identical file.
+
+    On a cache miss, pages are chunked as they are extracted.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        chunk_size (int): Size of each chunk
+        chunk_overlap (int): Overlap between chunks
+        fallback (callable, optional): Extractor for pages lacking a text layer, see iter_pdf_pages
+        file_hash (str, optional): SHA-256 of the file, if already known
+
+    Returns:
+        list: (chunk text, number of the page it starts on) pairs
+    """
+    cache = get_extraction_cache()
+    file_hash = file_hash or hash_file(pdf_path)
+    extractor = extractor_id(fallback)
+    chunks = cache.get_chunks(file_hash, extractor, chunk_size, chunk_overlap)
+    if chunks is not None:
+        print(f"Reusing cached chunks of {os.path.basename(pdf_path)}")
+        return chunks
+
+    pages = cache.get_pages(file_hash, extractor)
+    if pages is not None:
+        # Extracted before with other chunk settings
+        chunks = list(chunk_pages(enumerate(pages, 1), chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+        cache.put_chunks(file_hash, extractor, chunk_size, chunk_overlap, chunks)
+        return chunks
+
+    report = {}
+    extracted = []
+
+    def collect(page_stream):
+        for page_number, text in page_stream:
+            extracted.append(text)
+            yield page_number, text
+
+    page_stream = collect(iter_pdf_pages(pdf_path, fallback=fallback, report=report))
+    chunks = list(chunk_pages(page_stream, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+    if not report.get("fallback_failures"):
+        cache.put_pages(file_hash, extractor, extracted)
+        cache.put_chunks(file_hash, extractor, chunk_size, chunk_overlap, chunks)
+    return chunks
+
+
+def extract_text_from_pdf(pdf_path, fallback=None, file_hash=None):
+    """
+    Extract text from a PDF file.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        fallback (callable, optional): Extractor for pages lacking a text layer, see iter_pdf_pages
+        file_hash (str, optional): SHA-256 of the file, if already known
+
+    Returns:
+        str: Extracted text, pages separated by blank lines
+    """
+    try:
+        return "\n\n".join(text for text in extract_pdf_pages(pdf_path, fallback=fallback, file_hash=file_hash) if text)
+    except Exception as e:
+        print(f"Error extracting text from PDF {pdf_path}: {e}")
+        raise
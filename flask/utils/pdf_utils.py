@@ -1,35 +1,6 @@
-#from PyPDF2 import PdfReader
 import os
 import re
-
-# def extract_text_from_pdf(pdf_path):
-#     """
-#     Extract text from a PDF file.
-
-#     Args:
-#         pdf_path (str): Path to the PDF file
-
-#     Returns:
-#         str: Extracted text
-#     """
-#     if not os.path.exists(pdf_path):
-#         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-
-#     try:
-#         reader = PdfReader(pdf_path)
-#         text = ""
-
-#         for page in reader.pages:
-#             page_text = page.extract_text()
-#             if page_text:
-#                 text += page_text + "\n\n"
-
-#         # Clean up the text - remove extra whitespace
-#         text = re.sub(r'\s+', ' ', text).strip()
-#         return text
-#     except Exception as e:
-#         print(f"Error extracting text from PDF {pdf_path}: {e}")
-#         raise
+from bisect import bisect_right
 
 def chunk_text(text, chunk_size=1000, chunk_overlap=200):
     """
@@ -43,10 +14,45 @@ def chunk_text(text, chunk_size=1000, chunk_overlap=200):
     Returns:
         list: List of text chunks
     """
-    if not text:
-        return []
+    return [text[start:end] for start, end in chunk_spans(text, chunk_size, chunk_overlap)]
 
-    chunks = []
+def chunk_spans(text, chunk_size=1000, chunk_overlap=200):
+    """
+    Character spans of the chunks chunk_text would return.
+
+    Args:
+        text (str): The text to split
+        chunk_size (int): Size of each chunk
+        chunk_overlap (int): Overlap between chunks
+
+    Returns:
+        list: (start, end) offsets into text, whitespace trimmed
+    """
+    spans = []
+    for start, end in chunk_windows(text, chunk_size, chunk_overlap):
+        # Trim the chunk's surrounding whitespace and add it to our list
+        chunk = text[start:end]
+        stripped = chunk.strip()
+        if stripped:
+            chunk_start = start + (len(chunk) - len(chunk.lstrip()))
+            spans.append((chunk_start, chunk_start + len(stripped)))
+    return spans
+
+def chunk_windows(text, chunk_size=1000, chunk_overlap=200):
+    """
+    Untrimmed windows the chunker steps through.
+
+    Each window depends only on the text from its start onwards, so
+    chunking can resume at any window's start.
+
+    Args:
+        text (str): The text to split
+        chunk_size (int): Size of each chunk
+        chunk_overlap (int): Overlap between chunks
+
+    Yields:
+        tuple: (start, end) offsets into text, including whitespace-only windows
+    """
     start = 0
     text_length = len(text)
 
@@ -66,15 +72,90 @@ def chunk_text(text, chunk_size=1000, chunk_overlap=200):
                 if sentence_break != -1 and sentence_break > start + chunk_size // 2:
                     end = sentence_break + 2
 
-        # Extract the chunk and add it to our list
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+        yield start, end
+
+        # Stop once the last chunk reaches the end of the text
+        if end >= text_length:
+            break
 
         # Move the start pointer, accounting for overlap
-        start = end - chunk_overlap
+        start = max(end - chunk_overlap, start + 1)
 
-        if start >= text_length:
-            break
+def parent_span(text, start, end, parent_size):
+    """
+    Widen a chunk's span to about parent_size characters of surrounding context.
+
+    The span grows evenly on both sides and is then snapped outwards to
+    whitespace so it does not cut words.
+
+    Args:
+        text (str): Full text
+        start (int): Chunk start offset
+        end (int): Chunk end offset
+        parent_size (int): Target parent length
 
-    return chunks
+    Returns:
+        tuple: (start, end) of the parent span
+    """
+    margin = max(parent_size - (end - start), 0) // 2
+    parent_start = max(start - margin, 0)
+    parent_end = min(end + margin, len(text))
+    if parent_start > 0:
+        parent_start = max(text.rfind(' ', 0, parent_start), text.rfind('\n', 0, parent_start)) + 1
+    if parent_end < len(text):
+        breaks = [i for i in (text.find(' ', parent_end), text.find('\n', parent_end)) if i != -1]
+        parent_end = min(breaks) if breaks else len(text)
+    return parent_start, parent_end
+
+def chunk_pages(pages, chunk_size=1000, chunk_overlap=200):
+    """
+    Chunk a stream of pages as they arrive.
+
+    Pages are joined with blank lines and the chunks are those chunk_text
+    returns for the joined text. A chunk is emitted once a whole chunk's
+    worth of text follows the start of its window, so it can no longer
+    change; chunking then resumes from the first window that still can.
+
+    Args:
+        pages (iterable): (page number, page text) in page order
+        chunk_size (int): Size of each chunk
+        chunk_overlap (int): Overlap between chunks
+
+    Yields:
+        tuple: (chunk text, number of the page the chunk starts on)
+    """
+    buffer = ""
+    consumed = 0        # Characters dropped from the front of the buffer
+    page_offsets = []   # Absolute offset where each page starts
+    page_numbers = []
+
+    def page_at(offset):
+        return page_numbers[max(bisect_right(page_offsets, consumed + offset) - 1, 0)]
+
+    for page_number, page_text in pages:
+        if not page_text:
+            continue
+        if buffer:
+            buffer += "\n\n"
+        page_offsets.append(consumed + len(buffer))
+        page_numbers.append(page_number)
+        buffer += page_text
+
+        if len(buffer) < 2 * chunk_size:
+            continue
+        # A window reaching the end of the buffer may still change; the last one always does
+        keep_from = 0
+        for window_start, window_end in chunk_windows(buffer, chunk_size, chunk_overlap):
+            if window_start + chunk_size >= len(buffer):
+                keep_from = window_start
+                break
+            chunk = buffer[window_start:window_end]
+            stripped = chunk.strip()
+            if stripped:
+                start = window_start + (len(chunk) - len(chunk.lstrip()))
+                yield stripped, page_at(start)
+        buffer = buffer[keep_from:]
+        consumed += keep_from
+
+    for start, end in chunk_spans(buffer, chunk_size, chunk_overlap):
+        yield buffer[start:end], page_at(start)
@@ -0,0 +1,91 @@
+"""
+In-memory cache of rerank scores, keyed by (model, normalized query, chunk ID).
+"""
+from config import RERANK_SCORE_CACHE_SIZE
+from utils.lru_cache import LRUCache
+from utils.embedding_cache import normalize_text
+
+
+def normalize_query(query):
+    """Collapse whitespace and case so near-identical follow-up queries share scores"""
+    return normalize_text(query).lower()
+
+
+class RerankScoreCache:
+    """
+    Bounded LRU cache of relevance scores of chunks for queries.
+
+    A score depends only on the model, the query and the chunk text, and a
+    chunk ID always names the same text until the chunk is deleted, so
+    deleting a document must invalidate its chunks here.
+    """
+    def __init__(self, max_entries=RERANK_SCORE_CACHE_SIZE):
+        """
+        Args:
+            max_entries (int): Scores kept before the least recently used are evicted
+        """
+        self._cache = LRUCache(max_entries=max_entries)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get_many(self, model, query, chunk_ids):
+        """
+        Look up cached scores.
+
+        Args:
+            model (str): Rerank model name
+            query (str): The user query
+            chunk_ids (list): Chunk IDs to look up. None is never cached.
+
+        Returns:
+            list: One score per chunk, or None where it is not cached
+        """
+        query = normalize_query(query)
+        return [self._cache.get((model, query, chunk_id)) if chunk_id is not None else None
+                for chunk_id in chunk_ids]
+
+    def put_many(self, model, query, chunk_ids, scores):
+        """
+        Store scores.
+
+        Args:
+            model (str): Rerank model name
+            query (str): The user query
+            chunk_ids (list): Chunk IDs that were scored. None entries are skipped.
+            scores (list): Their scores
+        """
+        query = normalize_query(query)
+        for chunk_id, score in zip(chunk_ids, scores):
+            if chunk_id is not None:
+                self._cache.put((model, query, chunk_id), score)
+
+    def invalidate_chunks(self, chunk_ids):
+        """
+        Drop every cached score of the given chunks.
+
+        Args:
+            chunk_ids (iterable): IDs of deleted chunks
+
+        Returns:
+            int: Number of scores dropped
+        """
+        chunk_ids = set(chunk_ids)
+        if not chunk_ids:
+            return 0
+        return self._cache.discard_where(lambda key: key[2] in chunk_ids)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """Hit, miss and eviction counters and current size"""
+        return self._cache.stats()
+
+
+_shared_cache = RerankScoreCache()
+
+
+def get_rerank_score_cache():
+    """Return the process-wide rerank score cache"""
+    return _shared_cache
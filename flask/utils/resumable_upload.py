@@ -0,0 +1,380 @@
+"""
+Resumable uploads of large files in numbered parts.
+
+A client creates an upload, PUTs its parts (in any order, in parallel,
+retrying or resuming after a dropped connection), then completes it. Each
+part is streamed straight to its offset in a preallocated file, so parts
+are assembled on disk as they arrive and no part is ever held in memory.
+Upload state is kept in a JSON file next to the data, so an interrupted
+upload can be resumed after a restart too.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from config import (
+    RESUMABLE_UPLOAD_FOLDER, RESUMABLE_PART_SIZE, RESUMABLE_MAX_UPLOAD_SIZE, RESUMABLE_UPLOAD_EXPIRY
+)
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A resumable upload request that cannot be carried out"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ResumableUploadManager:
+    """
+    Tracks resumable uploads under a folder, one subfolder per upload
+    holding the preallocated data file and its state.
+
+    The SHA-256 of the whole file is computed while parts arrive in order;
+    parts received out of order are read back once the parts before them
+    arrive, or on completion after a restart.
+
+    Only uploads in progress are kept in memory; finished and aborted ones
+    are read from their state file when asked about.
+    """
+    def __init__(self, root=RESUMABLE_UPLOAD_FOLDER, part_size=RESUMABLE_PART_SIZE,
+                 max_upload_size=RESUMABLE_MAX_UPLOAD_SIZE, expiry=RESUMABLE_UPLOAD_EXPIRY):
+        """
+        Args:
+            root (str): Folder holding in-progress uploads
+            part_size (int): Default part size in bytes
+            max_upload_size (int): Largest file accepted
+            expiry (float): Seconds after which an inactive upload is removed
+        """
+        self.root = root
+        self.part_size = part_size
+        self.max_upload_size = max_upload_size
+        self.expiry = expiry
+        self._uploads = {}  # Upload id -> state dict, while uploading or being processed here
+        self._digests = {}  # Upload id -> (running SHA-256, bytes hashed so far)
+        self._locks = {}    # Upload id -> lock serializing its state changes, while in use
+        self._receiving = {}  # Upload id -> {part number: token of the request currently writing it}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, upload_id):
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadError("Unknown upload", 404)
+        return os.path.join(self.root, upload_id)
+
+    def _data_path(self, upload_id):
+        return os.path.join(self._dir(upload_id), 'data.part')
+
+    @contextmanager
+    def _upload_lock(self, upload_id):
+        """Serialize changes to one upload. The lock is dropped again once the upload is no longer kept in memory."""
+        with self._lock:
+            lock = self._locks.setdefault(upload_id, threading.Lock())
+        with lock:
+            try:
+                yield
+            finally:
+                if upload_id not in self._uploads:
+                    with self._lock:
+                        if self._locks.get(upload_id) is lock:
+                            del self._locks[upload_id]
+                        self._digests.pop(upload_id, None)
+                        self._receiving.pop(upload_id, None)
+
+    def _load(self, upload_id):
+        """State of an upload, read from disk if it is not in memory (caller holds its lock)"""
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            state_path = os.path.join(self._dir(upload_id), 'upload.json')
+            try:
+                with open(state_path, 'r') as f:
+                    upload = json.load(f)
+            except (OSError, ValueError):
+                raise UploadError("Unknown upload", 404)
+            if upload['status'] == 'uploading':
+                # Uploads completed by an earlier process are only read
+                self._uploads[upload_id] = upload
+        return upload
+
+    def _save(self, upload):
+        """Persist an upload's state atomically"""
+        upload['updated'] = time.time()
+        state_path = os.path.join(self._dir(upload['upload_id']), 'upload.json')
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(upload, f)
+        os.replace(tmp_path, state_path)
+
+    def create(self, filename, total_size, part_size=None, metadata=None):
+        """
+        Start an upload.
+
+        Args:
+            filename (str): Name of the file being uploaded
+            total_size (int): Size of the file in bytes
+            part_size (int, optional): Bytes per part; every part but the last must have exactly this size
+            metadata (dict, optional): Caller data kept with the upload, e.g. session and file type
+
+        Returns:
+            dict: The upload's state
+        """
+        part_size = int(part_size or self.part_size)
+        total_size = int(total_size)
+        if total_size <= 0 or total_size > self.max_upload_size:
+            raise UploadError(f"Upload size must be between 1 and {self.max_upload_size} bytes", 413)
+        if part_size <= 0 or part_size > self.part_size:
+            raise UploadError(f"Part size must be between 1 and {self.part_size} bytes")
+
+        self.remove_expired()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._dir(upload_id))
+        # Preallocated, so every part can be written at its offset on arrival
+        with open(self._data_path(upload_id), 'wb') as f:
+            f.truncate(total_size)
+
+        upload = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'total_size': total_size,
+            'part_size': part_size,
+            'part_count': (total_size + part_size - 1) // part_size,
+            'parts': {},            # Part number -> SHA-256 of the part
+            'status': 'uploading',  # uploading -> processing -> done / failed
+            'created': time.time(),
+            'metadata': metadata or {}
+        }
+        with self._upload_lock(upload_id):
+            self._uploads[upload_id] = upload
+            self._digests[upload_id] = (hashlib.sha256(), 0)
+            self._save(upload)
+        return upload
+
+    def _part_range(self, upload, part_number):
+        if not 0 <= part_number < upload['part_count']:
+            raise UploadError(f"Part number must be between 0 and {upload['part_count'] - 1}")
+        start = part_number * upload['part_size']
+        return start, min(start + upload['part_size'], upload['total_size'])
+
+    def write_part(self, upload_id, part_number, stream, content_length):
+        """
+        Write one part, streaming it to its place in the data file.
+
+        The body is read without holding the upload's lock, which is only
+        taken to check the upload's state, to write each block and to
+        record the part, so status requests, retries and other parts are
+        not held up by a slow client. Re-sending a part overwrites it: the
+        part counts as missing until the new transfer completes, and an
+        earlier transfer of it still running stops writing.
+
+        Args:
+            upload_id (str): Upload ID
+            part_number (int): 0-based part number
+            stream: Readable body of the part
+            content_length (int): Declared length of the body
+
+        Returns:
+            dict: The upload's state
+        """
+        token = object()
+        with self._upload_lock(upload_id):
+            upload = self._load(upload_id)
+            if upload['status'] != 'uploading':
+                raise UploadError("Upload is already complete", 409)
+            start, end = self._part_range(upload, part_number)
+            if content_length != end - start:
+                raise UploadError(f"Part {part_number} must be {end - start} bytes, got {content_length}")
+
+            digest, hashed = self._digests.get(upload_id, (None, 0))
+            if upload['parts'].pop(str(part_number), None) is not None:
+                if start < hashed:
+                    # Re-sent a part already hashed; hash the file on completion instead
+                    digest, hashed = self._digests[upload_id] = (None, 0)
+                self._save(upload)
+            self._receiving.setdefault(upload_id, {})[part_number] = token
+
+            # A part continuing the running file hash is hashed as it is written
+            running = digest.copy() if digest is not None and start == hashed else None
+            f = open(self._data_path(upload_id), 'r+b')
+
+        try:
+            part_digest = hashlib.sha256()
+            written = 0
+            with f:
+                f.seek(start)
+                while written < end - start:
+                    block = stream.read(min(STREAM_BLOCK_SIZE, end - start - written))
+                    if not block:
+                        break
+                    with self._upload_lock(upload_id):
+                        self._check_receiving(upload, part_number, token)
+                        f.write(block)
+                    part_digest.update(block)
+                    if running is not None:
+                        running.update(block)
+                    written += len(block)
+
+            with self._upload_lock(upload_id):
+                self._check_receiving(upload, part_number, token)
+                if written != end - start:
+                    # The part's bytes on disk are partial; it must be sent again
+                    raise UploadError(f"Part {part_number} ended after {written} of {end - start} bytes")
+
+                upload['parts'][str(part_number)] = part_digest.hexdigest()
+                current, hashed = self._digests.get(upload_id, (None, 0))
+                if current is not None and hashed == start:
+                    # The hash cannot move past a missing part, so an unchanged position means an unchanged hash
+                    if running is not None and current is digest:
+                        self._digests[upload_id] = (running, end)
+                    self._advance_digest(upload)
+                self._save(upload)
+                return upload
+        finally:
+            with self._upload_lock(upload_id):
+                receiving = self._receiving.get(upload_id, {})
+                if receiving.get(part_number) is token:
+                    del receiving[part_number]
+                    if not receiving:
+                        self._receiving.pop(upload_id, None)
+
+    def _check_receiving(self, upload, part_number, token):
+        """Raise unless this request is still the one writing the part (caller holds the upload's lock)"""
+        upload_id = upload['upload_id']
+        if self._uploads.get(upload_id) is not upload:
+            raise UploadError("Upload was aborted or expired", 409)
+        if self._receiving.get(upload_id, {}).get(part_number) is not token:
+            raise UploadError(f"Part {part_number} is being sent again by another request", 409)
+
+    def _advance_digest(self, upload):
+        """Extend the running file hash over parts received earlier out of order"""
+        upload_id = upload['upload_id']
+        digest, hashed = self._digests[upload_id]
+        with open(self._data_path(upload_id), 'rb') as f:
+            while hashed < upload['total_size'] and str(hashed // upload['part_size']) in upload['parts']:
+                start, end = self._part_range(upload, hashed // upload['part_size'])
+                f.seek(start)
+                remaining = end - start
+                while remaining:
+                    block = f.read(min(STREAM_BLOCK_SIZE, remaining))
+                    digest.update(block)
+                    remaining -= len(block)
+                hashed = end
+        self._digests[upload_id] = (digest, hashed)
+
+    def status(self, upload_id):
+        """
+        State of an upload, including the parts still missing.
+
+        Args:
+            upload_id (str): Upload ID
+
+        Returns:
+            dict: The upload's state plus 'missing_parts'
+        """
+        with self._upload_lock(upload_id):
+            upload = dict(self._load(upload_id))
+            upload['parts'] = dict(upload['parts'])
+        upload['missing_parts'] = [n for n in range(upload['part_count']) if str(n) not in upload['parts']]
+        return upload
+
+    def complete(self, upload_id, destination):
+        """
+        Finish an upload and move the assembled file to its destination.
+
+        Args:
+            upload_id (str): Upload ID
+            destination (str): Path to store the file at
+
+        Returns:
+            str: SHA-256 of the file
+        """
+        with self._upload_lock(upload_id):
+            upload = self._load(upload_id)
+            if upload['status'] != 'uploading':
+                raise UploadError("Upload is already complete", 409)
+            missing = [n for n in range(upload['part_count']) if str(n) not in upload['parts']]
+            if missing:
+                raise UploadError(f"Upload is missing {len(missing)} parts, starting with part {missing[0]}", 409)
+
+            digest, hashed = self._digests.pop(upload_id, (None, 0))
+            if digest is None:
+                digest, hashed = hashlib.sha256(), 0
+            # Parts hashed in order already; read back only the rest
+            with open(self._data_path(upload_id), 'rb') as f:
+                f.seek(hashed)
+                for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b""):
+                    digest.update(block)
+            file_hash = digest.hexdigest()
+
+            os.replace(self._data_path(upload_id), destination)
+            upload['status'] = 'processing'
+            upload['file_hash'] = file_hash
+            upload['path'] = destination
+            self._save(upload)
+            return file_hash
+
+    def finish(self, upload_id, document_id=None, error=None):
+        """
+        Record the outcome of processing a completed upload.
+
+        Args:
+            upload_id (str): Upload ID
+            document_id (str, optional): Document created from the file
+            error (str, optional): Why processing failed
+        """
+        with self._upload_lock(upload_id):
+            upload = self._load(upload_id)
+            upload['status'] = 'failed' if error else 'done'
+            upload['document_id'] = document_id
+            upload['error'] = error
+            self._save(upload)
+            self._uploads.pop(upload_id, None)
+
+    def abort(self, upload_id):
+        """
+        Cancel an upload and delete its data.
+
+        Args:
+            upload_id (str): Upload ID
+        """
+        with self._upload_lock(upload_id):
+            self._load(upload_id)
+            self._remove(upload_id)
+
+    def _remove(self, upload_id):
+        self._uploads.pop(upload_id, None)
+        self._digests.pop(upload_id, None)
+        self._receiving.pop(upload_id, None)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def remove_expired(self):
+        """
+        Delete uploads that have not changed for longer than the expiry.
+
+        Uploads this process is still processing are kept however long
+        that takes.
+
+        Returns:
+            int: Number of uploads removed
+        """
+        removed = 0
+        cutoff = time.time() - self.expiry
+        for upload_id in os.listdir(self.root):
+            try:
+                state_path = os.path.join(self._dir(upload_id), 'upload.json')
+                if os.path.getmtime(state_path) >= cutoff:
+                    continue
+                with self._upload_lock(upload_id):
+                    upload = self._uploads.get(upload_id)
+                    if upload is not None and upload['status'] == 'processing':
+                        continue
+                    self._remove(upload_id)
+                removed += 1
+            except (OSError, UploadError):
+                continue
+        return removed
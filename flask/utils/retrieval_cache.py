@@ -0,0 +1,82 @@
+"""
+Cache of retrieval responses, invalidated through content generation counters.
+"""
+import threading
+
+from config import RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL
+from utils.lru_cache import LRUCache
+from utils.embedding_cache import normalize_text
+
+
+class ContentGenerations:
+    """
+    Counters bumped whenever a session or document gains or loses content.
+
+    Cached results carry the counters of the scope they were computed for
+    in their key, so a bump makes them unreachable without scanning the
+    cache; the stale entries age out of the LRU.
+    """
+    def __init__(self):
+        self._global = 0
+        self._sessions = {}   # Session id -> generation
+        self._documents = {}  # Document id -> generation
+        self._lock = threading.Lock()
+
+    def bump(self, session_id=None, document_id=None):
+        """
+        Record a change to a document and the session it belongs to.
+
+        Args:
+            session_id (str, optional): Session that changed
+            document_id (str, optional): Document that changed
+        """
+        with self._lock:
+            self._global += 1
+            if session_id:
+                self._sessions[session_id] = self._sessions.get(session_id, 0) + 1
+            if document_id:
+                self._documents[document_id] = self._documents.get(document_id, 0) + 1
+
+    def current(self, session_id=None, document_id=None):
+        """
+        Generation of the content visible to a query with these filters.
+
+        Args:
+            session_id (str, optional): Session filter
+            document_id (str, optional): Document filter
+
+        Returns:
+            tuple: Counters that change whenever that content changes
+        """
+        with self._lock:
+            if not session_id and not document_id:
+                return (self._global,)
+            return (self._sessions.get(session_id, 0) if session_id else None,
+                    self._documents.get(document_id, 0) if document_id else None)
+
+
+def retrieval_cache_key(endpoint, query, k, mode=None, filters=None, generation=None):
+    """
+    Cache key of a retrieval request.
+
+    Args:
+        endpoint (str): Endpoint the payload is built for
+        query (str): Search query
+        k (int): Number of results
+        mode (str, optional): Retrieval mode (and fusion method)
+        filters (dict, optional): Filters applied to the search
+        generation (tuple, optional): Content generation of the filtered scope
+
+    Returns:
+        tuple: Hashable key
+    """
+    filters = tuple(sorted((filters or {}).items()))
+    return (endpoint, normalize_text(query), k, mode, filters, generation)
+
+
+_retrieval_cache = LRUCache(max_entries=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+
+
+def get_retrieval_cache():
+    """Return the process-wide cache of serialized retrieval responses"""
+    return _retrieval_cache
@@ -10,9 +10,17 @@ class SessionManager:
     Manages user sessions for the notebook application.
     Handles session creation, retrieval, and expiration.
     """
-    def __init__(self, session_dir='sessions'):
+    def __init__(self, session_dir='sessions', on_session_expired=None):
+        """
+        Args:
+            session_dir (str): Directory the session files are stored in
+            on_session_expired (callable, optional): Called with the session ID when an
+                expired session is cleaned up, e.g. to free its documents
+        """
         self.session_dir = session_dir
         self.sessions = {}  # In-memory cache of sessions
+        self.on_session_expired = on_session_expired
+        self.expired_session_ids = []  # Expired sessions found on disk at startup
 
         # Create sessions directory if it doesn't exist
         os.makedirs(session_dir, exist_ok=True)
@@ -29,8 +37,9 @@ class SessionManager:
                     with open(os.path.join(self.session_dir, filename), 'r') as f:
                         session_data = json.load(f)
 
-                    # Skip expired sessions
+                    # Skip expired sessions, cleaning them up later
                     if self._is_expired(session_data):
+                        self.expired_session_ids.append(session_id)
                         continue
 
                     self.sessions[session_id] = session_data
@@ -93,7 +102,7 @@ class SessionManager:
 
         if session and self._is_expired(session):
             # Remove expired session
-            self.delete_session(session_id)
+            self._expire_session(session_id)
             return None
 
         if session:
@@ -282,11 +291,35 @@ class SessionManager:
 
         for session_id in session_ids:
             if self._is_expired(self.sessions[session_id]):
-                self.delete_session(session_id)
+                self._expire_session(session_id)
                 expired_count += 1
 
+        # Sessions that had already expired when they were loaded
+        for session_id in self.expired_session_ids:
+            session_path = os.path.join(self.session_dir, f"{session_id}.json")
+            if os.path.exists(session_path):
+                try:
+                    os.remove(session_path)
+                except Exception as e:
+                    print(f"Error deleting session file {session_id}: {e}")
+            self._notify_expired(session_id)
+            expired_count += 1
+        self.expired_session_ids = []
+
         return expired_count
 
+    def _expire_session(self, session_id):
+        """Delete an expired session and notify the expiry callback"""
+        self.delete_session(session_id)
+        self._notify_expired(session_id)
+
+    def _notify_expired(self, session_id):
+        if self.on_session_expired:
+            try:
+                self.on_session_expired(session_id)
+            except Exception as e:
+                print(f"Error cleaning up expired session {session_id}: {e}")
+
 # Test functionality if this file is run directly
 if __name__ == "__main__":
     import os
@@ -0,0 +1,259 @@
+"""
+Single-pass upload handling: files are hashed while the request body is
+received and written to disk once.
+
+Werkzeug normally spools each uploaded file to a temporary file, and the
+endpoint then copies it to its destination and reads it back to hash it.
+StreamingRequest instead spools straight into the upload folder through
+a HashingSpoolFile, so saving is a rename and the SHA-256 is known as
+soon as the body has arrived.
+"""
+import os
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+from flask import Request
+from werkzeug.utils import cached_property
+
+from config import UPLOAD_SPOOL_FOLDER, UPLOAD_INDEX_PATH
+
+CONTENT_HASH_HEADER = 'X-Content-SHA256'
+
+
+class HashingSpoolFile:
+    """
+    Writable spool file that hashes everything written to it.
+
+    With an `expected_hash`, nothing is written to disk: the data is only
+    hashed, to confirm that an upload matches content already stored.
+    """
+    def __init__(self, directory=UPLOAD_SPOOL_FOLDER, expected_hash=None):
+        """
+        Args:
+            directory (str): Folder of the spool file, on the same filesystem as the upload folders
+            expected_hash (str, optional): SHA-256 of stored content the data should match; hash without storing
+        """
+        self.expected_hash = expected_hash
+        self.verify_only = expected_hash is not None
+        self.size = 0
+        self.claimed = False
+        self._digest = hashlib.sha256()
+        if self.verify_only:
+            self.path = None
+            self._file = None
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload_', suffix='.part', delete=False)
+            self.path = self._file.name
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        if self._file is not None:
+            return self._file.write(data)
+        return len(data)
+
+    def hexdigest(self):
+        """SHA-256 of the data written so far"""
+        return self._digest.hexdigest()
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence) if self._file is not None else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if self._file is not None else b""
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def discard(self):
+        """Remove the spool file unless it was moved to its destination"""
+        self.close()
+        if not self.claimed and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        if self._file is None:
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+
+class UploadIndex:
+    """
+    SQLite index of stored uploads by content hash, used to recognise a
+    re-upload before its body has been received.
+    """
+    def __init__(self, path=UPLOAD_INDEX_PATH):
+        """
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " file_hash TEXT PRIMARY KEY,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, file_hash):
+        """
+        Path of a stored upload with this content.
+
+        Args:
+            file_hash (str): SHA-256 of the content
+
+        Returns:
+            str: Path of the stored file, or None if none is stored (or it was since deleted)
+        """
+        with self._lock:
+            row = self._db.execute("SELECT path, size, mtime FROM uploads WHERE file_hash = ?",
+                                   (file_hash,)).fetchone()
+        if row is None:
+            return None
+        path, size, mtime = row
+        # A file replaced since it was recorded no longer holds this content
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return None
+        return path
+
+    def put(self, file_hash, path):
+        """Record where an upload with this content is stored"""
+        stat = os.stat(path)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)",
+                             (file_hash, os.path.abspath(path), stat.st_size, stat.st_mtime))
+            self._db.commit()
+
+
+_upload_index = None
+_upload_index_lock = threading.Lock()
+
+
+def get_upload_index():
+    """
+    Return the process-wide upload index, opening it on first use.
+
+    Returns:
+        UploadIndex: The shared index
+    """
+    global _upload_index
+    if _upload_index is None:
+        with _upload_index_lock:
+            if _upload_index is None:
+                _upload_index = UploadIndex()
+    return _upload_index
+
+
+class StreamingRequest(Request):
+    """
+    Request whose uploaded files are spooled through HashingSpoolFiles.
+
+    A client that sends the content's SHA-256 in the X-Content-SHA256
+    header lets the server decide before the body arrives: if that content
+    is already stored, the body is only hashed to confirm it, not written.
+    The header holds one comma-separated hash per file part, in the order
+    the parts are sent; an empty entry, or a part beyond the list, has no
+    hash and is stored as usual.
+    """
+    @cached_property
+    def upload_spools(self):
+        """Spool files created for this request, discarded at teardown unless saved"""
+        return []
+
+    @cached_property
+    def claimed_hashes(self):
+        """Hashes from the X-Content-SHA256 header, by file part"""
+        return [claimed.strip().lower() for claimed in self.headers.get(CONTENT_HASH_HEADER, '').split(',')]
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Called once per file part, in order
+        part = len(self.upload_spools)
+        claimed_hash = self.claimed_hashes[part] if part < len(self.claimed_hashes) else ''
+        known = bool(claimed_hash) and get_upload_index().get(claimed_hash) is not None
+        spool = HashingSpoolFile(expected_hash=claimed_hash if known else None)
+        self.upload_spools.append(spool)
+        return spool
+
+
+def _link_or_copy(source, destination):
+    """Make destination a copy of source, by hard link where the filesystem allows"""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    tmp_path = destination + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def save_upload(file, destination):
+    """
+    Move an uploaded file to its destination and return its content hash.
+
+    Spooled uploads are renamed into place; an upload that matched stored
+    content is linked to the stored copy instead. Uploads that were not
+    spooled (e.g. outside a StreamingRequest) are copied while hashing.
+
+    Args:
+        file (FileStorage): The uploaded file
+        destination (str): Path to store it at
+
+    Returns:
+        str: SHA-256 of the content
+
+    Raises:
+        ValueError: If the body does not match the X-Content-SHA256 it was sent with
+    """
+    spool = file.stream
+    if isinstance(spool, HashingSpoolFile):
+        file_hash = spool.hexdigest()
+        if spool.verify_only:
+            if file_hash != spool.expected_hash:
+                raise ValueError(f"Uploaded content does not match its {CONTENT_HASH_HEADER} header")
+            existing = get_upload_index().get(file_hash)
+            if existing is None:
+                raise ValueError("The stored copy of this upload was removed while receiving it; upload it again")
+            print(f"Upload matches stored file {existing}, skipping the write")
+            _link_or_copy(existing, destination)
+        else:
+            spool.close()
+            os.replace(spool.path, destination)
+            spool.claimed = True
+    else:
+        digest = hashlib.sha256()
+        # Written beside the destination and renamed, never in place: the
+        # destination may be a hard link shared with another upload
+        tmp_path = destination + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for block in iter(lambda: file.stream.read(1024 * 1024), b""):
+                digest.update(block)
+                f.write(block)
+        os.replace(tmp_path, destination)
+        file_hash = digest.hexdigest()
+
+    get_upload_index().put(file_hash, destination)
+    return file_hash
+
+
+def discard_spools(request):
+    """Remove the spool files of a request that were not saved"""
+    for spool in request.__dict__.get('upload_spools', ()):
+        spool.discard()